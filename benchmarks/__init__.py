@@ -0,0 +1,5 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmarks for Entity-fishing component (run against a local mock server).
+"""
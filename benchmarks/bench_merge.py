@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+
+"""bench_merge.py
+
+Microbenchmark of the post-processing of a document (no HTTP): "nil clustering"
+of the first-pass response and merge of the two passes, for documents with
+10 to 10k entities. The time per entity should stay flat (linear time).
+
+Usage:
+    python -m benchmarks.bench_merge --entities 10 100 1000 10000
+"""
+
+import argparse
+import time
+
+from typing import List, Tuple
+
+from spacy.tokens import Doc, Span
+
+from tests.corpus import MENTIONS, make_nlp
+from tests.mock_server import fake_qid
+
+
+def make_doc(nlp, n_entities: int) -> Tuple[Doc, dict, list]:
+    """
+    It builds a document with `n_entities` single-word entities, a first-pass response
+    linking 4 entities out of 5, and the second-pass entities of the others.
+
+    :return: the document, the first-pass response and the second-pass entities.
+    """
+    words = []
+    for idx in range(n_entities):
+        words.extend([MENTIONS[idx % len(MENTIONS)][1].split()[0], "and"])
+    doc = Doc(nlp.vocab, words=words)
+    doc.ents = [Span(doc, 2 * idx, 2 * idx + 1, label="MISC") for idx in range(n_entities)]
+
+    entities_from_text, entities_from_terms = [], []
+    for idx, ent in enumerate(doc.ents):
+        entity = {"rawName": ent.text, "offsetStart": ent.start_char, "offsetEnd": ent.end_char,
+                  "wikidataId": f"Q{fake_qid(ent.text)}", "wikipediaExternalRef": idx,
+                  "confidence_score": 0.5}
+        (entities_from_terms if idx % 5 == 0 else entities_from_text).append(entity)
+    return doc, {"text": doc.text, "entities": entities_from_text}, entities_from_terms
+
+
+def run(sizes: List[int], repeat: int) -> List[dict]:
+    """
+    It times the post-processing of a document of each size (best of `repeat` runs).
+
+    :return: a list of results (one per size).
+    """
+    nlp = make_nlp()
+    linker = nlp.get_pipe("entityfishing")
+    results = []
+    for n_entities in sizes:
+        doc, response, entities_from_terms = make_doc(nlp, n_entities)
+        metadata = {"status_code": 200, "ok": True}
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            nil_clustering = linker.passes.attach_text_result(doc, (response, metadata, response["entities"]))
+            entities = linker.passes.attach_terms_result(doc, response["entities"],
+                                                         ({}, metadata, entities_from_terms))
+            linker.updated_entities(doc, entities)
+            best = min(best, time.perf_counter() - start)
+        results.append({
+            "entities": n_entities,
+            "nil_clustering": len(nil_clustering),
+            "milliseconds": round(best * 1000, 3),
+            "microseconds_per_entity": round(best * 1e6 / n_entities, 2),
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for result in run(args.entities, args.repeat):
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+
+"""bench_multiprocess.py
+
+Throughput benchmark of the whole pipeline (entity ruler + `entityfishing`)
+with `nlp.pipe(texts, n_process=N)` against the local mock server.
+
+Usage:
+    python -m benchmarks.bench_multiprocess --docs 2000 --processes 1 2 4 --latency 0.02
+"""
+
+import argparse
+import time
+
+from typing import List
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+def run(n_docs: int, processes: List[int], batch_size: int, latency: float, jitter: float,
+        max_workers: int) -> List[dict]:
+    """
+    It runs `nlp.pipe` over a synthetic corpus with each number of processes
+    and returns throughput figures (speedup relative to the first run).
+
+    :return: a list of results (one per number of processes).
+    """
+    texts = make_texts(n_docs)
+    results = []
+    with MockEntityFishingServer(latency=latency, jitter=jitter, seed=0) as server:
+        nlp = make_nlp(api_ef_base=server.url,
+                       client={"max_workers": max_workers, "pool_maxsize": max_workers})
+        for n_process in processes:
+            start = time.perf_counter()
+            docs = list(nlp.pipe(texts, batch_size=batch_size, n_process=n_process))
+            elapsed = time.perf_counter() - start
+            failed = sum(1 for doc in docs if not doc._.metadata["disambiguation_text_service"]["ok"])
+            results.append({
+                "n_process": n_process,
+                "seconds": round(elapsed, 3),
+                "docs_per_second": round(n_docs / elapsed, 1),
+                "speedup": round(results[0]["seconds"] / elapsed, 2) if results else 1.0,
+                "failed_docs": failed,
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
+    for result in run(args.docs, args.processes, args.batch_size, args.latency, args.jitter, args.max_workers):
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+
+"""bench_pipe.py
+
+Throughput benchmark of `EntityFishing.pipe` against the local mock server.
+
+Usage:
+    python -m benchmarks.bench_pipe --docs 1000 --batch-size 128 --latency 0.02 --jitter 0.05
+"""
+
+import argparse
+import time
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+def run(n_docs: int, batch_size: int, latency: float, jitter: float, error_rate: float) -> dict:
+    """
+    It runs `nlp.pipe` over a synthetic corpus and returns throughput figures.
+    Every document is also checked to carry its own response (order preserved).
+
+    :return: a dictionary of results.
+    """
+    texts = make_texts(n_docs)
+    with MockEntityFishingServer(latency=latency, jitter=jitter, error_rate=error_rate, seed=0) as server:
+        nlp = make_nlp(api_ef_base=server.url)
+        start = time.perf_counter()
+        docs = list(nlp.pipe(texts, batch_size=batch_size))
+        elapsed = time.perf_counter() - start
+        n_requests = server.request_count
+
+    misaligned = sum(
+        1 for doc in docs
+        if doc._.annotations.get("disambiguation_text_service", {}).get("text", doc.text) != doc.text
+    )
+    failed = sum(1 for doc in docs if not doc._.metadata["disambiguation_text_service"]["ok"])
+    return {
+        "docs": n_docs,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(n_docs / elapsed, 1),
+        "requests": n_requests,
+        "failed_docs": failed,
+        "misaligned_docs": misaligned,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    print(run(args.docs, args.batch_size, args.latency, args.jitter, args.error_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# -*- coding: UTF-8 -*-
+
+"""suite.py
+
+Benchmark suite of the `entityfishing` component against the local mock
+server: scenarios covering `__call__`, `pipe` at several batch sizes, long
+documents, entity-dense documents and `extra_info`. Each scenario runs in a
+fresh process and reports docs/s, p50/p99 latency (of each call or batch and
+of each request), CPU time and peak memory; results can be saved as a
+baseline and compared to it to catch regressions.
+
+Usage:
+    python -m benchmarks.suite --docs 500 --latency 0.01 --save-baseline baseline.json
+    python -m benchmarks.suite --docs 500 --latency 0.01 --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from tests.corpus import make_dense_texts, make_long_texts, make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+# name: (mode, batch size, texts of a run of `n_docs` documents, configuration of the component)
+SCENARIOS: Dict[str, tuple] = {
+    "call": ("call", 1, lambda n_docs: make_texts(n_docs), {}),
+    "pipe_16": ("pipe", 16, lambda n_docs: make_texts(n_docs), {}),
+    "pipe_128": ("pipe", 128, lambda n_docs: make_texts(n_docs), {}),
+    "pipe_512": ("pipe", 512, lambda n_docs: make_texts(n_docs), {}),
+    "pipe_streaming": ("pipe", 128, lambda n_docs: make_texts(n_docs), {"client": {"streaming_window": 64}}),
+    "long_docs": ("pipe", 8, lambda n_docs: make_long_texts(max(1, n_docs // 50)), {}),
+    "long_docs_chunked": ("pipe", 8, lambda n_docs: make_long_texts(max(1, n_docs // 50)),
+                          {"queries": {"chunk_size": 2000, "chunk_boundary": "paragraph"}}),
+    "dense": ("pipe", 128, lambda n_docs: make_dense_texts(max(1, n_docs // 5), n_mentions=100), {}),
+    "extra_info": ("pipe", 128, lambda n_docs: make_texts(n_docs), {"extra_info": True}),
+    "extra_info_lookup": ("pipe", 128, lambda n_docs: make_texts(n_docs),
+                          {"extra_info": True, "cache": {"concept_lookup": True}}),
+    "extra_info_json_gzip": ("pipe", 128, lambda n_docs: make_texts(n_docs),
+                             {"extra_info": True,
+                              "client": {"request_format": "json", "request_compression": "gzip"}}),
+}
+
+# Metrics compared to the baseline: name -> True if higher is better.
+COMPARED = {"docs_per_second": True, "latency_p99": False, "request_latency_p99": False,
+            "cpu_seconds_per_doc": False, "peak_rss_mb": False}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    It computes a percentile of samples (nearest rank).
+
+    :param values: the samples
+    :type values: List[float]
+    :param q: the percentile (between 0 and 100)
+    :type q: float
+    :return: the percentile, None without samples.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """It returns the peak resident memory of the process in MB (None if unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scenario(name: str, server_url: str, n_docs: int) -> dict:
+    """
+    It runs a scenario (in the current process) and measures it.
+
+    :param name: the name of the scenario (cf. `SCENARIOS`)
+    :type name: str
+    :param server_url: base url of the mock server
+    :type server_url: str
+    :param n_docs: number of documents of the scenario (scaled down for long and dense documents)
+    :type n_docs: int
+    :return: the results of the scenario.
+    """
+    mode, batch_size, make, config = SCENARIOS[name]
+    texts = make(n_docs)
+    nlp = make_nlp(api_ef_base=server_url, **config)
+    linker = nlp.get_pipe("entityfishing")
+    # warm-up (connections, lazy initialisation), not measured
+    nlp(texts[0])
+    linker.metrics.reset()
+    durations = []
+    linker.metrics.add_hook(lambda event, data: durations.append(data["duration"]) if event == "batch" else None)
+
+    cpu_start, start = time.process_time(), time.perf_counter()
+    if mode == "call":
+        docs = [nlp(text) for text in texts]
+    else:
+        docs = list(nlp.pipe(texts, batch_size=batch_size))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    stats = linker.stats["metrics"]
+    request_latency = [histogram["p99"] for histogram in stats.get("request_latency", {}).values()]
+    request_p50 = [histogram["p50"] for histogram in stats.get("request_latency", {}).values()]
+    return {
+        "scenario": name,
+        "docs": len(docs),
+        "entities": sum(len(doc.ents) for doc in docs),
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(len(docs) / elapsed, 1),
+        "latency_p50": round(statistics.median(durations), 4),
+        "latency_p99": round(percentile(durations, 99), 4),
+        "request_latency_p50": round(max(request_p50), 4) if request_p50 else None,
+        "request_latency_p99": round(max(request_latency), 4) if request_latency else None,
+        "requests": sum(stats.get("requests", {}).values()),
+        "bytes_sent": sum(stats.get("bytes_sent", {}).values()),
+        "bytes_received": sum(stats.get("bytes_received", {}).values()),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_seconds_per_doc": round(cpu / len(docs), 6),
+        "peak_rss_mb": peak_rss_mb(),
+        "failed_docs": sum(1 for doc in docs if not doc._.metadata["disambiguation_text_service"]["ok"]),
+    }
+
+
+def run(names: List[str], n_docs: int, latency: float, jitter: float, error_rate: float,
+        payload_padding: int, isolated: bool = True, compress_responses: bool = False) -> List[dict]:
+    """
+    It runs scenarios against a mock server (each in a fresh process if `isolated`, so that
+    CPU time and peak memory are those of the scenario only), that gzips its responses if
+    `compress_responses`.
+
+    :return: the results of the scenarios.
+    """
+    results = []
+    with MockEntityFishingServer(latency=latency, jitter=jitter, error_rate=error_rate, seed=0,
+                                 payload_padding=payload_padding, compress_responses=compress_responses) as server:
+        for name in names:
+            if not isolated:
+                results.append(run_scenario(name, server.url, n_docs))
+                continue
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results.append(executor.submit(run_scenario, name, server.url, n_docs).result())
+    return results
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    It compares results to a baseline: a metric worse than the baseline by more than
+    `tolerance` (relative) is a regression.
+
+    :param results: the results of the scenarios
+    :type results: List[dict]
+    :param baseline: the results of the baseline
+    :type baseline: List[dict]
+    :param tolerance: relative tolerance (eg. 0.1 for 10%)
+    :type tolerance: float
+    :return: the regressions (one message each).
+    """
+    regressions = []
+    baseline = {result["scenario"]: result for result in baseline}
+    for result in results:
+        reference = baseline.get(result["scenario"])
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            value, expected = result.get(metric), reference.get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{result['scenario']}: {metric} {expected} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def print_table(results: List[dict], write: Callable[[str], None] = print) -> None:
+    """It prints the main figures of each scenario."""
+    columns = ["scenario", "docs", "docs_per_second", "latency_p50", "latency_p99",
+               "request_latency_p99", "requests", "bytes_sent", "bytes_received", "cpu_seconds", "peak_rss_mb",
+               "failed_docs"]
+    write(" | ".join(columns))
+    for result in results:
+        write(" | ".join(str(result.get(column)) for column in columns))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--payload-padding", type=int, default=0)
+    parser.add_argument("--compress-responses", action="store_true", help="gzip the responses of the mock server")
+    parser.add_argument("--baseline", help="JSON file of results to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.scenarios, args.docs, args.latency, args.jitter, args.error_rate, args.payload_padding,
+                  compress_responses=args.compress_responses)
+    print_table(results)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,7 +33,11 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/Lucaterre/spacyfishing",
     install_requires=install_requires,
-    packages=find_packages(),
+    extras_require={"async": ["httpx>=0.23"],
+                    "fast": ["orjson>=3.6"],
+                    "prometheus": ["prometheus-client>=0.12"],
+                    "opentelemetry": ["opentelemetry-api>=1.12"]},
+    packages=find_packages(exclude=["tests*", "benchmarks*"]),
     classifiers=CLASSIFIERS,
     python_requires='>=3.7',
     entry_points={
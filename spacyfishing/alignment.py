@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+
+"""alignment.py
+
+Resolution of the character offsets of the entities of a response to
+token spans: an index of the character offsets of the tokens of a `Doc`
+is built once and all the offsets of a response are resolved at once,
+with the alignment modes of `Doc.char_span` ("strict", "contract",
+"expand") to recover the entities whose offsets do not match tokens.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy
+
+from spacy.attrs import IDX, LENGTH
+from spacy.tokens import Doc
+
+ALIGNMENT_MODES = ("strict", "contract", "expand")
+
+# First and last tokens of offsets, and whether the offsets are aligned.
+Bounds = Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+
+
+class CharIndex:
+    """Character offsets of the tokens of a document."""
+
+    def __init__(self, doc: Doc):
+        """
+        `CharIndex` indexes the start and end character offsets of the tokens of `doc`.
+
+        Parameters:
+            doc (Doc): the document.
+
+        Attributes:
+            starts (numpy.ndarray): start character offset of each token (sorted).
+            ends (numpy.ndarray): end character offset of each token (sorted).
+        """
+        bounds = doc.to_array([IDX, LENGTH]).astype("int64").reshape(-1, 2)
+        self.starts = bounds[:, 0]
+        self.ends = bounds[:, 0] + bounds[:, 1]
+
+    def strict(self, char_starts: numpy.ndarray, char_ends: numpy.ndarray) -> Bounds:
+        """
+        It resolves character offsets on token boundaries (`alignment_mode="strict"`).
+
+        :param char_starts: start character offsets
+        :type char_starts: numpy.ndarray
+        :param char_ends: end character offsets
+        :type char_ends: numpy.ndarray
+        :return: the first and last tokens of each offsets, and whether they are aligned.
+        """
+        first = numpy.searchsorted(self.starts, char_starts, side="left")
+        last = numpy.searchsorted(self.ends, char_ends, side="left")
+        valid = (first < len(self.starts)) & (last < len(self.starts))
+        valid[valid] &= ((self.starts[first[valid]] == char_starts[valid])
+                         & (self.ends[last[valid]] == char_ends[valid]))
+        return first, last, valid
+
+    def contract(self, char_starts: numpy.ndarray, char_ends: numpy.ndarray) -> Bounds:
+        """
+        It resolves character offsets to the tokens inside them (`alignment_mode="contract"`).
+
+        :param char_starts: start character offsets
+        :type char_starts: numpy.ndarray
+        :param char_ends: end character offsets
+        :type char_ends: numpy.ndarray
+        :return: the first and last tokens of each offsets, and whether they are aligned.
+        """
+        # tokens starting at or after the start and ending at or before the end
+        first = numpy.searchsorted(self.starts, char_starts, side="left")
+        last = numpy.searchsorted(self.ends, char_ends, side="right") - 1
+        return first, last, (first < len(self.starts)) & (last >= 0)
+
+    def expand(self, char_starts: numpy.ndarray, char_ends: numpy.ndarray) -> Bounds:
+        """
+        It resolves character offsets to the tokens overlapping them (`alignment_mode="expand"`).
+
+        :param char_starts: start character offsets
+        :type char_starts: numpy.ndarray
+        :param char_ends: end character offsets
+        :type char_ends: numpy.ndarray
+        :return: the first and last tokens of each offsets, and whether they are aligned.
+        """
+        # tokens ending after the start and starting before the end
+        first = numpy.searchsorted(self.ends, char_starts, side="right")
+        last = numpy.searchsorted(self.starts, char_ends, side="left") - 1
+        return first, last, (first < len(self.starts)) & (last >= 0)
+
+    def token_bounds(self, offsets: List[Tuple[int, int]],
+                     mode: str = "strict") -> List[Optional[Tuple[int, int]]]:
+        """
+        It resolves character offsets to token bounds (as `Doc.char_span` with `alignment_mode`):
+        "strict" requires offsets on token boundaries, "contract" keeps the tokens inside the
+        offsets, "expand" keeps the tokens overlapping the offsets.
+
+        :param offsets: (start, end) character offsets
+        :type offsets: List[Tuple[int, int]]
+        :param mode: "strict", "contract" or "expand"
+        :type mode: str
+        :return: the (start, end) token bounds of each offsets, None if they can not be aligned.
+        """
+        if mode not in ALIGNMENT_MODES:
+            raise ValueError(f"Unknown alignment mode: {mode}.")
+        if len(offsets) == 0:
+            return []
+        if len(self.starts) == 0:
+            return [None for _ in offsets]
+        char_starts, char_ends = numpy.array(offsets, dtype="int64").reshape(-1, 2).T
+        first, last, valid = getattr(self, mode)(char_starts, char_ends)
+        valid &= (first <= last) & (char_starts < char_ends)
+        return [(int(start), int(end) + 1) if aligned else None
+                for start, end, aligned in zip(first.tolist(), last.tolist(), valid.tolist())]
@@ -0,0 +1,415 @@
+# -*- coding: UTF-8 -*-
+
+"""api.py
+
+Services of the Entity-fishing API used by the component (`disambiguate`,
+concept look-up, health check): requests sent through the pooled HTTP
+clients, admitted by the request scheduler and balanced across the urls
+of the API, and answered from the response and concept caches if possible.
+"""
+
+from typing import Callable, List, Tuple, Union
+
+import requests
+
+from .cache import LRUCache, ResponseCache, split_concepts, store_concepts
+from .client import AsyncEntityFishingClient, EntityFishingClient, log_responses
+from .config import CacheConfig, ClientConfig, EndpointsConfig, SchedulerConfig
+from .endpoints import EndpointPool
+from .metrics import Metrics, current_stage
+from .parsing import decode_response, dumps, loads
+from .payload import REQUEST_COMPRESSIONS, REQUEST_FORMATS
+from .scheduler import RequestScheduler
+
+# Converts a decoded response and its metadata to a result (response, metadata, entities).
+ToResult = Callable[[dict, dict], Tuple[dict, dict, list]]
+
+
+class EntityFishingAPI:
+    """Requests of the component to the Entity-fishing API, with their caches."""
+
+    def __init__(self,
+                 api_ef_base: Union[str, List[str]],
+                 language: str,
+                 verbose: bool,
+                 client: ClientConfig,
+                 scheduler: SchedulerConfig,
+                 endpoints: EndpointsConfig,
+                 cache: CacheConfig,
+                 metrics: Metrics):
+        """
+        `EntityFishingAPI` owns the HTTP clients of the component (shared scheduler and
+        endpoints) and its caches.
+
+        Parameters:
+            api_ef_base (Union[str, List[str]]): url of the entity-fishing API, or urls of
+            equivalent entity-fishing APIs to balance the requests across.
+            language (str): language of the queries.
+            verbose (bool): log the failed requests.
+            client (ClientConfig): cf. `ClientConfig`.
+            scheduler (SchedulerConfig): cf. `SchedulerConfig`.
+            endpoints (EndpointsConfig): cf. `EndpointsConfig`.
+            cache (CacheConfig): cf. `CacheConfig`.
+            metrics (Metrics): records the requests and the cache hits.
+
+        Attributes:
+            api_ef_base (str): first url of `api_ef_base`.
+            language (str): cf. `language` in parameters section.
+            verbose (bool): cf. `verbose` in parameters section.
+            client (EntityFishingClient): long-lived pooled HTTP client.
+            async_client (AsyncEntityFishingClient): asynchronous HTTP client used by `apipe`.
+            cache (ResponseCache): cache of the `disambiguate` responses (None if disabled).
+            concept_cache (LRUCache): cache of the concepts fetched by the concept look-up.
+        """
+        urls = [api_ef_base] if isinstance(api_ef_base, str) else list(api_ef_base)
+        urls = [url if url.endswith("/") else url + "/" for url in urls]
+        self.api_ef_base = urls[0]
+        self.language = language
+        self.verbose = verbose
+        pool = None
+        if len(urls) > 1:
+            pool = EndpointPool(urls=urls,
+                                weights=endpoints.endpoint_weights,
+                                strategy=endpoints.load_balancing,
+                                failure_threshold=endpoints.failure_threshold,
+                                recovery_timeout=endpoints.recovery_timeout)
+        admission = None
+        if scheduler.rate_limit > 0 or scheduler.adaptive_concurrency:
+            admission = RequestScheduler(rate_limit=scheduler.rate_limit,
+                                         rate_burst=scheduler.rate_burst,
+                                         adaptive_concurrency=scheduler.adaptive_concurrency,
+                                         min_concurrency=scheduler.min_concurrency,
+                                         max_concurrency=max(client.max_workers,
+                                                             client.async_concurrency))
+        if client.request_format not in REQUEST_FORMATS:
+            raise ValueError(f"Unknown request format: {client.request_format}.")
+        if client.request_compression not in REQUEST_COMPRESSIONS:
+            raise ValueError(f"Unknown request compression: {client.request_compression}.")
+        self.client = EntityFishingClient(max_workers=client.max_workers,
+                                          pool_maxsize=client.pool_maxsize,
+                                          connect_timeout=client.connect_timeout,
+                                          read_timeout=client.read_timeout,
+                                          max_retries=client.max_retries,
+                                          backoff_factor=client.backoff_factor,
+                                          max_backoff=client.max_backoff,
+                                          scheduler=admission,
+                                          endpoints=pool,
+                                          metrics=metrics,
+                                          request_format=client.request_format,
+                                          request_compression=client.request_compression)
+        self.async_client = AsyncEntityFishingClient(max_concurrency=client.async_concurrency,
+                                                     connect_timeout=client.connect_timeout,
+                                                     read_timeout=client.read_timeout,
+                                                     max_retries=client.max_retries,
+                                                     backoff_factor=client.backoff_factor,
+                                                     max_backoff=client.max_backoff,
+                                                     scheduler=admission,
+                                                     endpoints=pool,
+                                                     metrics=metrics,
+                                                     request_format=client.request_format,
+                                                     request_compression=client.request_compression)
+        self.cache = None
+        if cache.cache_size > 0 or cache.cache_path:
+            self.cache = ResponseCache(maxsize=cache.cache_size, ttl=cache.cache_ttl,
+                                       path=cache.cache_path)
+        self.concept_cache = LRUCache(maxsize=cache.concept_cache_size, ttl=cache.cache_ttl)
+
+    def service_url(self, service: str) -> str:
+        """
+        It builds the url of a service of the Entity-fishing API: relative to the endpoint chosen
+        for each request if several urls are balanced, else absolute.
+
+        :param service: the path of the service (eg. "disambiguate")
+        :type service: str
+        :return: the url of the service.
+        """
+        return service if self.client.endpoints is not None else self.api_ef_base + service
+
+    def batch(self,
+              method: str,
+              url_batch: List[str],
+              params: dict = None,
+              files_batch: List[dict] = None) -> List[Union[requests.Response, Exception]]:
+        """
+        It sends a request to each url with the corresponding file, through the pooled client.
+        Responses are returned in the order of `url_batch`; a request that raised is kept in
+        its slot as the exception instance.
+
+        :param method: the HTTP method
+        :type method: str
+        :param url_batch: a list of urls to send requests to
+        :type url_batch: List[str]
+        :param params: the query parameters of the requests
+        :type params: dict
+        :param files_batch: the multipart content of each request
+        :type files_batch: List[dict]
+        :return: A list of responses (or exceptions), aligned with `url_batch`.
+        """
+        response_batch = self.client.batch(method=method,
+                                           url_batch=url_batch,
+                                           params=params,
+                                           files_batch=files_batch)
+        log_responses(response_batch, self.verbose)
+        return response_batch
+
+    async def abatch(self,
+                     method: str,
+                     url_batch: List[str],
+                     params: dict = None,
+                     files_batch: List[dict] = None) -> list:
+        """
+        Asynchronous counterpart of `batch` (responses are `httpx.Response`).
+
+        :param method: the HTTP method
+        :type method: str
+        :param url_batch: a list of urls to send requests to
+        :type url_batch: List[str]
+        :param params: the query parameters of the requests
+        :type params: dict
+        :param files_batch: the multipart content of each request
+        :type files_batch: List[dict]
+        :return: A list of responses (or exceptions), aligned with `url_batch`.
+        """
+        response_batch = await self.async_client.batch(method=method,
+                                                       url_batch=url_batch,
+                                                       params=params,
+                                                       files_batch=files_batch)
+        log_responses(response_batch, self.verbose)
+        return response_batch
+
+    def disambiguate(self, files_batch: List[dict]) -> List[Union[requests.Response, Exception]]:
+        """
+        It sends a batch of queries to the `disambiguate` service.
+
+        :param files_batch: a list of queries (cf. `prepare_query`)
+        :type files_batch: List[dict]
+        :return: A list of responses.
+        """
+        url_disambiguate = self.service_url("disambiguate")
+        return self.batch(method="POST",
+                          url_batch=[url_disambiguate for _ in files_batch],
+                          files_batch=files_batch)
+
+    async def adisambiguate(self, files_batch: List[dict]) -> list:
+        """
+        Asynchronous counterpart of `disambiguate`.
+
+        :param files_batch: a list of queries (cf. `prepare_query`)
+        :type files_batch: List[dict]
+        :return: A list of responses.
+        """
+        url_disambiguate = self.service_url("disambiguate")
+        return await self.abatch(method="POST",
+                                 url_batch=[url_disambiguate for _ in files_batch],
+                                 files_batch=files_batch)
+
+    def concept_look_up_batch(self, wiki_id_batch: List[str]) -> List[Union[requests.Response,
+                                                                            Exception]]:
+        """
+        It sends a batch of Wikipedia ids to the concept look-up service (`kb/concept`).
+
+        :param wiki_id_batch: a list of wikipedia ids
+        :type wiki_id_batch: List[str]
+        :return: A list of responses.
+        """
+        return self.batch(method="GET",
+                          url_batch=[self.service_url("kb/concept/" + str(wiki_id))
+                                     for wiki_id in wiki_id_batch],
+                          params={"lang": self.language})
+
+    async def aconcept_look_up_batch(self, wiki_id_batch: List[str]) -> list:
+        """
+        Asynchronous counterpart of `concept_look_up_batch`.
+
+        :param wiki_id_batch: a list of wikipedia ids
+        :type wiki_id_batch: List[str]
+        :return: A list of responses.
+        """
+        return await self.abatch(method="GET",
+                                 url_batch=[self.service_url("kb/concept/" + str(wiki_id))
+                                            for wiki_id in wiki_id_batch],
+                                 params={"lang": self.language})
+
+    def process_queries(self, queries: List[dict], to_result: ToResult,
+                        variant: str = "") -> List[Tuple[dict, dict, list]]:
+        """
+        It sends a batch of queries to the `disambiguate` service, serving the queries already
+        answered from the response cache (if enabled).
+
+        :param queries: a list of queries (cf. `prepare_query`)
+        :type queries: List[dict]
+        :param to_result: converts a decoded response and its metadata to a result
+        :type to_result: Callable[[dict, dict], Tuple[dict, dict, list]]
+        :param variant: the variant of the cached responses ("" for whole responses)
+        :type variant: str
+        :return: A list of tuples, each tuple containing the response, metadata, and entities.
+        """
+        results, keys, to_send = self._cache_lookup(queries, variant)
+        if len(to_send) != 0:
+            reqs = self.disambiguate(files_batch=[queries[idx] for idx in to_send])
+            self._cache_update(results, keys, to_send,
+                               [to_result(*decode_response(req)) for req in reqs])
+        return results
+
+    async def aprocess_queries(self, queries: List[dict], to_result: ToResult,
+                               variant: str = "") -> List[Tuple[dict, dict, list]]:
+        """
+        Asynchronous counterpart of `process_queries`.
+
+        :param queries: a list of queries (cf. `prepare_query`)
+        :type queries: List[dict]
+        :param to_result: converts a decoded response and its metadata to a result
+        :type to_result: Callable[[dict, dict], Tuple[dict, dict, list]]
+        :param variant: the variant of the cached responses ("" for whole responses)
+        :type variant: str
+        :return: A list of tuples, each tuple containing the response, metadata, and entities.
+        """
+        results, keys, to_send = self._cache_lookup(queries, variant)
+        if len(to_send) != 0:
+            reqs = await self.adisambiguate(files_batch=[queries[idx] for idx in to_send])
+            self._cache_update(results, keys, to_send,
+                               [to_result(*decode_response(req)) for req in reqs])
+        return results
+
+    def _cache_lookup(self, queries: List[dict], variant: str) -> Tuple[list, list, List[int]]:
+        # the results found in the cache (None if missing), the cache keys of the queries
+        # and the indexes of the queries to send (identical queries are sent once)
+        if self.cache is None:
+            return [None for _ in queries], [None for _ in queries], list(range(len(queries)))
+
+        results, keys, to_send, seen = [], [], [], set()
+        for idx, query in enumerate(queries):
+            key = ResponseCache.make_key(query["query"], self.language, self.api_ef_base,
+                                         variant=variant)
+            keys.append(key)
+            value = self.cache.get(key)
+            if value is not None:
+                metadata = dict(value["metadata"], cached=True)
+                results.append((value["response"], metadata,
+                                value["response"].get("entities", [])))
+            else:
+                results.append(None)
+                if key not in seen:
+                    seen.add(key)
+                    to_send.append(idx)
+        misses = results.count(None)
+        self.client.metrics.observe_cache(current_stage(), len(results) - misses, misses)
+        return results, keys, to_send
+
+    def _cache_update(self, results: list, keys: list, sent: List[int],
+                      sent_results: List[Tuple[dict, dict, list]]) -> None:
+        # fills the results of the queries sent (and of their duplicates) and stores
+        # the successful ones in the response cache
+        by_key = {}
+        for idx, result in zip(sent, sent_results):
+            results[idx] = result
+            if keys[idx] is not None:
+                by_key[keys[idx]] = result
+                if result[1]["status_code"] == 200:
+                    self.cache.set(keys[idx], {"response": result[0], "metadata": result[1]})
+        for idx, result in enumerate(results):
+            if result is None:
+                # a copy of the response of the identical query (not shared by the documents)
+                res, metadata, _ = by_key[keys[idx]]
+                res = loads(dumps(res))
+                results[idx] = res, dict(metadata), res.get("entities", [])
+
+    def look_up_concepts(self, results: list, local_only: bool = False) -> dict:
+        """
+        It fetches (once) the concepts of the entities of a batch of results, through the
+        concept cache and the concept look-up service.
+
+        :param results: a list of (response, metadata, entities) tuples (None are ignored)
+        :type results: list
+        :param local_only: only the entities linked locally (cf. `link_index`)
+        :type local_only: bool
+        :return: the concepts by Wikipedia id.
+        """
+        concepts, missing = split_concepts(results, self.concept_cache, local_only)
+        if len(missing) != 0:
+            store_concepts(self.concept_cache, concepts, missing,
+                           self.concept_look_up_batch(missing))
+        return concepts
+
+    async def alook_up_concepts(self, results: list, local_only: bool = False) -> dict:
+        """
+        Asynchronous counterpart of `look_up_concepts`.
+
+        :param results: a list of (response, metadata, entities) tuples (None are ignored)
+        :type results: list
+        :param local_only: only the entities linked locally (cf. `link_index`)
+        :type local_only: bool
+        :return: the concepts by Wikipedia id.
+        """
+        concepts, missing = split_concepts(results, self.concept_cache, local_only)
+        if len(missing) != 0:
+            store_concepts(self.concept_cache, concepts, missing,
+                           await self.aconcept_look_up_batch(missing))
+        return concepts
+
+    def check_endpoints(self) -> dict:
+        """
+        It health-checks the urls of the API with the `isalive` service: healthy urls
+        receive requests again, the others are ejected.
+
+        :return: the health of each url.
+        """
+        def probe(url: str) -> bool:
+            try:
+                return self.client.session.get(url + "isalive", timeout=self.client.timeout).ok
+            except requests.exceptions.RequestException:
+                return False
+
+        if self.client.endpoints is None:
+            return {self.api_ef_base: probe(self.api_ef_base)}
+        return self.client.endpoints.check_health(probe)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Statistics of the requests: "cache" (hit/miss counters of the response cache),
+        "scheduler" (state of the request scheduler) and "endpoints" (latency, error and
+        circuit breaker state of each url). Empty for the features disabled.
+        """
+        scheduler, endpoints = self.client.scheduler, self.client.endpoints
+        return {
+            "cache": self.cache.stats if self.cache is not None else {},
+            "scheduler": scheduler.stats if scheduler is not None else {},
+            "endpoints": endpoints.stats if endpoints is not None else {},
+        }
+
+    def close(self) -> None:
+        """
+        It releases the pooled connections and the threads of the HTTP client
+        (they are created again on the next call).
+        """
+        self.client.close()
+
+    async def aclose(self) -> None:
+        """
+        It releases the pooled connections of the asynchronous HTTP client.
+        """
+        await self.async_client.aclose()
+
+    def serializers(self) -> dict:
+        """
+        It returns the getters of the in-memory caches, by name ("concepts", "responses").
+
+        :return: the getters.
+        """
+        getters = {"concepts": self.concept_cache.dump}
+        if self.cache is not None and self.cache.memory is not None:
+            getters["responses"] = self.cache.memory.dump
+        return getters
+
+    def deserializers(self) -> dict:
+        """
+        It returns the setters of the in-memory caches, by name ("concepts", "responses").
+
+        :return: the setters.
+        """
+        setters = {"concepts": self.concept_cache.load}
+        if self.cache is not None and self.cache.memory is not None:
+            setters["responses"] = self.cache.memory.load
+        return setters
+
@@ -0,0 +1,406 @@
+# -*- coding: UTF-8 -*-
+
+"""bulk.py
+
+Offline bulk linking: the HTTP calls are decoupled from spaCy.
+
+1. `export`: the documents of `DocBin` files are streamed into a JSONL file
+   of disambiguation queries (first pass, or "nil clustering" second pass).
+2. `ingest`: a JSONL file of responses produced elsewhere (e.g. by a batch job
+   against a local Entity-fishing cluster) is loaded into an on-disk store.
+3. `apply`: the responses are applied to the documents, written as `DocBin`
+   shards with a checkpoint so that an interrupted run can resume where it stopped.
+
+Query lines: {"id": "<doc>/<chunk>" or "<doc>/terms", "language": "en", "query": "<JSON query>"}
+Response lines: {"id": ..., "status_code": 200, "response": {<Entity-fishing response>}}
+
+Usage:
+    python -m spacyfishing.bulk export corpus.spacy queries.jsonl --lang en
+    python -m spacyfishing.bulk ingest responses.jsonl responses.sqlite
+    python -m spacyfishing.bulk export corpus.spacy terms_queries.jsonl --responses responses.sqlite
+    python -m spacyfishing.bulk ingest terms_responses.jsonl responses.sqlite
+    python -m spacyfishing.bulk apply corpus.spacy responses.sqlite linked/ --shard-size 10000
+    python -m spacyfishing.bulk apply corpus.spacy responses.sqlite linked/ --resume
+"""
+
+import argparse
+import itertools
+import json
+import os
+
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import spacy
+import srsly
+
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin
+from spacy.vocab import Vocab
+
+from .cache import SQLiteCache
+from .entity_fishing_linker import EntityFishing
+from .parsing import loads
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def read_docs(paths: Iterable[Union[str, Path]], vocab: Vocab, start: int = 0) -> Iterator[Doc]:
+    """
+    It streams the documents of `DocBin` files (one file in memory at a time), from the
+    document of index `start`: the files before it are skipped by their number of documents,
+    without building their documents.
+
+    :param paths: the `DocBin` files, in order
+    :type paths: Iterable[Union[str, Path]]
+    :param vocab: the vocabulary of the documents
+    :type vocab: Vocab
+    :param start: index of the first document (eg. the "docs" of a checkpoint)
+    :type start: int
+    :return: the documents.
+    """
+    for path in paths:
+        doc_bin = DocBin().from_disk(path)
+        if start >= len(doc_bin):
+            start -= len(doc_bin)
+            continue
+        yield from itertools.islice(doc_bin.get_docs(vocab), start, None)
+        start = 0
+
+
+def read_jsonl(path: Union[str, Path]) -> Iterator[dict]:
+    """
+    It streams the lines of a JSONL file (decoded with `loads`, which keeps floats exact).
+
+    :param path: the JSONL file
+    :type path: Union[str, Path]
+    :return: the decoded lines.
+    """
+    with open(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                yield loads(line)
+
+
+def query_id(doc_idx: int, part: Union[int, str]) -> str:
+    """
+    It builds the id of a query: the index of the document in the corpus and the index
+    of the chunk (first pass) or "terms" (second pass).
+
+    :param doc_idx: the index of the document
+    :type doc_idx: int
+    :param part: the index of the chunk or "terms"
+    :type part: Union[int, str]
+    :return: the id.
+    """
+    return f"{doc_idx}/{part}"
+
+
+class ResponseStore:
+    """On-disk store (SQLite) of the responses, by query id."""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        `ResponseStore` keeps the responses out of memory, so that they can be ingested
+        in any order and looked up while the documents are streamed.
+
+        Parameters:
+            path (Union[str, Path]): path of the SQLite database (created if missing).
+        """
+        self.responses = SQLiteCache(str(path))
+
+    def ingest(self, path: Union[str, Path], batch_size: int = 10000) -> int:
+        """
+        It loads a JSONL file of responses (lines with "id", "status_code" and "response").
+
+        :param path: the JSONL file
+        :type path: Union[str, Path]
+        :param batch_size: number of responses stored per transaction
+        :type batch_size: int
+        :return: the number of responses loaded.
+        """
+        lines = read_jsonl(path)
+        count = 0
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if len(batch) == 0:
+                return count
+            count += self.responses.set_many((line["id"], line) for line in batch)
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        It returns the response line of a query.
+
+        :param key: the id of the query
+        :type key: str
+        :return: the response line, None if missing.
+        """
+        return self.responses.get(key)
+
+
+def offline_result(linker: EntityFishing, key: str,
+                   line: Optional[dict]) -> Tuple[dict, dict, list]:
+    """
+    It converts a response line to the (response, metadata, entities) tuple of a query.
+
+    :param linker: the component
+    :type linker: EntityFishing
+    :param key: the id of the query
+    :type key: str
+    :param line: the response line (None if missing)
+    :type line: Optional[dict]
+    :return: the result of the query.
+    """
+    if line is None:
+        return {}, {
+            "status_code": None,
+            "reason": f"MissingResponse: no response for query {key}",
+            "ok": False,
+            "encoding": None,
+            "error": "MissingResponse"
+        }, []
+    status_code = line.get("status_code", 200)
+    metadata = {
+        "status_code": status_code,
+        "reason": line.get("reason"),
+        "ok": status_code is not None and status_code < 400,
+        "encoding": "utf-8",
+        "offline": True
+    }
+    return linker.passes.response_tuple(line.get("response") or {}, metadata)
+
+
+def text_result(linker: EntityFishing, doc: Doc, doc_idx: int,
+                store: ResponseStore) -> Tuple[dict, dict, list]:
+    """
+    It looks up the responses of the chunks of a document (first pass) and merges them.
+
+    :param linker: the component
+    :type linker: EntityFishing
+    :param doc: the document
+    :type doc: Doc
+    :param doc_idx: the index of the document in the corpus
+    :type doc_idx: int
+    :param store: the responses
+    :type store: ResponseStore
+    :return: the result of the document.
+    """
+    links = linker.passes.local_links(doc)
+    chunks = linker.passes.text_chunks(doc, links)
+    results = []
+    for chunk_idx in range(len(chunks)):
+        key = query_id(doc_idx, chunk_idx)
+        results.append(offline_result(linker, key, store.get(key)))
+    return linker.passes.merge_text_results([doc], [chunks], results, [links])[0]
+
+
+def export_queries(linker: EntityFishing,
+                   docs: Iterable[Doc],
+                   path: Union[str, Path],
+                   store: ResponseStore = None) -> int:
+    """
+    It writes the queries of the documents to a JSONL file: the queries of the first pass
+    (text), or if the responses of the first pass are given, the queries of the second pass
+    ("nil clustering") of the documents that need one.
+
+    :param linker: the component (its configuration shapes the queries)
+    :type linker: EntityFishing
+    :param docs: the documents, in the order of the corpus
+    :type docs: Iterable[Doc]
+    :param path: the JSONL file
+    :type path: Union[str, Path]
+    :param store: the responses of the first pass (None to export the first pass)
+    :type store: ResponseStore
+    :return: the number of queries written.
+    """
+    passes = linker.passes
+
+    def queries() -> Iterator[dict]:
+        for doc_idx, doc in enumerate(docs):
+            if store is None:
+                for chunk_idx, chunk in enumerate(passes.text_chunks(doc)):
+                    yield {"id": query_id(doc_idx, chunk_idx), "language": linker.language["lang"],
+                           **passes.queries([chunk.text], [""], [chunk.entities])[0]}
+            else:
+                nil_clustering = passes.attach_text_result(doc,
+                                                           text_result(linker, doc, doc_idx, store))
+                if len(nil_clustering) != 0:
+                    query = passes.queries([""], [passes.terms_query(doc)], [nil_clustering])[0]
+                    yield {"id": query_id(doc_idx, "terms"), "language": linker.language["lang"],
+                           **query}
+
+    count = 0
+    with open(path, "w", encoding="utf-8") as output:
+        for query in queries():
+            output.write(json.dumps(query, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_checkpoint(output_dir: Path) -> dict:
+    """
+    It reads the progress of `apply_responses` in `output_dir`.
+
+    :param output_dir: the output directory
+    :type output_dir: Path
+    :return: the number of documents and shards written.
+    """
+    path = output_dir / CHECKPOINT_FILE
+    if path.exists():
+        return srsly.read_json(path)
+    return {"docs": 0, "shards": 0}
+
+
+def write_checkpoint(output_dir: Path, checkpoint: dict) -> None:
+    """
+    It writes the progress of `apply_responses` in `output_dir` (atomically, after the shard
+    it records).
+
+    :param output_dir: the output directory
+    :type output_dir: Path
+    :param checkpoint: the number of documents and shards written
+    :type checkpoint: dict
+    """
+    tmp_path = output_dir / (CHECKPOINT_FILE + ".tmp")
+    srsly.write_json(tmp_path, checkpoint)
+    os.replace(tmp_path, output_dir / CHECKPOINT_FILE)
+
+
+def apply_responses(linker: EntityFishing,
+                    docs: Iterable[Doc],
+                    store: ResponseStore,
+                    output_dir: Union[str, Path],
+                    shard_size: int = 10000,
+                    resume: bool = False) -> int:
+    """
+    It applies the responses to the documents and writes them as `DocBin` shards
+    (`00000.spacy`, `00001.spacy`, ...) of `shard_size` documents. A checkpoint is written
+    after each shard: with `resume`, the run continues after the documents it records, and
+    `docs` starts at the first document not written yet (eg.
+    `read_docs(paths, vocab, start=read_checkpoint(output_dir)["docs"])`).
+
+    :param linker: the component
+    :type linker: EntityFishing
+    :param docs: the documents, in the order of the corpus (from the checkpoint with `resume`)
+    :type docs: Iterable[Doc]
+    :param store: the responses of the first and second passes
+    :type store: ResponseStore
+    :param output_dir: the output directory
+    :type output_dir: Union[str, Path]
+    :param shard_size: number of documents of a shard
+    :type shard_size: int
+    :param resume: continue the run recorded by the checkpoint of `output_dir`
+    :type resume: bool
+    :return: the number of documents written by this run.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = read_checkpoint(output_dir) if resume else {"docs": 0, "shards": 0}
+
+    count = 0
+    # the query ids are built on the index of the documents in the corpus
+    docs = enumerate(docs, checkpoint["docs"])
+    while True:
+        shard: List[Doc] = []
+        for doc_idx, doc in itertools.islice(docs, shard_size):
+            result_from_ef_text = text_result(linker, doc, doc_idx, store)
+            result_from_ef_terms = None
+            if len(linker.passes.attach_text_result(doc, result_from_ef_text)) != 0:
+                # a missing second pass is reported in the metadata, like a missing first pass
+                key = query_id(doc_idx, "terms")
+                result_from_ef_terms = offline_result(linker, key, store.get(key))
+            entities = linker.passes.attach_terms_result(doc, result_from_ef_text[2],
+                                                         result_from_ef_terms)
+            if len(entities) > 0:
+                try:
+                    linker.updated_entities(doc, entities)
+                except KeyError:
+                    pass
+            shard.append(doc)
+        if len(shard) == 0:
+            return count
+        DocBin(store_user_data=True,
+               docs=shard).to_disk(output_dir / f"{checkpoint['shards']:05d}.spacy")
+        checkpoint = {"docs": checkpoint["docs"] + len(shard), "shards": checkpoint["shards"] + 1}
+        write_checkpoint(output_dir, checkpoint)
+        count += len(shard)
+
+
+def load_linker(model: Optional[str], lang: str, config: dict) -> Tuple[Language, EntityFishing]:
+    """
+    It loads a pipeline with its `entityfishing` component (added with `config` if missing).
+
+    :param model: name or path of a pipeline (None for a blank pipeline of `lang`)
+    :type model: Optional[str]
+    :param lang: language of the blank pipeline
+    :type lang: str
+    :param config: configuration of the component if it is added
+    :type config: dict
+    :return: the pipeline and the component.
+    """
+    nlp = spacy.load(model) if model else spacy.blank(lang)
+    if "entityfishing" not in nlp.pipe_names:
+        nlp.add_pipe("entityfishing", config=dict({"language": lang}, **config))
+    return nlp, nlp.get_pipe("entityfishing")
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    Command line of the offline bulk linking (cf. usage above): `export`, `ingest` or `apply`.
+
+    :param argv: the arguments (None for `sys.argv`)
+    :type argv: List[str]
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_model_args(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument("--model", default=None,
+                               help="pipeline with the entityfishing component")
+        subparser.add_argument("--lang", default="en",
+                               help="language of the blank pipeline (without --model)")
+        subparser.add_argument("--config", default="{}",
+                               help="configuration of the component (JSON)")
+
+    export = subparsers.add_parser("export",
+                                   help="write the queries of DocBin files to a JSONL file")
+    export.add_argument("docs", nargs="+", help="DocBin files")
+    export.add_argument("queries", help="JSONL file of queries")
+    export.add_argument("--responses", default=None,
+                        help="store of the first pass: export the second pass")
+    add_model_args(export)
+
+    ingest = subparsers.add_parser("ingest", help="load a JSONL file of responses into a store")
+    ingest.add_argument("responses", help="JSONL file of responses")
+    ingest.add_argument("store", help="SQLite store of responses")
+
+    apply = subparsers.add_parser("apply", help="apply the responses to DocBin files")
+    apply.add_argument("docs", nargs="+", help="DocBin files")
+    apply.add_argument("store", help="SQLite store of responses")
+    apply.add_argument("output", help="output directory of DocBin shards")
+    apply.add_argument("--shard-size", type=int, default=10000)
+    apply.add_argument("--resume", action="store_true",
+                       help="continue from the checkpoint of a previous run")
+    add_model_args(apply)
+
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        print(f"{ResponseStore(args.store).ingest(args.responses)} responses ingested.")
+        return
+
+    nlp, linker = load_linker(args.model, args.lang, json.loads(args.config))
+    if args.command == "export":
+        store = ResponseStore(args.responses) if args.responses else None
+        docs = read_docs(args.docs, nlp.vocab)
+        print(f"{export_queries(linker, docs, args.queries, store)} queries exported.")
+    else:
+        start = read_checkpoint(Path(args.output))["docs"] if args.resume else 0
+        docs = read_docs(args.docs, nlp.vocab, start=start)
+        count = apply_responses(linker, docs, ResponseStore(args.store), args.output,
+                                shard_size=args.shard_size, resume=args.resume)
+        print(f"{count} documents linked.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+# -*- coding: UTF-8 -*-
+
+"""cache.py
+
+Caches of Entity-fishing responses: an in-memory LRU tier bounded
+in size and age, and an optional on-disk tier (SQLite) that survives
+restarts and can be shared by several worker processes.
+"""
+
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Any, Iterable, List, Optional, Tuple
+
+from .parsing import decode_response, dumps, extra_information, loads
+from .resources import Lockable
+
+
+class LRUCache(Lockable):
+    """Thread-safe in-memory LRU cache with an optional time-to-live."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        """
+        `LRUCache` keeps the `maxsize` most recently used entries.
+
+        Parameters:
+            maxsize (int): maximum number of entries.
+            ttl (float): entries older than `ttl` seconds are expired (None: never expire).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        super().__init__()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        It returns the value stored under `key`, None if missing or expired.
+
+        :param key: the key
+        :type key: str
+        :return: the value.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, created = item
+                if self.ttl is None or time.time() - created <= self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        It stores `value` under `key`, evicting the least recently used entries if full.
+
+        :param key: the key
+        :type key: str
+        :param value: the value
+        :type value: Any
+        """
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def dump(self) -> List[list]:
+        """
+        It exports the entries, from the least to the most recently used.
+
+        :return: the entries as [key, value, creation time] lists.
+        """
+        with self._lock:
+            return [[key, value, created] for key, (value, created) in self._data.items()]
+
+    def load(self, entries: List[list]) -> None:
+        """
+        It imports entries exported by `dump` (their creation time is kept for the time-to-live).
+
+        :param entries: the entries as [key, value, creation time] lists
+        :type entries: List[list]
+        """
+        with self._lock:
+            for key, value, created in entries:
+                self._data[key] = (value, created)
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """On-disk cache (SQLite database in WAL mode) shared by threads and processes."""
+
+    def __init__(self, path: str, ttl: float = None):
+        """
+        `SQLiteCache` stores JSON-serialisable values in a SQLite database.
+
+        Parameters:
+            path (str): path of the database file (created if missing).
+            ttl (float): entries older than `ttl` seconds are expired (None: never expire).
+        """
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS responses "
+                               "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread (and per process after a fork)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        It returns the value stored under `key`, None if missing or expired.
+
+        :param key: the key
+        :type key: str
+        :return: the value.
+        """
+        row = self._connection().execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+        hit = row is not None and (self.ttl is None or time.time() - row[1] <= self.ttl)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return loads(row[0]) if hit else None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        It stores `value` (JSON-serialisable) under `key`.
+
+        :param key: the key
+        :type key: str
+        :param value: the value
+        :type value: Any
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+            (key, dumps(value), time.time()))
+
+    def set_many(self, items: Iterable[Tuple[str, Any]]) -> int:
+        """
+        It stores many values (JSON-serialisable) in a single transaction.
+
+        :param items: the (key, value) pairs
+        :type items: Iterable[Tuple[str, Any]]
+        :return: the number of values stored.
+        """
+        now = time.time()
+        rows = [(key, dumps(value), now) for key, value in items]
+        connection = self._connection()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)", rows)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return len(rows)
+
+    def purge_expired(self) -> int:
+        """
+        It removes the expired entries from the database.
+
+        :return: the number of entries removed.
+        """
+        if self.ttl is None:
+            return 0
+        cursor = self._connection().execute(
+            "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._connection().execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def __getstate__(self) -> dict:
+        # connections are opened again by each process
+        state = self.__dict__.copy()
+        del state["_local"], state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+
+class ResponseCache:
+    """Two-tier cache of Entity-fishing responses (memory LRU, then optional disk)."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, path: str = None):
+        """
+        `ResponseCache` looks up the memory tier first, then the disk tier (a disk hit
+        is promoted to the memory tier). Values are stored serialized (JSON) in both tiers:
+        every hit returns a new copy, never shared with the cache nor with other documents.
+
+        Parameters:
+            maxsize (int): maximum number of entries of the memory tier (0 disables it).
+            ttl (float): entries older than `ttl` seconds are expired (None: never expire).
+            path (str): path of the SQLite database of the disk tier (None disables it).
+        """
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl) if maxsize > 0 else None
+        self.disk = SQLiteCache(path=path, ttl=ttl) if path else None
+
+    @staticmethod
+    def make_key(query: str, language: str, base_url: str = "", variant: str = "") -> str:
+        """
+        It builds the key of a query: a digest of the query payload (cf. `prepare_data`),
+        of the language, of the base URL of the service (responses of another
+        Entity-fishing instance, or knowledge base version, are not shared) and of the
+        variant of the stored responses (eg. compact).
+
+        :param query: the JSON query sent to the `disambiguate` service
+        :type query: str
+        :param language: the language of the query
+        :type language: str
+        :param base_url: the base URL of the Entity-fishing API
+        :type base_url: str
+        :param variant: the variant of the stored responses ("" for whole responses)
+        :type variant: str
+        :return: the key.
+        """
+        if variant:
+            query = f"{variant}\x00{query}"
+        return hashlib.sha256(f"{base_url}\x00{language}\x00{query}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        It returns the value stored under `key` in the first tier that holds it.
+
+        :param key: the key
+        :type key: str
+        :return: the value, None if missing.
+        """
+        if self.memory is not None:
+            encoded = self.memory.get(key)
+            if encoded is not None:
+                return loads(encoded)
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                if self.memory is not None:
+                    self.memory.set(key, dumps(value))
+                return value
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        It stores `value` under `key` in every tier.
+
+        :param key: the key
+        :type key: str
+        :param value: the value
+        :type value: Any
+        """
+        if self.memory is not None:
+            self.memory.set(key, dumps(value))
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters (overall and per tier)."""
+        memory_hits = self.memory.hits if self.memory is not None else 0
+        disk_hits = self.disk.hits if self.disk is not None else 0
+        if self.disk is not None:
+            misses = self.disk.misses
+        else:
+            misses = self.memory.misses if self.memory is not None else 0
+        return {
+            "hits": memory_hits + disk_hits,
+            "misses": misses,
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "memory_size": len(self.memory) if self.memory is not None else 0,
+        }
+
+
+def split_concepts(results: list, concept_cache: LRUCache,
+                   local_only: bool = False) -> Tuple[dict, List[str]]:
+    """
+    It collects the distinct Wikipedia ids of the entities of a batch of results and splits
+    them into concepts already in the concept cache and concepts to fetch.
+
+    :param results: a list of (response, metadata, entities) tuples (None are ignored)
+    :type results: list
+    :param concept_cache: the concepts already fetched (by Wikipedia id)
+    :type concept_cache: LRUCache
+    :param local_only: only the entities linked locally (cf. `link_index`)
+    :type local_only: bool
+    :return: the cached concepts (by Wikipedia id) and the Wikipedia ids to fetch.
+    """
+    # missing: dict used as an ordered set (the ids are fetched in the order they are found)
+    concepts, missing = {}, {}
+    for result in results:
+        if result is None:
+            continue
+        for entity in result[2]:
+            if "wikipediaExternalRef" not in entity or (local_only and not entity.get("local")):
+                continue
+            wiki_id = str(entity["wikipediaExternalRef"])
+            if wiki_id in concepts or wiki_id in missing:
+                continue
+            concept = concept_cache.get(wiki_id)
+            if concept is None:
+                missing[wiki_id] = None
+            else:
+                concepts[wiki_id] = concept
+    return concepts, list(missing)
+
+
+def store_concepts(concept_cache: LRUCache, concepts: dict, wiki_id_batch: List[str],
+                   reqs: list) -> dict:
+    """
+    It keeps the information used as extra information (cf. `extra_information`) from the
+    responses of the concept look-up service and stores them in the concept cache.
+
+    :param concept_cache: the concepts already fetched (by Wikipedia id), updated in place
+    :type concept_cache: LRUCache
+    :param concepts: the concepts of the batch (by Wikipedia id), updated in place
+    :type concepts: dict
+    :param wiki_id_batch: the Wikipedia ids looked up
+    :type wiki_id_batch: List[str]
+    :param reqs: the responses of the concept look-up service
+    :type reqs: list
+    :return: the concepts of the batch.
+    """
+    for wiki_id, req in zip(wiki_id_batch, reqs):
+        res, metadata = decode_response(req)
+        if not metadata["ok"] or len(res) == 0:
+            continue
+        concept = extra_information(res)
+        concept_cache.set(wiki_id, concept)
+        concepts[wiki_id] = concept
+    return concepts
@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+
+"""chunking.py
+
+Split long documents into chunks (at sentence or paragraph boundaries)
+disambiguated as separate queries, and merge the results of the chunks
+back into document coordinates.
+"""
+
+import re
+
+from typing import List, NamedTuple, Tuple
+
+from spacy.tokens import Doc
+
+from .payload import entity_query
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+class Chunk(NamedTuple):
+    """A part of a document sent as a single query."""
+    offset: int
+    """Position of `text` in the document."""
+    text: str
+    """Text of the query (the chunk with its context)."""
+    entities: list
+    """Entities of the chunk (spans, or entities of a query with offsets relative to `text`)."""
+
+
+def boundaries(doc: Doc, boundary: str) -> List[int]:
+    """
+    It lists the candidate split positions of a document that do not cut an entity.
+
+    :param doc: the document
+    :type doc: Doc
+    :param boundary: "sentence" (if sentences are set, else paragraphs) or "paragraph"
+    :type boundary: str
+    :return: the sorted split positions (character offsets).
+    """
+    if boundary == "sentence" and doc.has_annotation("SENT_START"):
+        positions = [sent.start_char for sent in doc.sents][1:]
+    else:
+        positions = [match.end() for match in PARAGRAPH_BREAK.finditer(doc.text)]
+    inside_entity = set()
+    for ent in doc.ents:
+        inside_entity.update(range(ent.start_char + 1, ent.end_char))
+    return [position for position in positions
+            if position not in inside_entity and 0 < position < len(doc.text)]
+
+
+def doc_units(doc: Doc, entities: list, boundary: str) -> List[Tuple[int, int, list]]:
+    """
+    It splits a document at its boundaries into units (sentences or paragraphs).
+
+    :param doc: the document
+    :type doc: Doc
+    :param entities: the entities (spans) to disambiguate, sorted by offset
+    :type entities: list
+    :param boundary: "sentence" or "paragraph"
+    :type boundary: str
+    :return: the (start, end, entities) of each unit.
+    """
+    positions = [0] + boundaries(doc, boundary) + [len(doc.text)]
+    units, ent_idx = [], 0
+    for start, end in zip(positions, positions[1:]):
+        unit_entities = []
+        while ent_idx < len(entities) and entities[ent_idx].start_char < end:
+            unit_entities.append(entities[ent_idx])
+            ent_idx += 1
+        units.append((start, end, unit_entities))
+    return units
+
+
+def pack_units(units: List[Tuple[int, int, list]],
+               max_chars: int,
+               max_entities: int = 0) -> List[Tuple[int, int, list]]:
+    """
+    It packs consecutive units greedily under the budgets (a unit over budget makes its own
+    span).
+
+    :param units: the (start, end, entities) of each unit
+    :type units: List[Tuple[int, int, list]]
+    :param max_chars: character budget of a span
+    :type max_chars: int
+    :param max_entities: entity budget of a span (0: no budget)
+    :type max_entities: int
+    :return: the (start, end, entities) of each span.
+    """
+    spans: List[Tuple[int, int, list]] = []
+    for start, end, unit_entities in units:
+        if spans:
+            last_start, _, last_entities = spans[-1]
+            fits_chars = end - last_start <= max_chars
+            fits_entities = (max_entities <= 0
+                             or len(last_entities) + len(unit_entities) <= max_entities)
+            if fits_chars and fits_entities:
+                spans[-1] = (last_start, end, last_entities + unit_entities)
+                continue
+        spans.append((start, end, list(unit_entities)))
+    return spans
+
+
+def split_doc(doc: Doc,
+              entities: list,
+              max_chars: int,
+              max_entities: int = 0,
+              boundary: str = "sentence",
+              overlap: int = 0) -> List[Chunk]:
+    """
+    It splits a document into chunks of at most `max_chars` characters and `max_entities`
+    entities (a single sentence or paragraph over budget makes its own chunk). Chunks without
+    entities are not kept. Each chunk can be extended with `overlap` characters of context on
+    both sides; the entities of the context belong to the neighbouring chunks.
+
+    :param doc: the document
+    :type doc: Doc
+    :param entities: the entities (spans) to disambiguate
+    :type entities: list
+    :param max_chars: character budget of a chunk
+    :type max_chars: int
+    :param max_entities: entity budget of a chunk (0: no budget)
+    :type max_entities: int
+    :param boundary: "sentence" or "paragraph"
+    :type boundary: str
+    :param overlap: characters of context added on both sides of a chunk
+    :type overlap: int
+    :return: the chunks.
+    """
+    text = doc.text
+    entities = sorted(entities, key=lambda ent: ent.start_char)
+    if len(text) <= max_chars and (max_entities <= 0 or len(entities) <= max_entities):
+        return [Chunk(0, text, [entity_query(ent) for ent in entities])]
+
+    chunks = []
+    for start, end, chunk_entities in pack_units(doc_units(doc, entities, boundary),
+                                                 max_chars, max_entities):
+        if len(chunk_entities) == 0:
+            continue
+        offset = max(0, start - overlap)
+        chunks.append(Chunk(offset,
+                            text[offset:min(len(text), end + overlap)],
+                            [entity_query(ent, offset) for ent in chunk_entities]))
+    if len(chunks) == 0:
+        chunks.append(Chunk(0, text, []))
+    return chunks
+
+
+def merge_chunk_results(text: str, chunks: List[Chunk], results: list) -> Tuple[dict, dict, list]:
+    """
+    It merges the results of the chunks of a document: the offsets of the entities are shifted
+    back to document coordinates (`offsetStart`/`offsetEnd`).
+
+    :param text: the text of the document
+    :type text: str
+    :param chunks: the chunks of the document
+    :type chunks: List[Chunk]
+    :param results: the results (response, metadata, entities) of the chunks
+    :type results: list
+    :return: the result of the document (response, metadata, entities).
+    """
+    if len(chunks) == 1 and chunks[0].offset == 0 and chunks[0].text == text:
+        return results[0]
+
+    entities, response = [], {}
+    for chunk, (res, _, chunk_entities) in zip(chunks, results):
+        for entity in chunk_entities:
+            entities.append(dict(entity,
+                                 offsetStart=entity["offsetStart"] + chunk.offset,
+                                 offsetEnd=entity["offsetEnd"] + chunk.offset))
+        if len(response) == 0 and len(res) > 0:
+            response = res
+    # the metadata of the first failed chunk, if any
+    failed = [chunk_metadata for _, chunk_metadata, _ in results if not chunk_metadata["ok"]]
+    metadata = failed[0] if failed else results[0][1]
+
+    if len(response) > 0:
+        response = dict(response, entities=entities)
+        if "text" in response:
+            response["text"] = text
+    metadata = dict(metadata, chunks=len(chunks), failed_chunks=len(failed))
+    return response, metadata, entities
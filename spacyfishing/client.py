@@ -0,0 +1,613 @@
+# -*- coding: UTF-8 -*-
+
+"""client.py
+
+HTTP clients used by the Entity-fishing component: a long-lived,
+connection-pooled session (keep-alive, timeouts, retry with exponential
+backoff, failover across endpoints) with a reusable thread pool to send
+batches of requests, and its asyncio counterpart (optional, requires `httpx`).
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import logging
+import weakref
+
+from email.utils import parsedate_to_datetime
+from time import perf_counter, sleep, time
+from typing import AsyncIterator, List, NamedTuple, Optional, Union
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from .endpoints import Endpoint, EndpointPool
+from .metrics import Metrics, current_stage
+from .payload import Body, encode_body, received_bytes
+from .resources import ProcessLocal
+from .scheduler import RequestScheduler
+
+# Status codes worth retrying: rate limiting and transient server errors.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy(NamedTuple):
+    """Retries of the requests on connection errors and on `RETRY_STATUS_CODES` responses."""
+    max_retries: int = 3
+    """Number of retries (0 disables retries)."""
+    backoff_factor: float = 0.5
+    """Exponential backoff factor between retries (`backoff_factor * 2 ** retry` seconds)."""
+    max_backoff: float = 60.0
+    """Maximum delay between retries in seconds (caps the `Retry-After` header too)."""
+
+
+class BaseClient:
+    """Retry, scheduling and endpoint selection shared by the HTTP clients."""
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 max_backoff: float = 60.0,
+                 scheduler: RequestScheduler = None,
+                 endpoints: EndpointPool = None,
+                 metrics: Metrics = None,
+                 request_format: str = "multipart",
+                 request_compression: Optional[str] = None):
+        self.retry = RetryPolicy(max_retries, backoff_factor, max_backoff)
+        self.scheduler = scheduler
+        self.endpoints = endpoints
+        self.metrics = metrics
+        self.request_format = request_format
+        self.request_compression = request_compression
+
+    def encode(self, files: Optional[dict]) -> Body:
+        """
+        It encodes the body of a request (cf. `encode_body`) in the format of the client.
+
+        :param files: multipart content of the request (None without body)
+        :type files: dict
+        :return: the body and its headers.
+        """
+        return encode_body(files, self.request_format, self.request_compression)
+
+    def acquire_endpoint(self, url: str, tried: List[Endpoint]) -> Optional[Endpoint]:
+        """
+        It selects the endpoint of an attempt: relative urls are sent to an endpoint of the
+        pool, absolute urls as is.
+
+        :param url: the url of the request
+        :type url: str
+        :param tried: endpoints already tried for this request
+        :type tried: List[Endpoint]
+        :return: the endpoint (None if `url` is sent as is).
+        """
+        if self.endpoints is None or "://" in url:
+            return None
+        return self.endpoints.acquire(exclude=tried)
+
+    def release(self, endpoint: Optional[Endpoint], status_code: Optional[int], latency: float,
+                size: int = 0) -> None:
+        """
+        It reports the outcome of an attempt to the scheduler and to its endpoint.
+
+        :param endpoint: the endpoint of the attempt (None if the url was sent as is)
+        :type endpoint: Optional[Endpoint]
+        :param status_code: the status code of the response (None if the attempt failed)
+        :type status_code: Optional[int]
+        :param latency: the duration of the attempt in seconds
+        :type latency: float
+        :param size: the size of the payload of the request
+        :type size: int
+        """
+        if self.scheduler is not None:
+            self.scheduler.release(status_code, latency, size)
+        if endpoint is not None:
+            self.endpoints.release(endpoint, status_code is not None and status_code < 500, latency)
+
+    def _retry_delay(self, attempt: int, response, endpoint: Optional[Endpoint],
+                     tried: List[Endpoint]) -> float:
+        # fail over to another endpoint at once, else back off
+        if endpoint is not None:
+            tried.append(endpoint)
+            if self.endpoints.has_alternative(tried):
+                return 0.0
+            tried.clear()
+        return backoff_delay(self.retry.backoff_factor, attempt, response, self.retry.max_backoff)
+
+    def _observe(self, stage: str, submitted: float, sent: float, retries: int, response) -> None:
+        # a request (all its attempts) from its submission to its response
+        if self.metrics is None:
+            return
+        bytes_sent, bytes_received, bytes_decoded, status_code = 0, 0, 0, None
+        if response is not None:
+            # sizes on the wire (compressed bodies)
+            bytes_sent = int(response.request.headers.get("Content-Length", 0))
+            bytes_received = received_bytes(response)
+            bytes_decoded = len(response.content)
+            status_code = response.status_code
+        self.metrics.observe_request(stage=stage,
+                                     latency=perf_counter() - sent,
+                                     queue_wait=sent - submitted,
+                                     retries=retries,
+                                     bytes_sent=bytes_sent,
+                                     bytes_received=bytes_received,
+                                     status_code=status_code,
+                                     bytes_decoded=bytes_decoded)
+
+
+class EntityFishingClient(BaseClient):
+    """Pooled HTTP client for the Entity-fishing API."""
+
+    def __init__(self,
+                 max_workers: int = 20,
+                 pool_maxsize: int = 20,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = 60.0,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 max_backoff: float = 60.0,
+                 scheduler: RequestScheduler = None,
+                 endpoints: EndpointPool = None,
+                 metrics: Metrics = None,
+                 request_format: str = "multipart",
+                 request_compression: Optional[str] = None):
+        """
+        `EntityFishingClient` owns a `requests.Session` and a `ThreadPoolExecutor`,
+        both created on first use in each process and reused for every batch
+        (the client can be pickled or inherited by a forked worker process).
+
+        Parameters:
+            max_workers (int): number of threads sending requests concurrently.
+            pool_maxsize (int): number of keep-alive connections kept per host.
+            connect_timeout (float): seconds to wait for a connection to be established.
+            read_timeout (float): seconds to wait for the server to send a response.
+            max_retries (int): number of retries on connection errors and on
+            429/5xx responses (0 disables retries).
+            backoff_factor (float): exponential backoff factor between retries
+            (`backoff_factor * 2 ** retry` seconds), a `Retry-After` header
+            sent by the server takes precedence.
+            max_backoff (float): maximum delay between retries in seconds (caps the
+            `Retry-After` header and the exponential backoff).
+            scheduler (RequestScheduler): admission of the requests (rate limit and
+            adaptive concurrency), None to send requests as soon as a worker is free.
+            endpoints (EndpointPool): endpoints across which relative urls are balanced
+            (a failed attempt fails over to another endpoint).
+            metrics (Metrics): records the latency, queue wait, retries and size of each request.
+            request_format (str): bodies sent as "multipart" form data or as "json".
+            request_compression (str): compression of the bodies ("gzip" or "deflate"),
+            None to send them uncompressed.
+        """
+        super().__init__(max_retries, backoff_factor, max_backoff, scheduler, endpoints, metrics,
+                         request_format, request_compression)
+        self.max_workers = max_workers
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+
+        self._session = ProcessLocal(functools.partial(build_session, pool_maxsize))
+        self._executor = ProcessLocal(functools.partial(concurrent.futures.ThreadPoolExecutor,
+                                                        max_workers=max_workers,
+                                                        thread_name_prefix="entityfishing"))
+
+    @property
+    def session(self) -> requests.Session:
+        """Connection-pooled session (created on first access in each process)."""
+        return self._session.get()
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Thread pool used to send batches (created on first access in each process)."""
+        return self._executor.get()
+
+    def request(self,
+                method: str,
+                url: str,
+                params: dict = None,
+                files: dict = None,
+                stage: str = None,
+                submitted: float = None) -> requests.Response:
+        """
+        It sends a single request through the pooled session, retried with exponential backoff
+        on connection errors and 429/5xx responses.
+
+        :param method: HTTP method ("GET" or "POST")
+        :type method: str
+        :param url: the url to send the request to
+        :type url: str
+        :param params: query string parameters
+        :type params: dict
+        :param files: multipart content of the request
+        :type files: dict
+        :param stage: stage of the request reported to `metrics` (defaults to the current stage)
+        :type stage: str
+        :param submitted: time (`perf_counter`) the request was submitted at (defaults to now)
+        :type submitted: float
+        :return: the response.
+        """
+        stage = current_stage() if stage is None else stage
+        submitted = perf_counter() if submitted is None else submitted
+        body = self.encode(files)
+        if body.content is not None:
+            files = None
+        attempt, tried, sent = 0, [], None
+        while True:
+            response = None
+            # waiting for a slot does not count as outstanding on an endpoint
+            if self.scheduler is not None:
+                self.scheduler.acquire()
+            endpoint = self.acquire_endpoint(url, tried)
+            start = perf_counter()
+            sent = start if sent is None else sent
+            try:
+                response = self.session.request(method=method,
+                                                url=url if endpoint is None else endpoint.url + url,
+                                                params=params,
+                                                files=files,
+                                                data=body.content,
+                                                headers=body.headers,
+                                                timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.retry.max_retries:
+                    self._observe(stage, submitted, sent, attempt, None)
+                    raise
+            except Exception:
+                # not retried (eg. an invalid url): still a failed request
+                self._observe(stage, submitted, sent, attempt, None)
+                raise
+            finally:
+                # the slot is released whatever the outcome (eg. a body that can not be decoded)
+                self.release(endpoint, None if response is None else response.status_code,
+                             perf_counter() - start,
+                             payload_size(files) if body.content is None else len(body.content))
+            if response is not None and (response.status_code not in RETRY_STATUS_CODES
+                                         or attempt >= self.retry.max_retries):
+                self._observe(stage, submitted, sent, attempt, response)
+                return response
+            sleep(self._retry_delay(attempt, response, endpoint, tried))
+            attempt += 1
+
+    def batch(self,
+              method: str,
+              url_batch: List[str],
+              params: dict = None,
+              files_batch: List[dict] = None) -> List[Union[requests.Response, Exception]]:
+        """
+        It sends a request to each url of `url_batch` with the corresponding files
+        concurrently, and returns the responses in the order of `url_batch`; a request
+        that raised is kept in its slot as the exception instance.
+
+        :param method: HTTP method ("GET" or "POST")
+        :type method: str
+        :param url_batch: a list of urls to send requests to
+        :type url_batch: List[str]
+        :param params: query string parameters shared by all requests
+        :type params: dict
+        :param files_batch: multipart content of each request
+        :type files_batch: List[dict]
+        :return: A list of responses (or exceptions), aligned with `url_batch`.
+        """
+        if files_batch is None:
+            files_batch = [None for _ in url_batch]
+
+        response_batch = [None] * len(url_batch)
+        stage, submitted = current_stage(), perf_counter()
+        future_to_idx = {self.executor.submit(
+            self.request, method, url, params, files, stage, submitted): idx
+            for idx, (url, files) in enumerate(zip(url_batch, files_batch))}
+        for future in concurrent.futures.as_completed(future_to_idx):
+            idx = future_to_idx[future]
+            try:
+                response_batch[idx] = future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                response_batch[idx] = exc
+        return response_batch
+
+    def close(self) -> None:
+        """Release the pooled connections and the threads."""
+        self._executor.close(concurrent.futures.ThreadPoolExecutor.shutdown)
+        self._session.close(requests.Session.close)
+
+
+def build_session(pool_maxsize: int) -> requests.Session:
+    """
+    It builds a session keeping `pool_maxsize` keep-alive connections per host, without
+    retries (they are handled by `EntityFishingClient.request`, so that the scheduler sees
+    every attempt).
+
+    :param pool_maxsize: number of keep-alive connections kept per host
+    :type pool_maxsize: int
+    :return: the session.
+    """
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=0)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept": "application/json"})
+    return session
+
+
+def retry_after_delay(retry_after: str) -> float:
+    """
+    It converts the value of a `Retry-After` header (seconds or HTTP date) to a delay in seconds.
+
+    :param retry_after: value of the header
+    :type retry_after: str
+    :return: the delay in seconds, None if the header can not be parsed.
+    """
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+def payload_size(files: dict = None) -> int:
+    """
+    It measures the multipart content of a request (the scheduler compares latencies
+    relative to the size of the requests).
+
+    :param files: multipart content of the request
+    :type files: dict
+    :return: the number of characters (or bytes) of the content.
+    """
+    if not files:
+        return 0
+    return sum(len(value) for value in files.values() if isinstance(value, (str, bytes)))
+
+
+def backoff_delay(backoff_factor: float, attempt: int, response=None,
+                  max_delay: float = 60.0) -> float:
+    """
+    It computes the delay before a retry: the `Retry-After` header of the response if any,
+    else an exponential backoff, at most `max_delay` seconds.
+
+    :param backoff_factor: the backoff factor
+    :type backoff_factor: float
+    :param attempt: the number of the failed attempt (from 0)
+    :type attempt: int
+    :param response: the response of the failed attempt (None on connection errors)
+    :param max_delay: the maximum delay in seconds (a server can ask for any `Retry-After`)
+    :type max_delay: float
+    :return: the delay in seconds.
+    """
+    if response is not None and "Retry-After" in response.headers:
+        delay = retry_after_delay(response.headers["Retry-After"])
+        if delay is not None:
+            return min(delay, max_delay)
+    return min(backoff_factor * (2 ** attempt), max_delay)
+
+
+def log_responses(response_batch: list, verbose: bool) -> None:
+    """
+    It logs the failed requests and the error status codes of a batch of responses.
+
+    :param response_batch: a list of responses (or exceptions)
+    :type response_batch: list
+    :param verbose: if True, the client will print out the status of each request
+    :type verbose: bool
+    """
+    def client_log(msg: str) -> None:
+        if verbose:
+            logging.warning(msg)
+
+    # Manage response status code :
+    # cf. https://nerd.readthedocs.io/en/latest/restAPI.html#response-status-codes
+    for idx, response in enumerate(response_batch):
+        if isinstance(response, Exception):
+            client_log(f"Request {idx}. Request failed: {response!r}.")
+        elif response.status_code == 400:
+            client_log(f"Request {idx}. Wrong request, missing parameters, "
+                       "missing header, text too short (<= 5 characters). (400)")
+        elif response.status_code == 500:
+            client_log(
+                f"Request {idx}. Entity-Fishing API service seems broken. (500)")
+        elif response.status_code == 404:
+            client_log(
+                f"Request {idx}. Property was not found in request body. (404)")
+        elif response.status_code == 406:
+            client_log(
+                f"Request {idx}. Language is not supported by Entity-Fishing. (406)")
+
+
+class AsyncEntityFishingClient(BaseClient):
+    """Asyncio HTTP client for the Entity-fishing API (based on `httpx`)."""
+
+    def __init__(self,
+                 max_concurrency: int = 100,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = 60.0,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 max_backoff: float = 60.0,
+                 scheduler: RequestScheduler = None,
+                 endpoints: EndpointPool = None,
+                 metrics: Metrics = None,
+                 request_format: str = "multipart",
+                 request_compression: Optional[str] = None):
+        """
+        `AsyncEntityFishingClient` keeps many requests in flight on a single event loop,
+        bounded by a semaphore. An `httpx.AsyncClient` and a semaphore are created on
+        first use in each event loop, and closed at the end of the last `session` of
+        this loop (or by `aclose`).
+
+        Parameters:
+            max_concurrency (int): maximum number of requests in flight
+            (also the size of the connection pool).
+            connect_timeout (float): seconds to wait for a connection to be established.
+            read_timeout (float): seconds to wait for the server to send a response.
+            max_retries (int): number of retries on connection errors and on
+            429/5xx responses (0 disables retries).
+            backoff_factor (float): exponential backoff factor between retries, a
+            `Retry-After` header sent by the server takes precedence.
+            max_backoff (float): maximum delay between retries in seconds.
+            scheduler (RequestScheduler): admission of the requests (rate limit and
+            adaptive concurrency), each attempt is admitted separately.
+            endpoints (EndpointPool): endpoints across which relative urls are balanced
+            (a failed attempt fails over to another endpoint).
+            metrics (Metrics): records the latency, queue wait, retries and size of each request.
+            request_format (str): bodies sent as "multipart" form data or as "json".
+            request_compression (str): compression of the bodies ("gzip" or "deflate"),
+            None to send them uncompressed.
+        """
+        super().__init__(max_retries, backoff_factor, max_backoff, scheduler, endpoints, metrics,
+                         request_format, request_compression)
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # connections of each event loop using the client (an `httpx.AsyncClient` and its
+        # semaphore are bound to the loop they were created on)
+        self._loops = weakref.WeakKeyDictionary()
+        # number of open `session` scopes of each event loop
+        self._sessions = weakref.WeakKeyDictionary()
+
+    def __getstate__(self) -> dict:
+        # the connections stay with the event loops of this process
+        state = self.__dict__.copy()
+        del state["_loops"], state["_sessions"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._loops = weakref.WeakKeyDictionary()
+        self._sessions = weakref.WeakKeyDictionary()
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator["AsyncEntityFishingClient"]:
+        """
+        It scopes the pooled connections: they are closed when the last session of the running
+        event loop ends, before the loop itself is closed (eg. by `asyncio.run`). The sessions
+        of other event loops (eg. in other threads) are left untouched.
+
+        :return: the client.
+        """
+        loop, state = asyncio.get_running_loop(), self._state()
+        self._sessions[loop] = self._sessions.get(loop, 0) + 1
+        try:
+            yield self
+        finally:
+            self._sessions[loop] -= 1
+            if self._sessions[loop] == 0 and self._loops.get(loop) is state:
+                await self.aclose()
+
+    def _state(self) -> "_LoopState":
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            if httpx is None:
+                raise ImportError("The asynchronous Entity-fishing client requires `httpx`, "
+                                  "install it with `pip install spacyfishing[async]`.")
+            state = _LoopState(
+                client=httpx.AsyncClient(
+                    headers={"Accept": "application/json"},
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(max_connections=self.max_concurrency,
+                                        max_keepalive_connections=self.max_concurrency)),
+                semaphore=asyncio.Semaphore(self.max_concurrency))
+            self._loops[loop] = state
+        return state
+
+    async def request(self, method: str, url: str, params: dict = None, files: dict = None):
+        """
+        It sends a single request (retried with exponential backoff on connection
+        errors and 429/5xx responses) once a slot of the semaphore is free.
+
+        :param method: HTTP method ("GET" or "POST")
+        :type method: str
+        :param url: the url to send the request to
+        :type url: str
+        :param params: query string parameters
+        :type params: dict
+        :param files: multipart content of the request
+        :type files: dict
+        :return: the `httpx.Response`.
+        """
+        state = self._state()
+        stage, submitted = current_stage(), perf_counter()
+        body = self.encode(files)
+        if body.content is not None:
+            files = None
+        attempt, tried, sent = 0, [], None
+        while True:
+            response = None
+            async with state.semaphore:
+                # waiting for a slot does not count as outstanding on an endpoint
+                if self.scheduler is not None:
+                    await self.scheduler.aacquire()
+                endpoint = self.acquire_endpoint(url, tried)
+                start = perf_counter()
+                sent = start if sent is None else sent
+                try:
+                    response = await state.client.request(
+                        method, url if endpoint is None else endpoint.url + url,
+                        params=params, files=files, content=body.content, headers=body.headers)
+                except httpx.TransportError:
+                    if attempt >= self.retry.max_retries:
+                        self._observe(stage, submitted, sent, attempt, None)
+                        raise
+                except Exception:
+                    # not retried (eg. an invalid url, or a cancelled task): still a failed request
+                    self._observe(stage, submitted, sent, attempt, None)
+                    raise
+                finally:
+                    # the slot is released whatever the outcome (eg. a body that can not be
+                    # decoded, or the task cancelled)
+                    self.release(endpoint, None if response is None else response.status_code,
+                                 perf_counter() - start,
+                                 payload_size(files) if body.content is None
+                                 else len(body.content))
+                if response is not None and (response.status_code not in RETRY_STATUS_CODES
+                                             or attempt >= self.retry.max_retries):
+                    self._observe(stage, submitted, sent, attempt, response)
+                    return response
+            await asyncio.sleep(self._retry_delay(attempt, response, endpoint, tried))
+            attempt += 1
+
+    async def batch(self,
+                    method: str,
+                    url_batch: List[str],
+                    params: dict = None,
+                    files_batch: List[dict] = None) -> list:
+        """
+        It sends a request to each url of `url_batch` with the corresponding files
+        concurrently, and returns the responses in the order of `url_batch`; a request
+        that raised is kept in its slot as the exception instance.
+
+        :param method: HTTP method ("GET" or "POST")
+        :type method: str
+        :param url_batch: a list of urls to send requests to
+        :type url_batch: List[str]
+        :param params: query string parameters shared by all requests
+        :type params: dict
+        :param files_batch: multipart content of each request
+        :type files_batch: List[dict]
+        :return: A list of `httpx.Response` (or exceptions), aligned with `url_batch`.
+        """
+        if files_batch is None:
+            files_batch = [None for _ in url_batch]
+        return await asyncio.gather(*[
+            self.request(method, url, params, files) for url, files in zip(url_batch, files_batch)
+        ], return_exceptions=True)
+
+    async def aclose(self) -> None:
+        """Release the pooled connections of the running event loop."""
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.client.aclose()
+
+
+class _LoopState(NamedTuple):
+    """Pooled connections of an `AsyncEntityFishingClient` on one event loop."""
+    client: "httpx.AsyncClient"
+    """Connection-pooled client of the loop."""
+    semaphore: asyncio.Semaphore
+    """Bounds the requests in flight on the loop."""
@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+
+"""config.py
+
+Sections of the configuration of the component: the HTTP clients, the
+request scheduler, the endpoints, the caches, the queries and the output
+attached to the documents. Each section is a dict of the factory config
+(eg. `config={"cache": {"cache_size": 1000}}`), its missing keys take the
+defaults below.
+"""
+
+from typing import List, NamedTuple, Optional, Type, TypeVar
+
+Section = TypeVar("Section", bound=tuple)
+
+
+class ClientConfig(NamedTuple):
+    """HTTP clients (section `client`)."""
+    max_workers: int = 20
+    """Number of requests sent concurrently by a batch."""
+    pool_maxsize: int = 20
+    """Number of keep-alive connections kept to the API."""
+    connect_timeout: float = 10.0
+    """Seconds to wait for a connection to the API."""
+    read_timeout: float = 60.0
+    """Seconds to wait for a response of the API."""
+    max_retries: int = 3
+    """Retries on connection errors and on 429/5xx responses (0 disables retries)."""
+    backoff_factor: float = 0.5
+    """Exponential backoff factor between retries (a `Retry-After` header takes precedence)."""
+    max_backoff: float = 60.0
+    """Maximum delay between retries in seconds (caps the `Retry-After` header)."""
+    async_concurrency: int = 100
+    """Maximum number of requests in flight with the asynchronous client (`apipe`)."""
+    request_format: str = "multipart"
+    """Queries sent as "multipart" form data or as a "json" body."""
+    request_compression: Optional[str] = None
+    """Compression of the queries sent ("gzip" or "deflate"), None to send them uncompressed."""
+    streaming_window: int = 0
+    """Documents in flight of the streaming `pipe` (0: batches processed in lock-step)."""
+
+
+class SchedulerConfig(NamedTuple):
+    """Admission of the requests (section `scheduler`)."""
+    rate_limit: float = 0.0
+    """Maximum number of requests per second sent to the API (0 disables the limit)."""
+    rate_burst: int = 0
+    """Requests allowed at once above `rate_limit` (0: one second worth of requests)."""
+    adaptive_concurrency: bool = False
+    """Adapt the number of requests in flight to the health of the API (AIMD)."""
+    min_concurrency: int = 1
+    """Lowest number of requests in flight with `adaptive_concurrency`."""
+
+
+class EndpointsConfig(NamedTuple):
+    """Load balancing across the urls of `api_ef_base` (section `endpoints`)."""
+    endpoint_weights: List[float] = []
+    """Weight of each url (defaults to 1 for all)."""
+    load_balancing: str = "least_outstanding"
+    """"least_outstanding" (fewest requests in flight) or "round_robin" (weighted round robin)."""
+    failure_threshold: int = 5
+    """Consecutive failures (connection errors, 5xx) that eject an url (circuit breaker)."""
+    recovery_timeout: float = 30.0
+    """Seconds before an ejected url receives a trial request."""
+
+
+class CacheConfig(NamedTuple):
+    """Caches of the responses and of the concepts (section `cache`)."""
+    cache_size: int = 0
+    """Number of responses kept in the in-memory cache (0 disables it)."""
+    cache_ttl: Optional[float] = None
+    """Responses (and concepts) older than `cache_ttl` seconds are not served (None: never)."""
+    cache_path: Optional[str] = None
+    """Path of a SQLite database used as on-disk cache of the responses (None disables it)."""
+    concept_lookup: bool = False
+    """With `extra_info`, fetch each distinct concept of a batch once (`kb/concept`)."""
+    concept_cache_size: int = 10000
+    """Number of concepts kept in memory."""
+
+
+class QueryConfig(NamedTuple):
+    """Queries of the documents (section `queries`)."""
+    chunk_size: int = 0
+    """Split documents longer than `chunk_size` characters into chunks (0 disables chunking)."""
+    chunk_max_entities: int = 0
+    """Maximum number of entities of a chunk (0: no limit)."""
+    chunk_boundary: str = "sentence"
+    """Split documents at "sentence" or "paragraph" boundaries."""
+    chunk_overlap: int = 0
+    """Characters of context added on both sides of a chunk."""
+    group_short_texts: int = 0
+    """With `pipe`, group the texts of at most `group_short_texts` characters (0 disables it)."""
+    group_max_chars: int = 1000
+    """Maximum number of characters of a group of short texts."""
+    group_by: Optional[str] = None
+    """`Doc` extension whose value the documents of a group share (None: any)."""
+    preflight: bool = False
+    """Do not send the documents without entities to link, or with a text too short."""
+    exclude_labels: List[str] = []
+    """Labels of the entities neither linked nor sent as context."""
+    incremental: bool = False
+    """Reuse the links stored in the documents processed again (cf. `incremental`)."""
+    incremental_window: int = 200
+    """Characters of context sent on both sides of a new entity with `incremental`."""
+    link_index_path: Optional[str] = None
+    """Path of a local index of the links of surface forms (None disables it)."""
+    link_index_threshold: float = 0.9
+    """Minimum agreement and mean score of the past links of a mention to link it locally."""
+    link_index_min_count: int = 2
+    """Minimum number of past links of a mention to link it locally."""
+
+
+class OutputConfig(NamedTuple):
+    """Results attached to the documents (section `output`)."""
+    annotations: str = "full"
+    """Raw responses attached to `doc._.annotations`: "full", "compact" or "none"."""
+    annotations_max_entities: int = 0
+    """Maximum number of entities of each raw response attached (0: no limit)."""
+    link_table: bool = False
+    """Store the links of a document in a single array-backed table."""
+    alignment_mode: str = "strict"
+    """Alignment of the offsets of the entities to tokens: "strict", "contract" or "expand"."""
+    metrics_exporter: Optional[str] = None
+    """"prometheus" or "opentelemetry" to report the metrics to these libraries."""
+
+
+def read_section(section: Type[Section], values: Optional[dict], name: str) -> Section:
+    """
+    It reads a section of the configuration of the component.
+
+    :param section: the class of the section (eg. `ClientConfig`)
+    :type section: Type[NamedTuple]
+    :param values: the settings of the section (None: the defaults)
+    :type values: Optional[dict]
+    :param name: the name of the section in the factory config
+    :type name: str
+    :return: the section, with the defaults of the missing settings.
+    """
+    values = dict(values or {})
+    unknown = sorted(set(values) - set(section._fields))
+    if unknown:
+        raise ValueError(f"Unknown settings in the `{name}` section: {', '.join(unknown)}.")
+    return section(**values)
+
+
+def default_config(section: Type[Section]) -> dict:
+    """
+    It returns the defaults of a section as a factory config dict.
+
+    :param section: the class of the section (eg. `ClientConfig`)
+    :type section: Type[NamedTuple]
+    :return: the settings of the section.
+    """
+    return dict(section()._asdict())
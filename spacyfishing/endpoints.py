@@ -0,0 +1,259 @@
+# -*- coding: UTF-8 -*-
+
+"""endpoints.py
+
+Client-side load balancing across several Entity-fishing endpoints:
+least-outstanding-requests or smooth weighted round robin selection,
+per-endpoint statistics, and a circuit breaker that ejects failing
+endpoints and lets a trial request through after a recovery timeout.
+"""
+
+import time
+
+from typing import Callable, List
+
+from .resources import Lockable
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker of an endpoint: ejects it after consecutive failures."""
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        `CircuitBreaker` opens after `failure_threshold` consecutive failures, and lets a
+        trial request through (half open) `recovery_timeout` seconds later.
+
+        Parameters:
+            failure_threshold (int): consecutive failures that open the circuit breaker.
+            recovery_timeout (float): seconds before an open circuit breaker lets a trial
+            request through.
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def recovered(self, now: float) -> bool:
+        """
+        It tells whether requests can be sent: the circuit breaker is not open, or its
+        recovery timeout is over.
+
+        :param now: the current time (`time.monotonic`)
+        :type now: float
+        :return: True if a request can be sent.
+        """
+        return self.state != OPEN or now - self.opened_at >= self.recovery_timeout
+
+    def available(self, outstanding: int, now: float) -> bool:
+        """
+        It tells whether a request can be sent now (a single trial request when half open).
+
+        :param outstanding: the requests in flight on the endpoint
+        :type outstanding: int
+        :param now: the current time (`time.monotonic`)
+        :type now: float
+        :return: True if a request can be sent.
+        """
+        if self.state == OPEN and self.recovered(now):
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return outstanding == 0
+        return self.state == CLOSED
+
+    def record(self, success: bool) -> None:
+        """
+        It records the outcome of a request.
+
+        :param success: False on connection errors and 5xx responses
+        :type success: bool
+        """
+        if success:
+            self.close()
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.open()
+
+    def open(self) -> None:
+        """It ejects the endpoint."""
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def close(self) -> None:
+        """It brings the endpoint back."""
+        self.consecutive_failures = 0
+        self.state = CLOSED
+
+
+class Endpoint:
+    """An Entity-fishing endpoint with its statistics and circuit breaker."""
+
+    def __init__(self, url: str, weight: float = 1.0, breaker: CircuitBreaker = None):
+        """
+        `Endpoint` describes a base url of the Entity-fishing API.
+
+        Parameters:
+            url (str): base url of the API (ends with "/").
+            weight (float): share of the traffic relative to the other endpoints.
+            breaker (CircuitBreaker): circuit breaker of the endpoint (defaults to
+            `CircuitBreaker()`).
+        """
+        self.url = url if url.endswith("/") else url + "/"
+        self.weight = weight
+        self.outstanding = 0
+        self.requests = 0
+        self.latency_average = None
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.current_weight = 0.0
+
+    @property
+    def state(self) -> str:
+        """State of the circuit breaker ("closed", "open" or "half_open")."""
+        return self.breaker.state
+
+    @property
+    def stats(self) -> dict:
+        """Statistics of the endpoint."""
+        return {
+            "state": self.state,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.breaker.failures,
+            "latency_average": self.latency_average,
+        }
+
+
+class EndpointPool(Lockable):
+    """Thread-safe selection of the endpoint of each request."""
+
+    def __init__(self,
+                 urls: List[str],
+                 weights: List[float] = None,
+                 strategy: str = "least_outstanding",
+                 failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0):
+        """
+        `EndpointPool` balances the requests across `urls`.
+
+        Parameters:
+            urls (List[str]): base urls of the API.
+            weights (List[float]): weight of each url (defaults to 1 for all).
+            strategy (str): "least_outstanding" (fewest requests in flight relative to the
+            weight) or "round_robin" (smooth weighted round robin).
+            failure_threshold (int): consecutive failures (connection errors, 5xx) that eject
+            an endpoint (open its circuit breaker).
+            recovery_timeout (float): seconds before an ejected endpoint receives a trial request.
+        """
+        if len(urls) == 0:
+            raise ValueError("At least one Entity-fishing endpoint is required.")
+        if not weights:
+            weights = [1.0 for _ in urls]
+        if len(weights) != len(urls):
+            raise ValueError("`endpoint_weights` must have one weight per endpoint.")
+        if strategy not in ("least_outstanding", "round_robin"):
+            raise ValueError(f"Unknown load balancing strategy: {strategy}.")
+        self.endpoints = [Endpoint(url, weight, CircuitBreaker(failure_threshold, recovery_timeout))
+                          for url, weight in zip(urls, weights)]
+        self.strategy = strategy
+        super().__init__()
+
+    def _select(self, candidates: List[Endpoint]) -> Endpoint:
+        if self.strategy == "round_robin":
+            total = sum(endpoint.weight for endpoint in candidates)
+            for endpoint in candidates:
+                endpoint.current_weight += endpoint.weight
+            selected = max(candidates, key=lambda endpoint: endpoint.current_weight)
+            selected.current_weight -= total
+            return selected
+        return min(candidates, key=lambda endpoint: (endpoint.outstanding + 1) / endpoint.weight)
+
+    def acquire(self, exclude: List[Endpoint] = ()) -> Endpoint:
+        """
+        It selects the endpoint of a request among the available endpoints not in `exclude`
+        (failover). If none is available, the endpoint ejected for the longest time is used.
+
+        :param exclude: endpoints already tried for this request
+        :type exclude: List[Endpoint]
+        :return: the endpoint (its outstanding requests are incremented).
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude
+                          and endpoint.breaker.available(endpoint.outstanding, now)]
+            if len(candidates) == 0:
+                candidates = [endpoint for endpoint in self.endpoints
+                              if endpoint not in exclude] or self.endpoints
+                selected = min(candidates, key=lambda endpoint: (endpoint.state != CLOSED,
+                                                                 endpoint.breaker.opened_at))
+            else:
+                selected = self._select(candidates)
+            selected.outstanding += 1
+            return selected
+
+    def has_alternative(self, exclude: List[Endpoint]) -> bool:
+        """
+        It tells whether an available endpoint has not been tried yet.
+
+        :param exclude: endpoints already tried for this request
+        :type exclude: List[Endpoint]
+        :return: True if a request can fail over to another endpoint.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return any(endpoint not in exclude and endpoint.breaker.recovered(now)
+                       for endpoint in self.endpoints)
+
+    def release(self, endpoint: Endpoint, success: bool, latency: float) -> None:
+        """
+        It reports the outcome of a request to its endpoint.
+
+        :param endpoint: the endpoint of the request
+        :type endpoint: Endpoint
+        :param success: False on connection errors and 5xx responses
+        :type success: bool
+        :param latency: the duration of the request in seconds
+        :type latency: float
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            if endpoint.latency_average is None:
+                endpoint.latency_average = latency
+            else:
+                endpoint.latency_average = 0.9 * endpoint.latency_average + 0.1 * latency
+            endpoint.breaker.record(success)
+
+    def check_health(self, probe: Callable[[str], bool]) -> dict:
+        """
+        It probes every endpoint (e.g. with the `isalive` service), closes the circuit breaker
+        of the healthy ones and ejects the others.
+
+        :param probe: a function taking a base url and returning True if the endpoint is healthy
+        :type probe: Callable[[str], bool]
+        :return: the health of each endpoint (by url).
+        """
+        health = {endpoint.url: probe(endpoint.url) for endpoint in self.endpoints}
+        with self._lock:
+            for endpoint in self.endpoints:
+                if health[endpoint.url]:
+                    endpoint.breaker.close()
+                else:
+                    endpoint.breaker.open()
+        return health
+
+    @property
+    def stats(self) -> dict:
+        """Statistics of each endpoint (by url)."""
+        with self._lock:
+            return {endpoint.url: endpoint.stats for endpoint in self.endpoints}
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        for endpoint in self.endpoints:
+            endpoint.outstanding = 0
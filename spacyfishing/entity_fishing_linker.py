@@ -6,37 +6,83 @@ SpaCy wrapper to call Entity-fishing API
 as disambiguation and entity linking component.
 """
 
-import requests
-import concurrent.futures
-import json
-import logging
+import asyncio
+import collections
+
+from pathlib import Path
+from time import perf_counter
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple, Union
 
-from email import iterators
-from typing import List, Tuple
+import requests
+import srsly
 
 from spacy import util
 from spacy.language import Language
 from spacy.tokens import Doc, Span
 
+from .alignment import CharIndex
+from .api import EntityFishingAPI
+from .client import EntityFishingClient, log_responses
+from .config import CacheConfig, ClientConfig, EndpointsConfig, OutputConfig, QueryConfig, \
+    SchedulerConfig, default_config, read_section
+from .grouping import group_queries
+from .incremental import StoredLinks, split_unchanged
+from .links import WIKIDATA_URL_BASE, entity_links, extra_links, set_links, set_span_extensions
+from .metrics import Metrics
+from .parsing import decode_response
+from .passes import Passes
+from .payload import prepare_query
+from .storage import set_doc_extensions
+from .streaming import DocStream
+
+
+def set_extensions() -> None:
+    """
+    It registers the `Doc` and `Span` extensions of the component once per process
+    (constructing the component again, e.g. in worker processes, keeps them).
+    """
+    # Set doc extensions to attaches raw response from Entity-Fishing API to doc
+    # (a dict allocated per document, cf. `storage`)
+    set_doc_extensions()
+
+    # Set spans extensions to enhance spans with new information
+    # come from Wikidata knowledge base (cf. `links`).
+    set_span_extensions()
+
 
 @Language.factory("entityfishing", default_config={
     "api_ef_base": "https://cloud.science-miner.com/nerd/service",
     "language": "en",
     "extra_info": False,
     "filter_statements": [],
-    "verbose": False
+    "verbose": False,
+    "client": default_config(ClientConfig),
+    "scheduler": default_config(SchedulerConfig),
+    "endpoints": default_config(EndpointsConfig),
+    "cache": default_config(CacheConfig),
+    "queries": default_config(QueryConfig),
+    "output": default_config(OutputConfig)
 })
 class EntityFishing:
     """EntityFishing component for spaCy pipeline."""
 
+    # wikidata base url (to concatenate QID identifiers)
+    wikidata_url_base = WIKIDATA_URL_BASE
+
     def __init__(self,
                  nlp: Language,
                  name: str,
-                 api_ef_base: str,
+                 api_ef_base: Union[str, List[str]],
                  language: str,
                  extra_info: bool,
                  filter_statements: list,
-                 verbose: bool):
+                 verbose: bool,
+                 client: dict = None,
+                 scheduler: dict = None,
+                 endpoints: dict = None,
+                 cache: dict = None,
+                 queries: dict = None,
+                 output: dict = None):
         """
         `EntityFishing` main class component.
 
@@ -44,7 +90,8 @@ class EntityFishing:
             Show default config for default attributes values.
 
         Parameters:
-            api_ef_base (str): describes url of the entity-fishing API used.
+            api_ef_base (Union[str, List[str]]): describes url of the entity-fishing API used,
+            or a list of urls of equivalent entity-fishing APIs to balance the requests across.
             language (str): matches the language of the resources to
             be disambiguated (matches the language model for the NER task).
             extra_info (bool): attach extra information to spans as normalised term,
@@ -52,53 +99,59 @@ class EntityFishing:
             filter_statements (list): filter others KB ids
             that relies on QID  eg. ['P214', 'P244'].
             verbose (bool): display logging messages.
+            client (dict): HTTP clients, cf. `ClientConfig`.
+            scheduler (dict): admission of the requests, cf. `SchedulerConfig`.
+            endpoints (dict): load balancing across the urls of `api_ef_base`,
+            cf. `EndpointsConfig`.
+            cache (dict): caches of the responses and of the concepts, cf. `CacheConfig`.
+            queries (dict): queries of the documents, cf. `QueryConfig`.
+            output (dict): results attached to the documents, cf. `OutputConfig`.
 
         Attributes:
-            api_ef_base (str): cf. `api_ef_base` in parameters section.
             language (dict): cf. `language` in parameters section.
             prepare the language argument for the query.
-            wikidata_url_base (str): wikidata base url (to concatenate QID identifiers).
             flag_extra (bool): cf. `extra_info` in parameters section.
             filter_statements (list): cf. `filter_statements` in parameters section.
-            verbose (bool): cf. `verbose` in parameters section.
+            metrics (Metrics): latency, size, retries and cache metrics of the requests by
+            stage, durations of the stages and throughput of the batches (hooks are added
+            with `metrics.add_hook`).
+            api (EntityFishingAPI): HTTP clients, request scheduler, endpoints and caches.
+            passes (Passes): queries of the documents and results attached to them.
+            streaming (DocStream): window of documents in flight of the streaming `pipe`
+            (None if `streaming_window` is not set).
         """
-        if not api_ef_base.endswith("/"):
-            api_ef_base += "/"
-        self.api_ef_base = api_ef_base
-        self.language = dict(lang=language)
-        self.wikidata_url_base = "https://www.wikidata.org/wiki/"
-
+        client = read_section(ClientConfig, client, "client")
+        cache = read_section(CacheConfig, cache, "cache")
+        output = read_section(OutputConfig, output, "output")
+        self.language = {"lang": language}
         self.flag_extra = extra_info
         self.filter_statements = filter_statements
-        self.verbose = verbose
-
-        # Set doc extensions to attaches raw response from Entity-Fishing API to doc
-        Doc.set_extension("annotations", default={}, force=True)
-        Doc.set_extension("metadata", default={}, force=True)
-
-        # Set spans extensions to enhance spans with new information
-        # come from Wikidata knowledge base.
-        # default spans :
-        Span.set_extension("kb_qid", default=None, force=True)
-        Span.set_extension("wikipedia_page_ref", default=None, force=True)
-        Span.set_extension("url_wikidata", default=None, force=True)
-        Span.set_extension("nerd_score", default=None, force=True)
-
-        # spans if extra_info set to True
-        Span.set_extension("normal_term", default=None, force=True)
-        Span.set_extension("description", default=None, force=True)
-        Span.set_extension("src_description", default=None, force=True)
-        Span.set_extension("other_ids", default=None, force=True)
+        self.metrics = Metrics(exporter=output.metrics_exporter)
+        self.api = EntityFishingAPI(api_ef_base, language, verbose, client,
+                                    read_section(SchedulerConfig, scheduler, "scheduler"),
+                                    read_section(EndpointsConfig, endpoints, "endpoints"),
+                                    cache, self.metrics)
+        # without the concept look-up, the descriptions of the entities come with the responses
+        self.passes = Passes(language, extra_info and not cache.concept_lookup,
+                             read_section(QueryConfig, queries, "queries"), output)
+        self.streaming = DocStream(client.streaming_window) if client.streaming_window > 0 else None
+
+        set_extensions()
 
     @staticmethod
     def generic_client_batch(method: str,
                              url_batch: List[str],
                              verbose: bool,
                              params: dict = None,
-                             files_batch: List[dict] = None) -> List[requests.Response]:
+                             files_batch: List[dict] = None) -> List[Union[requests.Response,
+                                                                           Exception]]:
         """
         It takes a list of urls and a list of files, and it sends a request to each url with the
-        corresponding file
+        corresponding file. Responses are returned in the order of `url_batch`; a request that
+        raised is kept in its slot as the exception instance.
+
+        Standalone helper (a client without retries, closed afterwards): the component sends its
+        requests through its pooled client (cf. `EntityFishingAPI.batch`).
 
         :param method: str,
         :type method: str
@@ -108,353 +161,323 @@ class EntityFishing:
         :type verbose: bool
         :param params: dict = None,
         :type params: dict
-        :param files_batch: a list of dictionaries, each dictionary containing the file to be annotated
+        :param files_batch: a list of dictionaries, each dictionary containing the file to be
+        annotated
         :type files_batch: List[dict]
-        :return: A list of responses.
+        :return: A list of responses (or exceptions), aligned with `url_batch`.
         """
-        if params is None:
-            params = {}
-        if files_batch is None:
-            files_batch = [{} for url in url_batch]
-
-        def load_url(type_url, type_files):
-            if method == "POST":
-                return requests.post(
-                    url=type_url,
-                    headers={
-                        "Accept": "application/json"
-                    },
-                    files=type_files,
-                    params=params)
-            else:
-                return requests.get(
-                    url=type_url,
-                    headers={
-                        "Accept": "application/json"
-                    },
-                    files=type_files,
-                    params=params)
-
-        response_batch = []
-        resp_err, resp_ok = 0, 0
-        with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-            future_to_url = {executor.submit(
-                load_url, type_url, type_files): (type_url, type_files) for type_url, type_files in zip(url_batch, files_batch)}
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    response_batch.append(future.result())
-                except Exception as exc:
-                    resp_err = resp_err + 1
-                else:
-                    resp_ok = resp_ok + 1
-
-        def client_log(msg: str) -> None:
-            if verbose:
-                logging.warning(msg)
-
-        # Manage response status code :
-        # cf. https://nerd.readthedocs.io/en/latest/restAPI.html#response-status-codes
-        for idx, response in enumerate(response_batch):
-            if response.status_code == 400:
-                client_log(f"Request {idx}. Wrong request, missing parameters, "
-                           "missing header, text too short (<= 5 characters). (400)")
-            elif response.status_code == 500:
-                client_log(
-                    f"Request {idx}. Entity-Fishing API service seems broken. (500)")
-            elif response.status_code == 404:
-                client_log(
-                    f"Request {idx}. Property was not found in request body. (404)")
-            elif response.status_code == 406:
-                client_log(
-                    f"Request {idx}. Language is not supported by Entity-Fishing. (406)")
-
+        client = EntityFishingClient(max_retries=0)
+        try:
+            response_batch = client.batch(method=method, url_batch=url_batch, params=params,
+                                          files_batch=files_batch)
+        finally:
+            client.close()
+        log_responses(response_batch, verbose)
         return response_batch
 
     @staticmethod
-    def process_response(response: requests.models.Response) -> Tuple[dict, dict]:
+    def process_response(response: Union[requests.models.Response,
+                                          Exception]) -> Tuple[dict, dict]:
         """
-        It takes a response object from the `requests` library and returns a tuple of two dictionaries.
+        It takes a response object from the `requests` library (or `httpx` with the asynchronous
+        client) and returns a tuple of two dictionaries.
         The first dictionary is the JSON response from the API, and the second dictionary contains
-        metadata about the response
+        metadata about the response. If the request failed (no response), the JSON response is
+        empty and the metadata describes the error.
 
-        :param response: The response object returned by the requests library
-        :type response: requests.models.Response
+        :param response: The response object returned by the HTTP client, or the exception raised
+        :type response: Union[requests.models.Response, Exception]
         :return: A tuple of two dictionaries.
         """
-        try:
-            res_json = response.json()
-        except json.decoder.JSONDecodeError:
-            res_json = {}
-
-        metadata = {
-            "status_code": response.status_code,
-            "reason": response.reason,
-            "ok": response.ok,
-            "encoding": response.encoding
-        }
-
-        return res_json, metadata
+        return decode_response(response)
 
     @staticmethod
-    def prepare_data(text: str, terms: str, entities: list, language: dict, full: bool = False) -> dict:
+    def prepare_data(text: str, terms: str, entities: list, language: dict,
+                     full: bool = False) -> dict:
         """
-        > The function takes in a text, a list of entities, a language dictionary and a boolean value.
-        It then returns a dictionary with a key called "query" and a value that is a JSON object
+        > The function takes in a text, a list of entities, a language dictionary and a boolean
+        value. It then returns a dictionary with a key called "query" and a value that is a JSON
+        object
 
         :param text: The text to be analyzed
         :type text: str
         :param terms: the terms to be searched for
         :type terms: str
-        :param entities: list of entities in the text
+        :param entities: list of entities in the text (spans, or entities of a query)
         :type entities: list
         :param language: the language of the text
         :type language: dict
-        :param full: if True, the response will contain the full text of the article, defaults to False
+        :param full: if True, the response will contain the full text of the article, defaults
+        to False
         :type full: bool (optional)
         :return: A dictionary with a key of "query" and a value of a json object.
         """
-        return {
-            "query": json.dumps({
-                "text": text,
-                "shortText": terms,
-                "language": language,
-                "entities": [
-                    {
-                        "rawName": ent.text,
-                        "offsetStart": ent.start_char,
-                        "offsetEnd": ent.end_char,
-                    } for ent in entities
-                ],
-                "mentions": [],
-                "customisation": "generic",
-                "full": "true" if full else "false"
-            }, ensure_ascii=False)
-        }
-
-    def updated_entities(self, doc: Doc, response: list) -> None:
-        """
-        > The function `updated_entities` takes a `Doc` object and a list of entities as input. It then
-        iterates over the list of entities and updates the `Doc` object with the information contained
-        in the list of entities
+        return prepare_query(text, terms, entities, language, full)
+
+    def updated_entities(self, doc: Doc, response: list, concepts: dict = None) -> None:
+        """
+        > The function `updated_entities` takes a `Doc` object and a list of entities as input.
+        It then iterates over the list of entities and updates the `Doc` object with the
+        information contained in the list of entities
 
         :param doc: the document to be processed
         :type doc: Doc
         :param response: the response from the NERD API
         :type response: list
+        :param concepts: concepts fetched by the concept look-up (by Wikipedia id), used as
+        extra information instead of the entity itself
+        :type concepts: dict
         """
-        for entity in response:
-            try:
-                span = doc.char_span(start_idx=entity['offsetStart'],
-                                     end_idx=entity['offsetEnd'])
-                try:
-                    span._.kb_qid = str(entity['wikidataId'])
-                    span._.url_wikidata = self.wikidata_url_base + span._.kb_qid
-                except KeyError:
-                    pass
-                try:
-                    span._.wikipedia_page_ref = str(entity["wikipediaExternalRef"])
-                    # if flag_extra : search other info on entity
-                    # => attach extra entity info to span
-                    if self.flag_extra:
-                        self.look_extra_informations_on_entity(span, entity)
-                except KeyError:
-                    pass
-                try:
-                    span._.nerd_score = entity['confidence_score']
-                except KeyError:
-                    pass
-            except AttributeError:
-                pass
+        # all the offsets are resolved to tokens at once (cf. `alignment_mode`)
+        offsets = [(entity['offsetStart'], entity['offsetEnd']) for entity in response]
+        bounds_batch = CharIndex(doc).token_bounds(offsets, self.passes.output.alignment_mode)
+        spans, links_batch = [], []
+        for entity, bounds in zip(response, bounds_batch):
+            if bounds is None:
+                continue
+            spans.append(Span(doc, *bounds))
+            links_batch.append(entity_links(entity, self.flag_extra, self.filter_statements,
+                                            concepts, self.passes.full_descriptions))
+        doc._.metadata["unaligned_entities"] = len(response) - len(spans)
+        # the Wikidata url is derived from the QID on demand
+        set_links(doc, links_batch, spans, self.passes.output.link_table)
 
     # ~ Entity-fishing call service methods ~:
-    def concept_look_up_batch(self, wiki_id_batch: str) -> List[requests.Response]:
+    def concept_look_up_batch(self,
+                              wiki_id_batch: List[str]) -> List[Union[requests.Response,
+                                                                      Exception]]:
         """
         > This function takes a list of wikipedia ids and returns a list of responses from the API
 
         :param wiki_id_batch: a list of wikipedia ids
-        :type wiki_id_batch: str
+        :type wiki_id_batch: List[str]
         :return: A list of requests.Response objects.
         """
-        url_concept_lookup_batch = [
-            self.api_ef_base + "kb/concept/" + wiki_id for wiki_id in wiki_id_batch]
-        return self.generic_client_batch(method="GET",
-                                         url_batch=url_concept_lookup_batch,
-                                         params=self.language,
-                                         verbose=self.verbose)
+        return self.api.concept_look_up_batch(wiki_id_batch)
 
-    def disambiguate_text_batch(self, files_batch: List[dict]) -> List[requests.Response]:
+    def disambiguate_text_batch(self,
+                                files_batch: List[dict]) -> List[Union[requests.Response,
+                                                                       Exception]]:
         """
         > The function `disambiguate_text_batch` takes a list of dictionaries as input, where each
-        dictionary contains the text to be disambiguated and the corresponding language. The function
-        returns a list of responses, where each response contains the disambiguated text
+        dictionary contains the text to be disambiguated and the corresponding language. The
+        function returns a list of responses, where each response contains the disambiguated text
 
         :param files_batch: a list of dictionaries, each dictionary containing the following keys:
         :type files_batch: List[dict]
         :return: A list of responses.
         """
-        url_disambiguate = self.api_ef_base + "disambiguate"
-        url_disambiguate_batch = [url_disambiguate for file in files_batch]
-        return self.generic_client_batch(method='POST',
-                                         url_batch=url_disambiguate_batch,
-                                         files_batch=files_batch,
-                                         verbose=self.verbose)
+        return self.api.disambiguate(files_batch)
 
     def look_extra_informations_on_entity(self, span: Span, res_desc: dict) -> None:
         """
-        It takes a span and a dictionary of information about the entity, and adds the information to
-        the span
+        It takes a span and a dictionary of information about the entity, and adds the
+        information to the span
 
         :param span: The Span object that the extension is being applied to
         :type span: Span
         :param res_desc: the result of the query to Wikidata
         :type res_desc: dict
         """
-        # normalised term name
-        try:
-            span._.normal_term = res_desc['preferredTerm']
-        except KeyError:
-            pass
-        # description and source description (filter by language)
-        try:
-            span._.description = res_desc['definitions'][0]["definition"]
-            span._.src_description = res_desc['definitions'][0]["source"]
-        except KeyError:
-            pass
-        except IndexError:
-            pass
-        # others identifiers attach to QID
-        # in Wikidata KB with filter properties or not
-        try:
-            ids = []
-            for content in res_desc['statements']:
-                new_id = {
-                    k: content[k] for k in ['propertyName',
-                                            'propertyId',
-                                            'value']
-                }
-                if len(self.filter_statements) != 0:
-                    if content['propertyId'] in self.filter_statements:
-                        ids.append(new_id)
-                else:
-                    ids.append(new_id)
-
-            span._.other_ids = ids
-        except KeyError:
-            pass
-        except json.decoder.JSONDecodeError:
-            pass
+        for name, value in extra_links(res_desc, self.filter_statements).items():
+            span._.set(name, value)
 
     def main_disambiguation_process_batch(self,
                                           text_batch: List[str],
                                           terms_batch: List[str],
-                                          entities_batch: List[list]) -> List[Tuple[dict, dict, list]]:
+                                          entities_batch: List[list]) -> List[Tuple[dict, dict,
+                                                                                    list]]:
         """
-        It takes a batch of text, terms and entities, and returns a batch of disambiguated entities
+        It takes a batch of text, terms and entities, and returns a batch of disambiguated
+        entities (the queries already answered are served from the response cache, if enabled)
 
         :param text_batch: a list of strings, each string is a text to be disambiguated
         :type text_batch: List[str]
         :param terms_batch: a list of strings, each string is a list of terms separated by a space
         :type terms_batch: List[str]
-        :param entities_batch: a list of lists of entities, where each entity is a dictionary with the
-        following keys:
+        :param entities_batch: a list of lists of entities, where each entity is a dictionary
+        with the following keys:
         :type entities_batch: List[list]
-        :return: A list of tuples, each tuple containing the response, metadata, and entities_enhanced.
-        """
-        data_to_post_batch = [self.prepare_data(text=text,
-                                                terms=terms,
-                                                entities=entities,
-                                                language=self.language,
-                                                full=self.flag_extra) for text, terms, entities in zip(text_batch, terms_batch, entities_batch)]
-        reqs = self.disambiguate_text_batch(files_batch=data_to_post_batch)
-
-        response_tuples = []
-        for req in reqs:
-            res, metadata = self.process_response(response=req)
-            try:
-                entities_enhanced = res['entities']
-            except KeyError:
-                entities_enhanced = []
-            response_tuples.append((res, metadata, entities_enhanced))
-        return response_tuples
+        :return: A list of tuples, each tuple containing the response, metadata, and
+        entities_enhanced.
+        """
+        return self.api.process_queries(self.passes.queries(text_batch, terms_batch,
+                                                            entities_batch),
+                                        self.passes.response_tuple, self.passes.cache_variant)
+
+    async def amain_disambiguation_process_batch(self,
+                                                 text_batch: List[str],
+                                                 terms_batch: List[str],
+                                                 entities_batch: List[list]) -> List[Tuple[dict,
+                                                                                           dict,
+                                                                                           list]]:
+        """
+        Asynchronous counterpart of `main_disambiguation_process_batch`: all the requests of
+        the batch are in flight at once, bounded by `async_concurrency`.
 
-    def process_single_doc_after_call(self, doc: Doc, result_from_ef_text) -> Doc:
+        :param text_batch: a list of strings, each string is a text to be disambiguated
+        :type text_batch: List[str]
+        :param terms_batch: a list of strings, each string is a list of terms separated by a space
+        :type terms_batch: List[str]
+        :param entities_batch: a list of lists of entities
+        :type entities_batch: List[list]
+        :return: A list of tuples, each tuple containing the response, metadata, and
+        entities_enhanced.
+        """
+        return await self.api.aprocess_queries(self.passes.queries(text_batch, terms_batch,
+                                                                   entities_batch),
+                                               self.passes.response_tuple,
+                                               self.passes.cache_variant)
+
+    def _look_up_concepts(self, results: list, timings: dict = None) -> Optional[dict]:
+        # with `concept_lookup`, the concepts of all the entities of a batch of results, else
+        # only those of the entities linked by the `link_index` (their extra information is
+        # not in the responses); None if no concept is looked up
+        if not self.flag_extra or (self.passes.full_descriptions
+                                   and self.passes.link_index is None):
+            return None
+        with self.metrics.stage("concepts", timings):
+            return self.api.look_up_concepts(results, local_only=self.passes.full_descriptions)
+
+    async def _alook_up_concepts(self, results: list, timings: dict = None) -> Optional[dict]:
+        if not self.flag_extra or (self.passes.full_descriptions
+                                   and self.passes.link_index is None):
+            return None
+        with self.metrics.stage("concepts", timings):
+            return await self.api.alook_up_concepts(results,
+                                                    local_only=self.passes.full_descriptions)
+
+    def _text_pass(self, docs: List[Doc], timings: dict) -> List[Tuple[dict, dict, list]]:
+        # first pass (text method of the Entity-Fishing service): the chunks of all the
+        # documents are sent concurrently, then merged back in document coordinates
+        with self.metrics.stage("text", timings):
+            batch = self.passes.text_batch(docs)
+            results = self.main_disambiguation_process_batch(*group_queries(batch.groups))
+            return self.passes.merge_text_batch(docs, batch, results)
+
+    async def _atext_pass(self, docs: List[Doc], timings: dict) -> List[Tuple[dict, dict, list]]:
+        with self.metrics.stage("text", timings):
+            batch = self.passes.text_batch(docs)
+            results = await self.amain_disambiguation_process_batch(*group_queries(batch.groups))
+            return self.passes.merge_text_batch(docs, batch, results)
+
+    def _terms_pass(self, docs: List[Doc], result_from_ef_text_batch: list,
+                    timings: dict) -> List[Doc]:
+        # second pass: the "nil clustering" queries of all the documents are gathered and sent
+        # concurrently as a single batch, then merged back into their own document
+        terms_idx, queries = self.passes.terms_batch(docs, result_from_ef_text_batch)
+        result_from_ef_terms_batch = []
+        if len(terms_idx) != 0:
+            with self.metrics.stage("terms", timings):
+                result_from_ef_terms_batch = self.main_disambiguation_process_batch(*queries)
+        concepts = self._look_up_concepts(list(result_from_ef_text_batch)
+                                          + result_from_ef_terms_batch, timings)
+        return self._attach_results(docs, result_from_ef_text_batch,
+                                    dict(zip(terms_idx, result_from_ef_terms_batch)), concepts)
+
+    async def _aterms_pass(self, docs: List[Doc], result_from_ef_text_batch: list,
+                           timings: dict) -> List[Doc]:
+        terms_idx, queries = self.passes.terms_batch(docs, result_from_ef_text_batch)
+        result_from_ef_terms_batch = []
+        if len(terms_idx) != 0:
+            with self.metrics.stage("terms", timings):
+                result_from_ef_terms_batch = await self.amain_disambiguation_process_batch(
+                    *queries)
+        concepts = await self._alook_up_concepts(list(result_from_ef_text_batch)
+                                                 + result_from_ef_terms_batch, timings)
+        return self._attach_results(docs, result_from_ef_text_batch,
+                                    dict(zip(terms_idx, result_from_ef_terms_batch)), concepts)
+
+    def _attach_results(self, docs: List[Doc], result_from_ef_text_batch: list,
+                        result_from_ef_terms_batch: dict, concepts: dict = None) -> List[Doc]:
+        # merges the entities of the two passes and attaches information from Entity-Fishing
+        # to the spans
+        for idx, (doc, result_from_ef_text) in enumerate(zip(docs, result_from_ef_text_batch)):
+            result = self.passes.attach_terms_result(doc, result_from_ef_text[2],
+                                                     result_from_ef_terms_batch.get(idx))
+            if len(result) > 0:
+                try:
+                    self.updated_entities(doc, result, concepts)
+                except KeyError:
+                    pass
+        return docs
+
+    def process_single_doc_after_call(self, doc: Doc, result_from_ef_text,
+                                      timings: dict = None) -> Doc:
         """
         - The function takes a document and a list of entities from the Entity-Fishing service.
-        - It then checks if there are any entities in the document that were not disambiguated by the
-        Entity-Fishing service.
-        - If there are, it passes the text of these entities to the Entity-Fishing service again, but
-        this time without the text of the document.
-        - It then merges the results of the two calls to the Entity-Fishing service and attaches the
-        information from the Entity-Fishing service to the entities in the document
+        - It then checks if there are any entities in the document that were not disambiguated
+        by the Entity-Fishing service.
+        - If there are, it passes the text of these entities to the Entity-Fishing service
+        again, but this time without the text of the document.
+        - It then merges the results of the two calls to the Entity-Fishing service and attaches
+        the information from the Entity-Fishing service to the entities in the document
 
         :param doc: The document to be processed
         :type doc: Doc
         :param result_from_ef_text: a list of three elements:
-        :return: A list of dictionaries, each dictionary contains the information of a single entity.
+        :param timings: durations of the stages, updated in place
+        :type timings: dict
+        :return: the document.
         """
-        entities_from_text = result_from_ef_text[2]
-
-        # 1a. Attach raw response (with text method in Entity-Fishing service) to doc
-        if len(result_from_ef_text[0]) > 0:
-            doc._.annotations["disambiguation_text_service"] = result_from_ef_text[0]
-
-        doc._.metadata["disambiguation_text_service"] = result_from_ef_text[1]
-
-        # 2 .Because some named entities have not been disambiguated,
-        # create a list with these unrelated entities ("nil clustering").
-        # Pass them back in Entity-fishing without the text but with all
-        # the named entities surrounding these entities, to create a context
-        # of neighboring terms.
-        # nil_clustering = named entities in doc - actual disambiguated entities by EF
-        nil_clustering = []
-        if len(result_from_ef_text[0]) > 0:
-            try:
-                nil_clustering = [
-                    doc.char_span(start_idx=ent[1],
-                                  end_idx=ent[2]) for ent in [
-                        (
-                            ent.text, ent.start_char, ent.end_char
-                        ) for ent in doc.ents
-                    ] if ent not in [
-                        (
-                            ent_ef['rawName'], ent_ef['offsetStart'], ent_ef['offsetEnd']
-                        ) for ent_ef in result_from_ef_text[0]['entities']
-                    ]
-                ]
-            except KeyError:
-                pass
-        entities_from_terms = []
-        if len(nil_clustering) != 0:
-            # prepare query for Entity-Fishing terms disambiguation
-            terms = " ".join([ent.text for ent in doc.ents])
-            result_from_ef_terms = self.main_disambiguation_process_batch(
-                text_batch=[""],
-                terms_batch=[terms],
-                entities_batch=[nil_clustering]
-            )[0]
-
-            entities_from_terms = result_from_ef_terms[2]
-
-            # 2b. Attach raw response (with terms method in Entity-Fishing service) to doc
-            if len(result_from_ef_terms[0]) > 0:
-                doc._.annotations["disambiguation_terms_service"] = result_from_ef_terms[0]
-            doc._.metadata["disambiguation_terms_service"] = result_from_ef_terms[1]
-
-        # 3. Merge two list of entities (first and second pass in EF service)
-        # and attach information from Entity-Fishing to spans
-        result = entities_from_text + [
-            entity_term for entity_term in entities_from_terms
-            if entity_term not in entities_from_text
-        ] if len(entities_from_terms) > 0 else entities_from_text
-
-        if len(result) > 0:
-            try:
-                self.updated_entities(doc, result)
-            except KeyError:
-                pass
-
-        return doc
+        return self._terms_pass([doc], [result_from_ef_text], timings)[0]
+
+    def _reuse_stored_links(self, docs: List[Doc]) -> List[Doc]:
+        # with `incremental`, the unchanged documents (same text and entity offsets) are linked
+        # again from the responses stored in their annotations, without calling the service
+        if not self.passes.config.incremental:
+            return docs
+        to_link, reused = split_unchanged(docs)
+        if len(reused) != 0:
+            concepts = self._look_up_concepts([({}, {}, links.entities) for _, links in reused])
+            self._attach_stored_links(reused, concepts)
+        return to_link
+
+    async def _areuse_stored_links(self, docs: List[Doc]) -> List[Doc]:
+        if not self.passes.config.incremental:
+            return docs
+        to_link, reused = split_unchanged(docs)
+        if len(reused) != 0:
+            concepts = await self._alook_up_concepts([({}, {}, links.entities)
+                                                      for _, links in reused])
+            self._attach_stored_links(reused, concepts)
+        return to_link
+
+    def _attach_stored_links(self, reused: List[Tuple[Doc, StoredLinks]],
+                             concepts: dict = None) -> None:
+        for doc, links in reused:
+            self.updated_entities(doc, links.entities, concepts)
+            doc._.metadata["incremental"] = "reused"
+        self.passes.counts["incremental"]["reused"] += len(reused)
+
+    def _record_timings(self, docs: List[Doc], timings: dict, start: float) -> None:
+        # the durations of the stages of a batch, attached to its documents
+        # (`doc._.metadata["timings"]`, in seconds) and recorded in `metrics`
+        timings = dict(timings, total=perf_counter() - start, batch_size=len(docs))
+        for doc in docs:
+            doc._.metadata["timings"] = dict(timings)
+        self.metrics.observe_batch(len(docs), sum(len(doc.ents) for doc in docs), timings["total"])
+
+    def _link_batch(self, docs: List[Doc]) -> List[Doc]:
+        start, timings = perf_counter(), {}
+        to_link = self._reuse_stored_links(docs)
+        if len(to_link) != 0:
+            # 1. Disambiguate and linking named entities in Doc object with Entity-Fishing
+            result_from_ef_text_batch = self._text_pass(to_link, timings)
+
+            # 2. Disambiguate "nil clustering" entities of all documents as a second batch
+            self._terms_pass(to_link, result_from_ef_text_batch, timings)
+        self._record_timings(docs, timings, start)
+        return docs
+
+    async def _alink_batch(self, docs: List[Doc]) -> List[Doc]:
+        start, timings = perf_counter(), {}
+        to_link = await self._areuse_stored_links(docs)
+        if len(to_link) != 0:
+            result_from_ef_text_batch = await self._atext_pass(to_link, timings)
+            await self._aterms_pass(to_link, result_from_ef_text_batch, timings)
+        self._record_timings(docs, timings, start)
+        return docs
 
     def __call__(self, doc: Doc) -> Doc:
         """
@@ -465,32 +488,161 @@ class EntityFishing:
         :type doc: Doc
         :return: A Doc object with the entities linked to the corresponding Wikipedia page.
         """
-        # 1. Disambiguate and linking named entities in Doc object with Entity-Fishing
-        result_from_ef_text = self.main_disambiguation_process_batch(
-            text_batch=[doc.text],
-            terms_batch=[""],
-            entities_batch=[doc.ents]
-        )[0]
-        return self.process_single_doc_after_call(doc, result_from_ef_text)
+        return self._link_batch([doc])[0]
 
-    def pipe(self, stream: iterators, batch_size: int = 128) -> Doc:
+    def pipe(self, stream: Iterable[Doc], batch_size: int = 128) -> Iterator[Doc]:
         """
-        For each batch of documents, we disambiguate the named entities in the documents, and then yield
-        the results
+        For each batch of documents, we disambiguate the named entities in the documents, and
+        then yield the results (with `streaming_window`, each document is processed as soon as
+        it is pulled from the stream instead, cf. `DocStream`)
 
         :param stream: a generator that yields Doc objects
         :type stream: iterator
-        :param batch_size: The number of documents to process at a time, defaults to 128 (optional)
+        :param batch_size: The number of documents to process at a time, defaults to 128
+        (optional)
         :type batch_size: int
         """
+        if self.streaming is not None:
+            yield from self.streaming.process(stream, self)
+            return
         for docs in util.minibatch(stream, size=batch_size):
-            text_batch = [doc.text for doc in docs]
-            entities_batch = [doc.ents for doc in docs]
-            terms_batch = ["" for _ in text_batch]
+            yield from self._link_batch(docs)
 
-            # 1. Disambiguate and linking named entities in Doc object with Entity-Fishing
-            result_from_ef_text_batch = self.main_disambiguation_process_batch(
-                text_batch=text_batch, terms_batch=terms_batch, entities_batch=entities_batch)
+    async def apipe(self, stream, batch_size: int = 128,
+                    max_in_flight: int = 1024) -> AsyncIterator[Doc]:
+        """
+        Asynchronous counterpart of `pipe`: the documents pulled from the stream are sent by
+        minibatches of `batch_size` (as with `pipe`), each minibatch as soon as it is complete,
+        and the documents are yielded in the order of the stream. Requests in flight are bounded
+        by `async_concurrency`, and documents in flight by `max_in_flight` (the stream is not
+        consumed further until the first pending minibatch is done).
+
+        :param stream: an iterable or an asynchronous iterable of Doc objects
+        (already processed by the NER components)
+        :param batch_size: The number of documents to process at a time, defaults to 128
+        (optional)
+        :type batch_size: int
+        :param max_in_flight: The maximum number of documents being processed at a time,
+        defaults to 1024 (optional)
+        :type max_in_flight: int
+        """
+        async def aminibatch(docs):
+            if not hasattr(docs, "__aiter__"):
+                for batch in util.minibatch(docs, size=batch_size):
+                    yield batch
+                return
+            batch = []
+            async for doc in docs:
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if len(batch) != 0:
+                yield batch
+
+        pending, in_flight = collections.deque(), 0
+        async with self.api.async_client.session():
+            try:
+                async for docs in aminibatch(stream):
+                    pending.append(asyncio.ensure_future(self._alink_batch(docs)))
+                    in_flight += len(docs)
+                    while in_flight >= max_in_flight:
+                        docs = await pending.popleft()
+                        in_flight -= len(docs)
+                        for doc in docs:
+                            yield doc
+                while pending:
+                    for doc in await pending.popleft():
+                        yield doc
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    def close(self) -> None:
+        """
+        It releases the pooled connections and the threads of the HTTP client
+        (they are created again on the next call).
+        """
+        self.api.close()
+        if self.streaming is not None:
+            self.streaming.close()
+
+    async def aclose(self) -> None:
+        """
+        It releases the pooled connections of the asynchronous HTTP client.
+        """
+        await self.api.aclose()
+
+    def to_bytes(self, *, exclude: Iterable[str] = tuple()) -> bytes:
+        """
+        It serializes the in-memory caches (concepts and responses) of the component, so that
+        a pipeline saved with `nlp.to_bytes` is loaded with warm caches. The configuration is
+        saved by spaCy in the config of the pipeline.
 
-            for doc, result_from_ef_text in zip(docs, result_from_ef_text_batch):
-                yield self.process_single_doc_after_call(doc, result_from_ef_text)
+        :param exclude: names of the caches to exclude ("concepts", "responses")
+        :type exclude: Iterable[str]
+        :return: the serialized caches.
+        """
+        return util.to_bytes(self.api.serializers(), exclude)
+
+    def from_bytes(self, bytes_data: bytes, *,
+                   exclude: Iterable[str] = tuple()) -> "EntityFishing":
+        """
+        It loads the in-memory caches serialized by `to_bytes`.
+
+        :param bytes_data: the serialized caches
+        :type bytes_data: bytes
+        :param exclude: names of the caches to exclude ("concepts", "responses")
+        :type exclude: Iterable[str]
+        :return: the component.
+        """
+        util.from_bytes(bytes_data, self.api.deserializers(), exclude)
+        return self
+
+    def to_disk(self, path: Union[str, Path], *, exclude: Iterable[str] = tuple()) -> None:
+        """
+        It saves the in-memory caches of the component in the directory `path`
+        (one msgpack file per cache).
+
+        :param path: the directory
+        :type path: Union[str, Path]
+        :param exclude: names of the caches to exclude ("concepts", "responses")
+        :type exclude: Iterable[str]
+        """
+        util.to_disk(path, {key: lambda p, getter=getter: srsly.write_msgpack(p, getter())
+                            for key, getter in self.api.serializers().items()}, exclude)
+
+    def from_disk(self, path: Union[str, Path], *,
+                  exclude: Iterable[str] = tuple()) -> "EntityFishing":
+        """
+        It loads the in-memory caches saved by `to_disk` (missing files are ignored).
+
+        :param path: the directory
+        :type path: Union[str, Path]
+        :param exclude: names of the caches to exclude ("concepts", "responses")
+        :type exclude: Iterable[str]
+        :return: the component.
+        """
+        util.from_disk(path, {key: lambda p, setter=setter: setter(srsly.read_msgpack(p))
+                              if p.exists() else None
+                              for key, setter in self.api.deserializers().items()}, exclude)
+        return self
+
+    def check_endpoints(self) -> dict:
+        """
+        It health-checks the urls of `api_ef_base` with the `isalive` service: healthy urls
+        receive requests again, the others are ejected.
+
+        :return: the health of each url.
+        """
+        return self.api.check_endpoints()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Statistics of the component: "cache", "scheduler" and "endpoints" (cf.
+        `EntityFishingAPI.stats`), "incremental", "preflight" and "link_index" (cf.
+        `Passes.stats`) and "metrics" (snapshot of the latency and throughput metrics, cf.
+        `Metrics.stats`). Empty for the features disabled.
+        """
+        return dict(self.api.stats, **self.passes.stats, metrics=self.metrics.stats)
@@ -0,0 +1,143 @@
+# -*- coding: UTF-8 -*-
+
+"""grouping.py
+
+Group short texts (documents or chunks) of a batch into a single query
+in `shortText` mode, so that they are disambiguated together (in the
+context of each other) by a single request, and split the result of
+the group back into the results of its texts.
+"""
+
+import bisect
+
+from typing import Hashable, List, NamedTuple, Tuple
+
+from .chunking import Chunk
+from .payload import entity_query
+
+# Separator of the texts of a group.
+GROUP_SEPARATOR = "\n"
+
+
+class Group(NamedTuple):
+    """Texts sent as a single query."""
+    members: List[int]
+    """Indexes of the chunks of the group."""
+    offsets: List[int]
+    """Position of each chunk in `text`."""
+    text: str
+    """Text of the query (the texts of the chunks separated by `GROUP_SEPARATOR`)."""
+    entities: list
+    """Entities of the chunks (spans for a single chunk, else entities of a query)."""
+
+
+def group_chunks(chunks: List[Chunk], keys: List[Hashable], max_text_chars: int,
+                 max_chars: int) -> List[Group]:
+    """
+    It groups the chunks of at most `max_text_chars` characters with the same key, in their order,
+    into groups of at most `max_chars` characters. Every chunk is in a single group: longer chunks
+    (and chunks left alone) make their own group.
+
+    :param chunks: the chunks of a batch
+    :type chunks: List[Chunk]
+    :param keys: the key of each chunk (only chunks with the same key are grouped)
+    :type keys: List[Hashable]
+    :param max_text_chars: maximum number of characters of a chunk to be grouped
+    :type max_text_chars: int
+    :param max_chars: maximum number of characters of a group
+    :type max_chars: int
+    :return: the groups, in the order of their first chunk.
+    """
+    members_batch, open_groups = [], {}
+    for idx, (chunk, key) in enumerate(zip(chunks, keys)):
+        if len(chunk.text) > max_text_chars:
+            members_batch.append([idx])
+            continue
+        group = open_groups.get(key)
+        size = len(chunk.text) + len(GROUP_SEPARATOR)
+        if group is None or group[1] + size > max_chars + len(GROUP_SEPARATOR):
+            group = [[idx], size]
+            open_groups[key] = group
+            members_batch.append(group[0])
+        else:
+            group[0].append(idx)
+            group[1] += size
+    return [make_group(chunks, members) for members in members_batch]
+
+
+def make_group(chunks: List[Chunk], members: List[int]) -> Group:
+    """
+    It builds the query of a group of chunks.
+
+    :param chunks: the chunks of a batch
+    :type chunks: List[Chunk]
+    :param members: the indexes of the chunks of the group
+    :type members: List[int]
+    :return: the group.
+    """
+    if len(members) == 1:
+        chunk = chunks[members[0]]
+        return Group(members, [0], chunk.text, chunk.entities)
+    offsets, entities, position = [], [], 0
+    for idx in members:
+        offsets.append(position)
+        # offsets relative to the group (entity_query shifts by minus its offset)
+        entities.extend(entity_query(ent, -position) for ent in chunks[idx].entities)
+        position += len(chunks[idx].text) + len(GROUP_SEPARATOR)
+    text = GROUP_SEPARATOR.join(chunks[idx].text for idx in members)
+    return Group(members, offsets, text, entities)
+
+
+def group_queries(groups: List[Group]) -> Tuple[List[str], List[str], List[list]]:
+    """
+    It builds the text, terms and entities of the queries of the groups: a single chunk is
+    sent as text, several chunks as terms (`shortText`).
+
+    :param groups: the groups of chunks
+    :type groups: List[Group]
+    :return: the text batch, terms batch and entities batch of the queries.
+    """
+    text_batch = [group.text if len(group.members) == 1 else "" for group in groups]
+    terms_batch = ["" if len(group.members) == 1 else group.text for group in groups]
+    return text_batch, terms_batch, [group.entities for group in groups]
+
+
+def split_group_results(groups: List[Group], chunks: List[Chunk], results: list) -> list:
+    """
+    It splits the result of each group into the results of its chunks: each entity goes to the
+    chunk it falls in, with offsets relative to the chunk.
+
+    :param groups: the groups of a batch
+    :type groups: List[Group]
+    :param chunks: the chunks of the batch
+    :type chunks: List[Chunk]
+    :param results: the results (response, metadata, entities) of the groups
+    :type results: list
+    :return: the results of the chunks, aligned with `chunks`.
+    """
+    chunk_results = [None for _ in chunks]
+    for group, (res, metadata, entities) in zip(groups, results):
+        if len(group.members) == 1:
+            chunk_results[group.members[0]] = (res, metadata, entities)
+            continue
+        entities_batch = [[] for _ in group.members]
+        for entity in entities:
+            member = bisect.bisect_right(group.offsets, entity["offsetStart"]) - 1
+            if member < 0:
+                continue
+            offset = group.offsets[member]
+            if entity["offsetEnd"] > offset + len(chunks[group.members[member]].text):
+                continue
+            entities_batch[member].append(dict(entity,
+                                               offsetStart=entity["offsetStart"] - offset,
+                                               offsetEnd=entity["offsetEnd"] - offset))
+        for member, idx in enumerate(group.members):
+            response = res
+            if len(res) > 0:
+                response = dict(res, entities=entities_batch[member])
+                if "shortText" in response:
+                    response["shortText"] = chunks[idx].text
+            # a metadata dict per document (not shared by the documents of the group)
+            chunk_results[idx] = (response, dict(metadata, grouped=len(group.members)),
+                                  entities_batch[member])
+    return chunk_results
@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+
+"""incremental.py
+
+Incremental re-linking: a fingerprint of the text and of the entity offsets
+of each document is kept in `doc._.metadata`, so that a document processed
+again reuses the links stored in `doc._.annotations` when nothing changed,
+and only sends the context windows of its new entities when its entity set
+changed. As the fingerprint is stored in the document, links are only reused
+for the same `Doc` objects or for documents loaded from a `DocBin` that keeps
+`user_data` (`DocBin(store_user_data=True)`).
+"""
+
+import hashlib
+
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+from spacy.tokens import Doc, Span
+
+from .chunking import Chunk
+from .payload import entity_query
+
+
+class StoredLinks(NamedTuple):
+    """Links of a document stored by a previous run (its text is unchanged)."""
+    unchanged: bool
+    """True if the entity offsets are unchanged too."""
+    entities: list
+    """Entities of the stored responses (first pass, then second pass) still in `doc.ents`."""
+    new_entities: list
+    """Spans of `doc.ents` that were not in the document when it was linked."""
+
+
+def text_digest(text: str) -> str:
+    """
+    It computes the digest of the text of a document.
+
+    :param text: the text
+    :type text: str
+    :return: the hexadecimal digest.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fingerprint(doc: Doc) -> dict:
+    """
+    It builds the fingerprint of a document: digest of its text and offsets of its entities.
+
+    :param doc: the document
+    :type doc: Doc
+    :return: the fingerprint (stored in `doc._.metadata["fingerprint"]`).
+    """
+    return {"text": text_digest(doc.text),
+            "entities": [[ent.start_char, ent.end_char] for ent in doc.ents]}
+
+
+def linked_ok(metadata: dict) -> bool:
+    """
+    It tells whether the passes of the last run of a document succeeded (its links can be reused).
+
+    :param metadata: the metadata of the document (`doc._.metadata`)
+    :type metadata: dict
+    :return: True if the first pass, and the second pass if any, succeeded.
+    """
+    return metadata.get("disambiguation_text_service", {}).get("ok", False) and \
+        metadata.get("disambiguation_terms_service", {"ok": True}).get("ok", False)
+
+
+def stored_links(doc: Doc) -> Optional[StoredLinks]:
+    """
+    It compares a document with its fingerprint and selects the stored links still valid.
+
+    :param doc: the document (with the `annotations` and `metadata` of a previous run)
+    :type doc: Doc
+    :return: the stored links, None if the document has to be linked again from scratch
+    (never linked, failed, text changed or first pass not stored).
+    """
+    previous = doc._.metadata.get("fingerprint")
+    text_response = doc._.annotations.get("disambiguation_text_service")
+    if previous is None or text_response is None or not linked_ok(doc._.metadata) \
+            or previous["text"] != text_digest(doc.text):
+        return None
+    # a `DocBin` loads the lists of `user_data` as tuples
+    previous_offsets: Set[Tuple[int, int]] = {tuple(offsets) for offsets in previous["entities"]}
+    offsets = [(ent.start_char, ent.end_char) for ent in doc.ents]
+    current_offsets = set(offsets)
+
+    entities, seen = [], set()
+    terms_response = doc._.annotations.get("disambiguation_terms_service", {})
+    candidates = list(text_response.get("entities", [])) + list(terms_response.get("entities", []))
+    for entity in candidates:
+        key = (entity["offsetStart"], entity["offsetEnd"])
+        if key in current_offsets and key not in seen:
+            seen.add(key)
+            entities.append(entity)
+    new_entities = [ent for ent, key in zip(doc.ents, offsets) if key not in previous_offsets]
+    return StoredLinks(current_offsets == previous_offsets, entities, new_entities)
+
+
+def split_unchanged(docs: List[Doc]) -> Tuple[List[Doc], List[Tuple[Doc, StoredLinks]]]:
+    """
+    It splits documents into documents to link and unchanged documents (with their stored links).
+
+    :param docs: The documents to be processed
+    :type docs: List[Doc]
+    :return: the documents to link, and the unchanged documents with their stored links.
+    """
+    to_link, reused = [], []
+    for doc in docs:
+        links = stored_links(doc)
+        if links is not None and links.unchanged:
+            reused.append((doc, links))
+        else:
+            to_link.append(doc)
+    return to_link, reused
+
+
+def new_entity_links(links: Tuple[list, List[Span]],
+                     new_entities: List[Span]) -> Tuple[list, List[Span]]:
+    """
+    It keeps the part of the local links of a document (cf. `Passes.local_links`) that
+    concerns its new entities: the entities stored by the previous run are not linked again.
+
+    :param links: the entities linked locally and the entities to send to the service
+    :type links: Tuple[list, List[Span]]
+    :param new_entities: the new entities of the document (cf. `StoredLinks`)
+    :type new_entities: List[Span]
+    :return: the entities linked locally and the entities to send, among the new entities.
+    """
+    local, remote = links
+    offsets = {(ent.start_char, ent.end_char) for ent in new_entities}
+    return ([entity for entity in local if (entity["offsetStart"], entity["offsetEnd"]) in offsets],
+            [ent for ent in remote if (ent.start_char, ent.end_char) in offsets])
+
+
+def context_windows(text: str, entities: list, window: int) -> List[Chunk]:
+    """
+    It builds the queries of the new entities of a document: each entity with `window`
+    characters of context on both sides (overlapping windows are merged).
+
+    :param text: the text of the document
+    :type text: str
+    :param entities: the new entities (spans)
+    :type entities: list
+    :param window: characters of context on both sides of an entity
+    :type window: int
+    :return: the chunks (one per group of overlapping windows).
+    """
+    groups = []
+    for ent in sorted(entities, key=lambda ent: ent.start_char):
+        start, end = max(0, ent.start_char - window), min(len(text), ent.end_char + window)
+        if groups and start <= groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], end)
+            groups[-1][2].append(ent)
+        else:
+            groups.append([start, end, [ent]])
+    return [Chunk(start, text[start:end], [entity_query(ent, start) for ent in group_entities])
+            for start, end, group_entities in groups]
@@ -0,0 +1,233 @@
+# -*- coding: UTF-8 -*-
+
+"""link_index.py
+
+Local index of the links of surface forms: the links set by past runs
+(surface form, label and language of an entity -> QID, Wikipedia id and
+score) are aggregated by `LinkIndexBuilder` and saved as a single sorted
+numpy array of hashed keys, memory-mapped by `LinkIndex` (it loads in
+constant time and its pages are shared by the processes reading it). The
+mentions whose past links agree and are confident enough are linked
+locally, without the service.
+"""
+
+import hashlib
+import re
+
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+import numpy
+
+from spacy.tokens import Doc, Span
+
+from .links import QID_PATTERN
+
+# Record of the index (sorted by `key`).
+INDEX_DTYPE = numpy.dtype([
+    ("key", "<u8"),          # hash of the surface form, label and language
+    ("qid", "<i8"),          # QID of the most frequent link (number)
+    ("wikipedia", "<i8"),    # Wikipedia id of the most frequent link (-1 if missing)
+    ("score", "<f4"),        # mean score of the most frequent link (NaN if missing)
+    ("count", "<u4"),        # number of links seen
+    ("agreement", "<f4"),    # share of the links with the most frequent QID
+])
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def surface_key(surface: str, label: str, language: str) -> int:
+    """
+    It hashes the key of a mention (surface form with normalised whitespace, label and language).
+
+    :param surface: the text of the mention
+    :type surface: str
+    :param label: the label of the mention
+    :type label: str
+    :param language: the language of the document
+    :type language: str
+    :return: the 64-bit key.
+    """
+    key = f"{language}\x00{label}\x00{WHITESPACE.sub(' ', surface.strip())}"
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LinkIndexBuilder:
+    """Links of surface forms seen in documents, aggregated and saved by `save`."""
+
+    def __init__(self, language: str):
+        """
+        `LinkIndexBuilder` collects the links of the entities of linked documents.
+
+        Parameters:
+            language (str): the language of the documents.
+
+        Attributes:
+            language (str): cf. `language` in parameters section.
+            links (dict): by key, [count, score sum, scored count, Wikipedia id] of each QID.
+        """
+        self.language = language
+        self.links = {}
+
+    def add(self, surface: str, label: str, qid: str, wikipedia: Optional[str] = None,
+            score: Optional[float] = None) -> None:
+        """
+        It records a link of a mention (QIDs that are not "Q<number>" are ignored).
+
+        :param surface: the text of the mention
+        :type surface: str
+        :param label: the label of the mention
+        :type label: str
+        :param qid: the Wikidata QID
+        :type qid: str
+        :param wikipedia: the Wikipedia id
+        :type wikipedia: str
+        :param score: the score of the link
+        :type score: float
+        """
+        match = QID_PATTERN.fullmatch(qid)
+        if match is None:
+            return
+        stats = self.links.setdefault(surface_key(surface, label, self.language), {}) \
+            .setdefault(int(match.group(1)), [0, 0.0, 0, -1])
+        stats[0] += 1
+        if score is not None:
+            stats[1] += float(score)
+            stats[2] += 1
+        if wikipedia is not None:
+            stats[3] = int(wikipedia)
+
+    def add_doc(self, doc: Doc) -> None:
+        """
+        It records the links of the entities of a linked document.
+
+        :param doc: the document
+        :type doc: Doc
+        """
+        for ent in doc.ents:
+            if ent._.kb_qid is not None:
+                self.add(ent.text, ent.label_, ent._.kb_qid, ent._.wikipedia_page_ref,
+                         ent._.nerd_score)
+
+    def add_docs(self, docs: Iterable[Doc]) -> "LinkIndexBuilder":
+        """
+        It records the links of the entities of linked documents.
+
+        :param docs: the documents
+        :type docs: Iterable[Doc]
+        :return: the builder.
+        """
+        for doc in docs:
+            self.add_doc(doc)
+        return self
+
+    def to_array(self) -> numpy.ndarray:
+        """
+        It aggregates the links of each key: most frequent QID, its mean score and Wikipedia id,
+        and the share of the links that agree with it.
+
+        :return: the records, sorted by key.
+        """
+        records = numpy.zeros(len(self.links), dtype=INDEX_DTYPE)
+        for idx, key in enumerate(sorted(self.links)):
+            qids = self.links[key]
+            qid, (count, score_sum, scored, wikipedia) = max(qids.items(),
+                                                             key=lambda item: item[1][0])
+            total = sum(stats[0] for stats in qids.values())
+            records[idx] = (key, qid, wikipedia, score_sum / scored if scored else numpy.nan,
+                            total, count / total)
+        return records
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        It writes the index to `path` (a `.npy` file read by `LinkIndex`).
+
+        :param path: the path of the index
+        :type path: Union[str, Path]
+        """
+        with open(path, "wb") as output:
+            numpy.save(output, self.to_array(), allow_pickle=False)
+
+
+class LinkIndex:
+    """Memory-mapped index of the links of surface forms."""
+
+    def __init__(self, path: Union[str, Path], language: str, threshold: float = 0.9,
+                 min_count: int = 2):
+        """
+        `LinkIndex` memory-maps an index written by `LinkIndexBuilder.save`.
+
+        Parameters:
+            path (str): the path of the index.
+            language (str): the language of the documents.
+            threshold (float): minimum agreement of the past links of a mention and minimum
+            mean score of its most frequent link to link it locally.
+            min_count (int): minimum number of past links of a mention to link it locally (the
+            agreement of a mention seen once is always 1).
+
+        Attributes:
+            path, language, threshold, min_count: cf. parameters section.
+            records (numpy.ndarray): the records of the index (memory-mapped, sorted by key).
+        """
+        self.path = str(path)
+        self.language = language
+        self.threshold = threshold
+        self.min_count = min_count
+        self.records = self._load()
+
+    def _load(self) -> numpy.ndarray:
+        records = numpy.load(self.path, mmap_mode="r", allow_pickle=False)
+        if records.dtype != INDEX_DTYPE:
+            raise ValueError(f"{self.path} is not a link index.")
+        return records
+
+    def __getstate__(self) -> dict:
+        # the records are mapped again (not copied) by each process
+        state = self.__dict__.copy()
+        del state["records"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.records = self._load()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def lookup(self, ents: List[Span]) -> List[Optional[dict]]:
+        """
+        It links the mentions seen often enough (cf. `min_count`) whose past links agree and are
+        confident enough (cf. `threshold`).
+
+        :param ents: the entities of a document
+        :type ents: List[Span]
+        :return: for each entity, an entity in the format of the responses of the service
+        (None if it is not linked locally).
+        """
+        if len(ents) == 0 or len(self.records) == 0:
+            return [None for _ in ents]
+        keys = numpy.array([surface_key(ent.text, ent.label_, self.language) for ent in ents],
+                           dtype="<u8")
+        positions = numpy.minimum(numpy.searchsorted(self.records["key"], keys),
+                                  len(self.records) - 1)
+        records = self.records[positions]
+        # NaN scores never pass the threshold
+        found = (records["key"] == keys) & (records["count"] >= self.min_count) & \
+                (records["agreement"] >= self.threshold) & (records["score"] >= self.threshold)
+        entities = []
+        for ent, record, matched in zip(ents, records, found.tolist()):
+            if not matched:
+                entities.append(None)
+                continue
+            entity = {
+                "rawName": ent.text,
+                "offsetStart": ent.start_char,
+                "offsetEnd": ent.end_char,
+                "confidence_score": round(float(record["score"]), 4),
+                "wikidataId": f"Q{int(record['qid'])}",
+                "local": True,
+            }
+            if record["wikipedia"] >= 0:
+                entity["wikipediaExternalRef"] = int(record["wikipedia"])
+            entities.append(entity)
+        return entities
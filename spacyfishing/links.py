@@ -0,0 +1,370 @@
+# -*- coding: UTF-8 -*-
+
+"""links.py
+
+Storage of the links of the spans: the `Span` extensions of the component
+read the link table of their `Doc` (one array-backed table per document,
+opt-in) or the values set on the span, and the Wikidata url is derived
+from the QID on demand.
+"""
+
+import itertools
+import re
+
+from typing import Any, Dict, List, Optional
+
+import numpy
+
+from spacy.tokens import Doc, Span
+
+WIKIDATA_URL_BASE = "https://www.wikidata.org/wiki/"
+
+# Key of the link table in `doc.user_data` (serialized with the document).
+LINKS_KEY = "entityfishing_links"
+
+# Extensions stored per span (`url_wikidata` is derived from `kb_qid`).
+# default spans : kb_qid, wikipedia_page_ref, nerd_score
+# spans if extra_info set to True : normal_term, description, src_description, other_ids
+LINK_FIELDS = ("kb_qid", "wikipedia_page_ref", "nerd_score",
+               "normal_term", "description", "src_description", "other_ids")
+
+# Fields of the link table stored as indexes in its table of strings.
+STRING_FIELDS = ("normal_term", "description", "src_description")
+
+QID_PATTERN = re.compile(r"Q(\d+)")
+
+
+class LinkTableBuilder:
+    """Rows of the link table of a document, converted to columns by `to_dict`."""
+
+    def __init__(self):
+        """
+        `LinkTableBuilder` collects the links of the spans of a document.
+
+        Attributes:
+            rows (dict): links by (start, end) character offsets of the span.
+        """
+        self.rows = {}
+
+    def add(self, start: int, end: int, links: dict) -> None:
+        """
+        It sets the links of the span from `start` to `end` (updating the links already set).
+
+        :param start: start character offset of the span
+        :type start: int
+        :param end: end character offset of the span
+        :type end: int
+        :param links: the values of `LINK_FIELDS` to set
+        :type links: dict
+        """
+        self.rows.setdefault((start, end), {}).update(links)
+
+    def to_dict(self) -> dict:
+        """
+        It builds the columns of the table, sorted by offsets: integer QIDs and Wikipedia ids
+        (-1 if missing, QIDs that are not "Q<number>" are stored as -2 - index of the string),
+        float scores (NaN if missing) and indexes of the interned strings (-1 if missing).
+
+        :return: the link table (numpy arrays and lists, serializable with msgpack).
+        """
+        keys = sorted(self.rows)
+        strings, string_idx = [], {}
+
+        def intern(value: Optional[str]) -> int:
+            if value is None:
+                return -1
+            if value not in string_idx:
+                string_idx[value] = len(strings)
+                strings.append(value)
+            return string_idx[value]
+
+        def encode_qid(value: Optional[str]) -> int:
+            if value is None:
+                return -1
+            match = QID_PATTERN.fullmatch(value)
+            return int(match.group(1)) if match else -2 - intern(value)
+
+        def or_default(value: Any, default: Any) -> Any:
+            return default if value is None else value
+
+        rows = [self.rows[key] for key in keys]
+        table = {
+            "start": numpy.array([key[0] for key in keys], dtype="int32"),
+            "end": numpy.array([key[1] for key in keys], dtype="int32"),
+            "kb_qid": numpy.array([encode_qid(row.get("kb_qid")) for row in rows], dtype="int64"),
+            "wikipedia_page_ref": numpy.array(
+                [int(or_default(row.get("wikipedia_page_ref"), -1)) for row in rows],
+                dtype="int64"),
+            "nerd_score": numpy.array(
+                [or_default(row.get("nerd_score"), numpy.nan) for row in rows], dtype="float32"),
+        }
+        for field in STRING_FIELDS:
+            table[field] = numpy.array([intern(row.get(field)) for row in rows], dtype="int32")
+        table["other_ids"] = [row.get("other_ids") for row in rows]
+        table["strings"] = strings
+        return table
+
+
+def find_row(table: dict, start: int, end: int) -> int:
+    """
+    It finds the row of a span in a link table (binary search on the offsets).
+
+    :param table: the link table
+    :type table: dict
+    :param start: start character offset of the span
+    :type start: int
+    :param end: end character offset of the span
+    :type end: int
+    :return: the index of the row, -1 if the span has no link.
+    """
+    starts = table["start"]
+    row = int(numpy.searchsorted(starts, start, side="left"))
+    while row < len(starts) and starts[row] == start:
+        if table["end"][row] == end:
+            return row
+        row += 1
+    return -1
+
+
+def table_value(table: dict, row: int, name: str) -> Any:
+    """
+    It decodes the value of an extension from a row of a link table.
+
+    :param table: the link table
+    :type table: dict
+    :param row: the index of the row
+    :type row: int
+    :param name: the name of the extension (cf. `LINK_FIELDS`)
+    :type name: str
+    :return: the value, None if missing.
+    """
+    if name == "kb_qid":
+        qid = int(table["kb_qid"][row])
+        if qid == -1:
+            return None
+        return f"Q{qid}" if qid >= 0 else table["strings"][-2 - qid]
+    if name == "wikipedia_page_ref":
+        ref = int(table["wikipedia_page_ref"][row])
+        return str(ref) if ref >= 0 else None
+    if name == "nerd_score":
+        score = float(table["nerd_score"][row])
+        return None if numpy.isnan(score) else round(score, 4)
+    if name == "other_ids":
+        # a `DocBin` loads the lists of `user_data` as tuples
+        other_ids = table["other_ids"][row]
+        return list(other_ids) if other_ids is not None else None
+    idx = int(table[name][row])
+    return table["strings"][idx] if idx >= 0 else None
+
+
+def span_value(span: Span, name: str) -> Any:
+    """
+    It reads an extension of a span: the value set on the span if any, else its row
+    in the link table of the document.
+
+    :param span: the span
+    :type span: Span
+    :param name: the name of the extension (cf. `LINK_FIELDS`)
+    :type name: str
+    :return: the value, None if missing.
+    """
+    user_data = span.doc.user_data
+    key = ("._.", name, span.start_char, span.end_char)
+    if key in user_data:
+        return user_data[key]
+    table = user_data.get(LINKS_KEY)
+    if table is None:
+        return None
+    row = find_row(table, span.start_char, span.end_char)
+    return table_value(table, row, name) if row >= 0 else None
+
+
+def url_wikidata(span: Span) -> Optional[str]:
+    """
+    It derives the Wikidata url of a span from its QID.
+
+    :param span: the span
+    :type span: Span
+    :return: the url, None if the span has no QID.
+    """
+    user_data = span.doc.user_data
+    key = ("._.", "url_wikidata", span.start_char, span.end_char)
+    if key in user_data:
+        return user_data[key]
+    qid = span_value(span, "kb_qid")
+    return WIKIDATA_URL_BASE + qid if qid is not None else None
+
+
+def make_getter(name: str):
+    """It builds the getter of the extension `name`."""
+    def getter(span: Span) -> Any:
+        return span_value(span, name)
+    return getter
+
+
+def make_setter(name: str):
+    """It builds the setter of the extension `name` (the value is stored on the span)."""
+    def setter(span: Span, value: Any) -> None:
+        span.doc.user_data[("._.", name, span.start_char, span.end_char)] = value
+    return setter
+
+
+def set_span_extensions() -> None:
+    """
+    It registers the `Span` extensions of the component (once per process).
+    """
+    for name in LINK_FIELDS:
+        if not Span.has_extension(name):
+            Span.set_extension(name, getter=make_getter(name), setter=make_setter(name))
+    if not Span.has_extension("url_wikidata"):
+        Span.set_extension("url_wikidata", getter=url_wikidata, setter=make_setter("url_wikidata"))
+
+
+def set_links(doc: Doc, links_batch: List[Dict[str, Any]], spans: List[Span],
+              link_table: bool) -> None:
+    """
+    It attaches the links to the spans: in the link table of the document if `link_table`
+    is set, else on each span.
+
+    :param doc: the document
+    :type doc: Doc
+    :param links_batch: the links of each span (values of `LINK_FIELDS`)
+    :type links_batch: List[Dict[str, Any]]
+    :param spans: the spans, aligned with `links_batch`
+    :type spans: List[Span]
+    :param link_table: store the links in the link table of the document
+    :type link_table: bool
+    """
+    if not link_table:
+        for span, links in zip(spans, links_batch):
+            for name, value in links.items():
+                doc.user_data[("._.", name, span.start_char, span.end_char)] = value
+        return
+    builder = LinkTableBuilder()
+    table = doc.user_data.get(LINKS_KEY)
+    if table is not None:
+        # keep the links of a previous call
+        for row in range(len(table["start"])):
+            builder.add(int(table["start"][row]), int(table["end"][row]),
+                        {name: table_value(table, row, name) for name in LINK_FIELDS})
+    for span, links in zip(spans, links_batch):
+        builder.add(span.start_char, span.end_char, links)
+    doc.user_data[LINKS_KEY] = builder.to_dict()
+
+
+def extra_links(res_desc: dict, filter_statements: List[str]) -> dict:
+    """
+    It converts the extra information about an entity to the values of the span extensions.
+
+    :param res_desc: the result of the query to Wikidata
+    :type res_desc: dict
+    :param filter_statements: properties of the other ids kept (all if empty)
+    :type filter_statements: List[str]
+    :return: the values of the span extensions.
+    """
+    links = {}
+    # normalised term name
+    try:
+        links["normal_term"] = res_desc['preferredTerm']
+    except KeyError:
+        pass
+    # description and source description (filter by language)
+    try:
+        links["description"] = res_desc['definitions'][0]["definition"]
+        links["src_description"] = res_desc['definitions'][0]["source"]
+    except KeyError:
+        pass
+    except IndexError:
+        pass
+    # others identifiers attach to QID
+    # in Wikidata KB with filter properties or not
+    try:
+        ids = []
+        for content in res_desc['statements']:
+            new_id = {
+                k: content[k] for k in ['propertyName',
+                                        'propertyId',
+                                        'value']
+            }
+            if len(filter_statements) != 0:
+                if content['propertyId'] in filter_statements:
+                    ids.append(new_id)
+            else:
+                ids.append(new_id)
+
+        links["other_ids"] = ids
+    except KeyError:
+        pass
+    return links
+
+
+def entity_links(entity: dict, extra: bool, filter_statements: List[str], concepts: dict = None,
+                 described: bool = False) -> dict:
+    """
+    It converts an entity of a response to the values of the span extensions.
+
+    :param entity: an entity of a response
+    :type entity: dict
+    :param extra: attach the extra information of the entity (cf. `extra_info`)
+    :type extra: bool
+    :param filter_statements: properties of the other ids kept (cf. `extra_links`)
+    :type filter_statements: List[str]
+    :param concepts: concepts fetched by the concept look-up (by Wikipedia id), used as
+    extra information instead of the entity itself
+    :type concepts: dict
+    :param described: the entity holds its own extra information (full description)
+    :type described: bool
+    :return: the values of the span extensions.
+    """
+    links = {}
+    if 'wikidataId' in entity:
+        links["kb_qid"] = str(entity['wikidataId'])
+    if "wikipediaExternalRef" in entity:
+        links["wikipedia_page_ref"] = str(entity["wikipediaExternalRef"])
+        # if extra : search other info on entity
+        # => attach extra entity info to span
+        if extra:
+            if concepts is not None and links["wikipedia_page_ref"] in concepts:
+                links.update(extra_links(concepts[links["wikipedia_page_ref"]], filter_statements))
+            elif described:
+                links.update(extra_links(entity, filter_statements))
+    if 'confidence_score' in entity:
+        links["nerd_score"] = entity['confidence_score']
+    return links
+
+
+def nil_clustering(doc: Doc, entities_from_ef: list) -> List[Span]:
+    """
+    It selects the named entities of the document that are not in the response
+    (same surface form and character offsets), in linear time.
+
+    :param doc: The document to be processed
+    :type doc: Doc
+    :param entities_from_ef: the entities of the response
+    :type entities_from_ef: list
+    :return: the spans of the named entities not disambiguated.
+    """
+    disambiguated = {
+        (ent_ef['rawName'], ent_ef['offsetStart'], ent_ef['offsetEnd'])
+        for ent_ef in entities_from_ef
+    }
+    return [ent for ent in doc.ents
+            if (ent.text, ent.start_char, ent.end_char) not in disambiguated]
+
+
+def merge_entities(entities_from_text: list, entities_from_terms: list) -> list:
+    """
+    It merges the entities of the first pass (text) and of the second pass (terms),
+    keyed on their character offsets: on a conflict (several entities for the same
+    offsets), the first pass wins, then the first entity of a pass.
+
+    :param entities_from_text: the entities disambiguated by the first pass
+    :type entities_from_text: list
+    :param entities_from_terms: the entities disambiguated by the second pass
+    :type entities_from_terms: list
+    :return: the merged entities, in the order of the passes.
+    """
+    merged = {}
+    for entity in itertools.chain(entities_from_text, entities_from_terms):
+        merged.setdefault((entity.get('offsetStart'), entity.get('offsetEnd')), entity)
+    return list(merged.values())
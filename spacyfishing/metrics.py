@@ -0,0 +1,474 @@
+# -*- coding: UTF-8 -*-
+
+"""metrics.py
+
+Latency and throughput instrumentation of the component: request latency
+and queue wait histograms by stage (first pass, terms pass, concept
+look-up), bytes sent and received, retries, cache hits and documents and
+entities per batch, reported to hooks (callbacks, Prometheus or
+OpenTelemetry adapters, optional).
+"""
+
+import bisect
+import collections
+import contextlib
+import contextvars
+import threading
+
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Stage of the requests sent in the current context ("text", "terms", "concepts").
+CURRENT_STAGE = contextvars.ContextVar("entityfishing_stage", default="other")
+
+# Upper bounds (seconds) of the buckets of the histograms.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0)
+
+Hook = Callable[[str, dict], None]
+
+
+class Histogram:
+    """Bucketed distribution of durations (with estimated quantiles)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        `Histogram` counts the observations falling in each bucket.
+
+        Parameters:
+            buckets (Tuple[float, ...]): sorted upper bounds of the buckets (the last bucket is
+            unbounded).
+        """
+        self.buckets = buckets
+        self.counts = [0 for _ in range(len(buckets) + 1)]
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        It adds an observation.
+
+        :param value: the observed value
+        :type value: float
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, level: float) -> Optional[float]:
+        """
+        It estimates a quantile (linear interpolation inside its bucket).
+
+        :param level: the quantile (between 0 and 1)
+        :type level: float
+        :return: the estimated value, None without observations.
+        """
+        if self.count == 0:
+            return None
+        rank, seen = level * self.count, 0
+        for idx, count in enumerate(self.counts):
+            if count != 0 and seen + count >= rank:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                upper = self.buckets[idx] if idx < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    @property
+    def stats(self) -> dict:
+        """Count, mean and estimated p50/p90/p99 of the observations."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """Thread-safe registry of the metrics of a component, reported to hooks."""
+
+    def __init__(self, exporter: Optional[str] = None):
+        """
+        `Metrics` aggregates the observations of the HTTP clients and of the component.
+
+        Parameters:
+            exporter (str): "prometheus" or "opentelemetry" to report the observations to
+            these libraries too (None: only `stats` and the hooks).
+
+        Attributes:
+            counters (Counter): counters by (name, stage).
+            histograms (dict): histograms by (name, stage).
+            hooks (list): callbacks `hook(event, data)` called on each observation.
+        """
+        self.exporter = exporter
+        self.counters = collections.Counter()
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.hooks: List[Hook] = []
+        self._lock = threading.Lock()
+        self._exporter_hook = exporter_hook(exporter) if exporter is not None else None
+
+    def __getstate__(self) -> dict:
+        # every process reports its own observations
+        state = self.__dict__.copy()
+        state.update(counters=collections.Counter(), histograms={}, _exporter_hook=None)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._exporter_hook = exporter_hook(self.exporter) if self.exporter is not None else None
+
+    def add_hook(self, hook: Hook) -> None:
+        """
+        It registers a callback called with the name of an event ("request", "cache", "stage"
+        or "batch") and its data on each observation.
+
+        :param hook: the callback
+        :type hook: Callable[[str, dict], None]
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Hook) -> None:
+        """
+        It unregisters a callback.
+
+        :param hook: the callback
+        :type hook: Callable[[str, dict], None]
+        """
+        self.hooks.remove(hook)
+
+    def _observe(self, name: str, stage: str, value: float) -> None:
+        key = (name, stage)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def _emit(self, event: str, data: dict) -> None:
+        if self._exporter_hook is not None:
+            self._exporter_hook(event, data)
+        for hook in self.hooks:
+            hook(event, data)
+
+    def observe_request(self,
+                        stage: str,
+                        latency: float,
+                        queue_wait: float,
+                        retries: int,
+                        bytes_sent: int,
+                        bytes_received: int,
+                        status_code: Optional[int],
+                        bytes_decoded: Optional[int] = None) -> None:
+        """
+        It records a request (all its attempts).
+
+        :param stage: the stage of the request ("text", "terms", "concepts")
+        :type stage: str
+        :param latency: seconds from the first attempt to the response
+        :type latency: float
+        :param queue_wait: seconds from the submission of the request to its first attempt
+        :type queue_wait: float
+        :param retries: number of retries
+        :type retries: int
+        :param bytes_sent: size of the body of the request (on the wire)
+        :type bytes_sent: int
+        :param bytes_received: size of the body of the response (on the wire, compressed if so)
+        :type bytes_received: int
+        :param status_code: status code of the response, None if the request failed
+        :type status_code: Optional[int]
+        :param bytes_decoded: size of the body of the response once decompressed (defaults to
+        `bytes_received`)
+        :type bytes_decoded: Optional[int]
+        """
+        bytes_decoded = bytes_received if bytes_decoded is None else bytes_decoded
+        with self._lock:
+            self._observe("request_latency", stage, latency)
+            self._observe("queue_wait", stage, queue_wait)
+            self.counters["requests", stage] += 1
+            self.counters["retries", stage] += retries
+            self.counters["bytes_sent", stage] += bytes_sent
+            self.counters["bytes_received", stage] += bytes_received
+            self.counters["bytes_decoded", stage] += bytes_decoded
+            if status_code is None or status_code >= 400:
+                self.counters["errors", stage] += 1
+        self._emit("request", {"stage": stage, "latency": latency, "queue_wait": queue_wait,
+                               "retries": retries, "bytes_sent": bytes_sent,
+                               "bytes_received": bytes_received, "bytes_decoded": bytes_decoded,
+                               "status_code": status_code})
+
+    def observe_cache(self, stage: str, hits: int, misses: int) -> None:
+        """
+        It records the response cache lookups of a batch of queries.
+
+        :param stage: the stage of the queries
+        :type stage: str
+        :param hits: queries served from the cache
+        :type hits: int
+        :param misses: queries not in the cache
+        :type misses: int
+        """
+        with self._lock:
+            self.counters["cache_hits", stage] += hits
+            self.counters["cache_misses", stage] += misses
+        self._emit("cache", {"stage": stage, "hits": hits, "misses": misses})
+
+    def observe_stage(self, stage: str, duration: float) -> None:
+        """
+        It records the duration of a stage of a batch.
+
+        :param stage: the stage
+        :type stage: str
+        :param duration: seconds
+        :type duration: float
+        """
+        with self._lock:
+            self._observe("stage_duration", stage, duration)
+        self._emit("stage", {"stage": stage, "duration": duration})
+
+    def observe_batch(self, docs: int, entities: int, duration: float) -> None:
+        """
+        It records a batch of documents processed by the component.
+
+        :param docs: number of documents
+        :type docs: int
+        :param entities: number of entities of the documents
+        :type entities: int
+        :param duration: seconds spent by the component on the batch
+        :type duration: float
+        """
+        with self._lock:
+            self._observe("batch_duration", "total", duration)
+            self.counters["docs", "total"] += docs
+            self.counters["entities", "total"] += entities
+        self._emit("batch", {"docs": docs, "entities": entities, "duration": duration,
+                             "entities_per_second": entities / duration if duration > 0 else None})
+
+    @contextlib.contextmanager
+    def stage(self, name: str, timings: dict = None) -> Iterator[None]:
+        """
+        It tags the requests sent in the block with the stage `name` and records its duration
+        (added to `timings[name]` if given).
+
+        :param name: the stage
+        :type name: str
+        :param timings: durations by stage, updated in place
+        :type timings: dict
+        """
+        token = CURRENT_STAGE.set(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            CURRENT_STAGE.reset(token)
+            duration = perf_counter() - start
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + duration
+            self.observe_stage(name, duration)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the metrics: counters and histograms by stage, and entities processed per
+        second of the component.
+        """
+        with self._lock:
+            stats = collections.defaultdict(dict)
+            for (name, stage), value in self.counters.items():
+                stats[name][stage] = value
+            for (name, stage), histogram in self.histograms.items():
+                stats[name][stage] = histogram.stats
+            stats = dict(stats)
+            batch = self.histograms.get(("batch_duration", "total"))
+            if batch is not None and batch.sum > 0:
+                stats["entities_per_second"] = self.counters["entities", "total"] / batch.sum
+            return stats
+
+    def reset(self) -> None:
+        """It clears the counters and histograms."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def current_stage() -> str:
+    """It returns the stage of the requests sent in the current context."""
+    return CURRENT_STAGE.get()
+
+
+class ExporterHook:
+    """Hook dispatching each event to the method of the same name (no-op by default)."""
+
+    def __call__(self, event: str, data: dict) -> None:
+        getattr(self, event)(data)
+
+    def request(self, data: dict) -> None:
+        """
+        It reports a request.
+
+        :param data: stage, latency, queue wait, retries, sizes and status code of the request
+        :type data: dict
+        """
+
+    def cache(self, data: dict) -> None:
+        """
+        It reports the response cache lookups of a batch of queries.
+
+        :param data: stage, hits and misses
+        :type data: dict
+        """
+
+    def stage(self, data: dict) -> None:
+        """
+        It reports the duration of a stage of a batch.
+
+        :param data: stage and duration
+        :type data: dict
+        """
+
+    def batch(self, data: dict) -> None:
+        """
+        It reports a batch of documents.
+
+        :param data: documents, entities and duration of the batch
+        :type data: dict
+        """
+
+
+class PrometheusHook(ExporterHook):
+    """Hook reporting the observations to `prometheus_client` metrics (optional dependency)."""
+
+    def __init__(self, registry=None, namespace: str = "spacyfishing"):
+        """
+        `PrometheusHook` creates the metrics in `registry`.
+
+        Parameters:
+            registry (CollectorRegistry): the registry (defaults to the global registry).
+            namespace (str): prefix of the names of the metrics.
+
+        Attributes:
+            metrics (dict): the Prometheus metrics by name.
+        """
+        try:
+            import prometheus_client  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:  # pragma: no cover
+            raise ImportError("The Prometheus exporter requires `prometheus_client`, "
+                              "install it with `pip install spacyfishing[prometheus]`.") from exc
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        options = {"namespace": namespace, "registry": registry}
+        histogram, counter = prometheus_client.Histogram, prometheus_client.Counter
+        self.metrics = {
+            "request_latency": histogram("request_latency_seconds", "Latency of the requests",
+                                         ["stage"], buckets=DEFAULT_BUCKETS, **options),
+            "queue_wait": histogram("queue_wait_seconds",
+                                    "Wait before the first attempt of the requests", ["stage"],
+                                    buckets=DEFAULT_BUCKETS, **options),
+            "stage_duration": histogram("stage_duration_seconds",
+                                        "Duration of the stages of the batches", ["stage"],
+                                        buckets=DEFAULT_BUCKETS, **options),
+            "requests": counter("requests", "Requests", ["stage", "status"], **options),
+            "retries": counter("retries", "Retries", ["stage"], **options),
+            "bytes_sent": counter("sent_bytes", "Bytes sent", ["stage"], **options),
+            "bytes_received": counter("received_bytes", "Bytes received", ["stage"], **options),
+            "cache": counter("cache_lookups", "Response cache lookups", ["stage", "result"],
+                             **options),
+            "docs": counter("docs", "Documents processed", **options),
+            "entities": counter("entities", "Entities processed", **options),
+        }
+
+    def request(self, data: dict) -> None:
+        stage = data["stage"]
+        self.metrics["request_latency"].labels(stage).observe(data["latency"])
+        self.metrics["queue_wait"].labels(stage).observe(data["queue_wait"])
+        self.metrics["requests"].labels(stage, str(data["status_code"])).inc()
+        self.metrics["retries"].labels(stage).inc(data["retries"])
+        self.metrics["bytes_sent"].labels(stage).inc(data["bytes_sent"])
+        self.metrics["bytes_received"].labels(stage).inc(data["bytes_received"])
+
+    def cache(self, data: dict) -> None:
+        self.metrics["cache"].labels(data["stage"], "hit").inc(data["hits"])
+        self.metrics["cache"].labels(data["stage"], "miss").inc(data["misses"])
+
+    def stage(self, data: dict) -> None:
+        self.metrics["stage_duration"].labels(data["stage"]).observe(data["duration"])
+
+    def batch(self, data: dict) -> None:
+        self.metrics["docs"].inc(data["docs"])
+        self.metrics["entities"].inc(data["entities"])
+
+
+class OpenTelemetryHook(ExporterHook):
+    """Hook reporting the observations to OpenTelemetry instruments (optional dependency)."""
+
+    def __init__(self, meter=None):
+        """
+        `OpenTelemetryHook` creates the instruments with `meter`.
+
+        Parameters:
+            meter (Meter): the meter (defaults to the meter "spacyfishing" of the global meter
+            provider).
+
+        Attributes:
+            instruments (dict): the OpenTelemetry instruments by name.
+        """
+        try:
+            from opentelemetry import metrics  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:  # pragma: no cover
+            raise ImportError("The OpenTelemetry exporter requires `opentelemetry-api`, "
+                              "install it with `pip install spacyfishing[opentelemetry]`.") from exc
+        if meter is None:
+            meter = metrics.get_meter("spacyfishing")
+        self.instruments = {
+            "request_latency": meter.create_histogram("spacyfishing.request.latency", unit="s"),
+            "queue_wait": meter.create_histogram("spacyfishing.request.queue_wait", unit="s"),
+            "stage_duration": meter.create_histogram("spacyfishing.stage.duration", unit="s"),
+            "requests": meter.create_counter("spacyfishing.requests"),
+            "retries": meter.create_counter("spacyfishing.retries"),
+            "bytes_sent": meter.create_counter("spacyfishing.bytes_sent", unit="By"),
+            "bytes_received": meter.create_counter("spacyfishing.bytes_received", unit="By"),
+            "cache": meter.create_counter("spacyfishing.cache.lookups"),
+            "docs": meter.create_counter("spacyfishing.docs"),
+            "entities": meter.create_counter("spacyfishing.entities"),
+        }
+
+    def request(self, data: dict) -> None:
+        attributes = {"stage": data["stage"]}
+        self.instruments["request_latency"].record(data["latency"], attributes)
+        self.instruments["queue_wait"].record(data["queue_wait"], attributes)
+        self.instruments["requests"].add(1, dict(attributes, status=str(data["status_code"])))
+        self.instruments["retries"].add(data["retries"], attributes)
+        self.instruments["bytes_sent"].add(data["bytes_sent"], attributes)
+        self.instruments["bytes_received"].add(data["bytes_received"], attributes)
+
+    def cache(self, data: dict) -> None:
+        self.instruments["cache"].add(data["hits"], {"stage": data["stage"], "result": "hit"})
+        self.instruments["cache"].add(data["misses"], {"stage": data["stage"], "result": "miss"})
+
+    def stage(self, data: dict) -> None:
+        self.instruments["stage_duration"].record(data["duration"], {"stage": data["stage"]})
+
+    def batch(self, data: dict) -> None:
+        self.instruments["docs"].add(data["docs"])
+        self.instruments["entities"].add(data["entities"])
+
+
+_EXPORTER_HOOKS: Dict[str, Hook] = {}
+
+
+def exporter_hook(name: str) -> Hook:
+    """
+    It returns the hook of an exporter, created once per process (the metrics of the
+    global registries can only be registered once).
+
+    :param name: "prometheus" or "opentelemetry"
+    :type name: str
+    :return: the hook.
+    """
+    if name not in ("prometheus", "opentelemetry"):
+        raise ValueError(f"Unknown metrics exporter: {name}.")
+    if name not in _EXPORTER_HOOKS:
+        _EXPORTER_HOOKS[name] = PrometheusHook() if name == "prometheus" else OpenTelemetryHook()
+    return _EXPORTER_HOOKS[name]
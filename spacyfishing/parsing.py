@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+
+"""parsing.py
+
+Parsing of Entity-fishing responses: a fast JSON decoder and encoder of
+the queries (`orjson` if installed, optional) and the selective extraction
+of the fields used by the component, so that large responses (eg. with
+`full` descriptions and statements) are not kept whole.
+"""
+
+import json
+
+from typing import Any, Tuple
+
+import requests
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Fields of an entity used to link the spans.
+ENTITY_FIELDS = ("rawName", "offsetStart", "offsetEnd", "confidence_score", "wikipediaExternalRef",
+                 "wikidataId")
+
+# Fields of an entity (or of a concept) used as extra information (cf. `extra_info`).
+STATEMENT_FIELDS = ("propertyName", "propertyId", "value")
+
+# Top-level fields of a compact response (the text of the query is not kept).
+RESPONSE_FIELDS = ("software", "version", "date", "runtime", "nbest", "language")
+
+
+def loads(content: bytes) -> Any:
+    """
+    It decodes a JSON body, with `orjson` if installed.
+
+    :param content: the body of a response
+    :type content: bytes
+    :return: the decoded value.
+    :raises json.decoder.JSONDecodeError: if the body is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def dumps(value: Any) -> str:
+    """
+    It encodes a value as compact JSON (non-ASCII characters kept as is), with `orjson` if
+    installed.
+
+    :param value: the value (eg. a query)
+    :type value: Any
+    :return: the JSON text.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def extra_information(res: dict) -> dict:
+    """
+    It keeps the information used by `look_extra_informations_on_entity` from an entity
+    or a concept: preferred term, first definition and statements (without qualifiers).
+
+    :param res: an entity (with `full` descriptions) or a concept
+    :type res: dict
+    :return: the extra information.
+    """
+    extra = {}
+    if res.get("preferredTerm") is not None:
+        extra["preferredTerm"] = res["preferredTerm"]
+    if "definitions" in res:
+        extra["definitions"] = res["definitions"][:1]
+    if "statements" in res:
+        extra["statements"] = [{k: content.get(k) for k in STATEMENT_FIELDS}
+                               for content in res["statements"]]
+    return extra
+
+
+def compact_entity(entity: dict, extra: bool = False) -> dict:
+    """
+    It keeps the fields of an entity used to link the spans.
+
+    :param entity: an entity of a response
+    :type entity: dict
+    :param extra: keep the extra information too
+    :type extra: bool
+    :return: the compact entity.
+    """
+    compact = {k: entity[k] for k in ENTITY_FIELDS if k in entity}
+    if extra:
+        compact.update(extra_information(entity))
+    return compact
+
+
+def compact_response(res: dict, extra: bool = False) -> dict:
+    """
+    It keeps the top-level metadata of a response and the compact entities.
+
+    :param res: a `disambiguate` response
+    :type res: dict
+    :param extra: keep the extra information of the entities
+    :type extra: bool
+    :return: the compact response (empty if `res` is empty).
+    """
+    if len(res) == 0:
+        return res
+    compact = {k: res[k] for k in RESPONSE_FIELDS if k in res}
+    if "entities" in res:
+        compact["entities"] = [compact_entity(entity, extra) for entity in res["entities"]]
+    return compact
+
+
+def decode_response(response) -> Tuple[dict, dict]:
+    """
+    It decodes a response of the API (`requests.Response`, or `httpx.Response` with the
+    asynchronous client) and describes it in a metadata dict. If the request failed (no
+    response), the decoded response is empty and the metadata describes the error.
+
+    :param response: the response, or the exception raised by the request
+    :return: the decoded response and its metadata.
+    """
+    if isinstance(response, Exception):
+        return {}, {
+            "status_code": None,
+            "reason": f"{type(response).__name__}: {response}",
+            "ok": False,
+            "encoding": None,
+            "error": type(response).__name__
+        }
+
+    try:
+        res_json = loads(response.content)
+    except json.decoder.JSONDecodeError:
+        res_json = {}
+
+    if isinstance(response, requests.models.Response):
+        reason, success = response.reason, response.ok
+    else:
+        # httpx.Response (asynchronous client)
+        reason, success = response.reason_phrase, response.status_code < 400
+
+    metadata = {
+        "status_code": response.status_code,
+        "reason": reason,
+        "ok": success,
+        "encoding": response.encoding
+    }
+    return res_json, metadata
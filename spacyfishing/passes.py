@@ -0,0 +1,506 @@
+# -*- coding: UTF-8 -*-
+
+"""passes.py
+
+Document side of the two passes of the component: the queries of the first
+pass (text method of the Entity-fishing service: documents, chunks, groups of
+short texts, context windows of new entities, minus the entities linked
+locally or not worth a request) and of the second pass (terms method, for the
+"nil clustering" entities), and the results of both passes attached to the
+documents. The requests themselves are sent by `EntityFishingAPI`.
+"""
+
+import collections
+
+from typing import List, NamedTuple, Optional, Tuple
+
+from spacy.tokens import Doc, Span
+
+from .alignment import ALIGNMENT_MODES
+from .chunking import Chunk, merge_chunk_results, split_doc
+from .config import OutputConfig, QueryConfig
+from .grouping import Group, group_chunks, make_group, split_group_results
+from .incremental import StoredLinks, context_windows, fingerprint, linked_ok, new_entity_links, \
+    stored_links
+from .link_index import LinkIndex
+from .links import merge_entities, nil_clustering
+from .parsing import compact_response
+from .payload import prepare_query
+from .storage import cap_response
+
+# Texts shorter than this (5 characters or less) are rejected by the `disambiguate` service
+# with a 400 error (cf. `test_bad_text_ef_client` against the public API).
+MIN_TEXT_LENGTH = 6
+
+ANNOTATION_MODES = ("full", "compact", "none")
+
+# Counters of each feature (cf. `Passes.stats`).
+COUNTERS = {
+    "incremental": ("reused", "partial", "full"),
+    "preflight": ("text_too_short", "no_entities", "linked_locally"),
+    "link_index": ("local", "sent"),
+}
+
+# Entities of a document linked locally (in the format of the responses), and to send.
+Links = Tuple[list, List[Span]]
+
+# Text batch, terms batch and entities batch of the queries of a pass.
+Queries = Tuple[List[str], List[str], List[list]]
+
+
+class TextBatch(NamedTuple):
+    """Queries of the first pass of a batch of documents."""
+    links: List[Links]
+    """The result of `local_links` for each document."""
+    chunks: List[List[Chunk]]
+    """The chunks of each document."""
+    groups: List[Group]
+    """The groups of chunks, one query each."""
+
+
+class Passes:
+    """Queries and results of the two passes of the component."""
+
+    def __init__(self, language: str, full_descriptions: bool, config: QueryConfig,
+                 output: OutputConfig):
+        """
+        `Passes` prepares the queries of the documents and attaches the results to them.
+
+        Parameters:
+            language (str): language of the queries.
+            full_descriptions (bool): ask for the full description of the entities.
+            config (QueryConfig): cf. `QueryConfig`.
+            output (OutputConfig): cf. `OutputConfig`.
+
+        Attributes:
+            language (dict): language argument of the queries.
+            full_descriptions (bool): cf. `full_descriptions` in parameters section.
+            config (QueryConfig): cf. `config` in parameters section.
+            output (OutputConfig): cf. `output` in parameters section.
+            exclude_labels (frozenset): cf. `QueryConfig.exclude_labels`.
+            link_index (LinkIndex): cf. `QueryConfig.link_index_path` (None if not set).
+            counts (dict): counters of each feature (cf. `COUNTERS`).
+        """
+        if output.annotations not in ANNOTATION_MODES:
+            raise ValueError(f"Unknown annotations mode: {output.annotations}.")
+        if output.alignment_mode not in ALIGNMENT_MODES:
+            raise ValueError(f"Unknown alignment mode: {output.alignment_mode}.")
+        if config.incremental and output.annotations == "none":
+            raise ValueError("`incremental` needs the annotations of the documents "
+                             "(`annotations` set to \"none\").")
+        self.language = {"lang": language}
+        self.full_descriptions = full_descriptions
+        self.config = config
+        self.output = output
+        self.exclude_labels = frozenset(config.exclude_labels or [])
+        self.link_index = None
+        if config.link_index_path:
+            self.link_index = LinkIndex(config.link_index_path, language,
+                                        config.link_index_threshold, config.link_index_min_count)
+        self.counts = {name: collections.Counter() for name in COUNTERS}
+
+    def queries(self,
+                text_batch: List[str],
+                terms_batch: List[str],
+                entities_batch: List[list]) -> List[dict]:
+        """
+        It prepares the queries of a batch of text, terms and entities (cf. `prepare_query`).
+
+        :param text_batch: a list of strings, each string is a text to be disambiguated
+        :type text_batch: List[str]
+        :param terms_batch: a list of strings, each string is a list of terms separated by a space
+        :type terms_batch: List[str]
+        :param entities_batch: a list of lists of entities
+        :type entities_batch: List[list]
+        :return: A list of queries.
+        """
+        return [prepare_query(text, terms, entities, self.language, self.full_descriptions)
+                for text, terms, entities in zip(text_batch, terms_batch, entities_batch)]
+
+    @property
+    def cache_variant(self) -> str:
+        """Variant of the responses kept (cf. `ResponseCache.make_key`): "" or "compact"."""
+        return "" if self.output.annotations == "full" else "compact"
+
+    def response_tuple(self, res: dict, metadata: dict) -> Tuple[dict, dict, list]:
+        """
+        It keeps the fields of a decoded response used by the component (cf. `annotations`)
+        and extracts its entities.
+
+        :param res: the decoded response
+        :type res: dict
+        :param metadata: the metadata of the response
+        :type metadata: dict
+        :return: A tuple containing the response, metadata, and entities_enhanced.
+        """
+        if self.output.annotations != "full":
+            # keep only the fields used to link the spans
+            res = compact_response(res, extra=self.full_descriptions)
+        try:
+            entities_enhanced = res['entities']
+        except KeyError:
+            entities_enhanced = []
+        return res, metadata, entities_enhanced
+
+    def linkable_ents(self, ents) -> List[Span]:
+        """
+        It filters out the entities whose label is in `exclude_labels`.
+
+        :param ents: the entities of a document
+        :type ents: Iterable[Span]
+        :return: the entities to link.
+        """
+        if len(self.exclude_labels) == 0:
+            return list(ents)
+        return [ent for ent in ents if ent.label_ not in self.exclude_labels]
+
+    def local_links(self, doc: Doc) -> Links:
+        """
+        It links the entities of a document found in the `link_index`.
+
+        :param doc: The document to be processed
+        :type doc: Doc
+        :return: the entities linked locally (in the format of the responses) and the
+        entities to send to the service.
+        """
+        ents = self.linkable_ents(doc.ents)
+        if self.link_index is None:
+            return [], ents
+        entities = self.link_index.lookup(ents)
+        return [entity for entity in entities if entity is not None], \
+            [ent for ent, entity in zip(ents, entities) if entity is None]
+
+    def preflight_result(self, doc: Doc,
+                         links: Links = None) -> Optional[Tuple[dict, dict, list]]:
+        """
+        It builds the result of the first pass of a document that is not worth a request: if
+        `preflight` is set, text too short (the API answers with a 400 error) or no entity to link;
+        in any case, all its entities linked locally (cf. `link_index`).
+
+        :param doc: The document to be processed
+        :type doc: Doc
+        :param links: the result of `local_links` for the document (computed if None)
+        :type links: Tuple[list, List[Span]]
+        :return: the synthetic result (empty response, metadata, no entities), None if the
+        document has to be sent.
+        """
+        if self.config.preflight and len(doc.text) < MIN_TEXT_LENGTH:
+            return {}, {
+                "status_code": 400,
+                "reason": f"Text shorter than {MIN_TEXT_LENGTH} characters (not sent)",
+                "ok": False,
+                "encoding": None,
+                "skipped": "text_too_short"
+            }, []
+        if self.config.preflight and len(self.linkable_ents(doc.ents)) == 0:
+            return {}, {
+                "status_code": None,
+                "reason": "No entity to link (not sent)",
+                "ok": True,
+                "encoding": None,
+                "skipped": "no_entities"
+            }, []
+        if self.link_index is None:
+            return None
+        local, remote = self.local_links(doc) if links is None else links
+        if len(local) > 0 and len(remote) == 0:
+            return {}, {
+                "status_code": None,
+                "reason": "All the entities linked locally (not sent)",
+                "ok": True,
+                "encoding": None,
+                "skipped": "linked_locally"
+            }, []
+        return None
+
+    def text_chunks(self, doc: Doc, links: Links = None) -> List[Chunk]:
+        """
+        It splits a document into the queries of the first pass (text method in Entity-Fishing
+        service): the whole document, or chunks if `chunk_size` is set.
+
+        :param doc: The document to be processed
+        :type doc: Doc
+        :param links: the result of `local_links` for the document (computed if None)
+        :type links: Tuple[list, List[Span]]
+        :return: the chunks of the document (none if it is not sent, cf. `preflight_result`).
+        """
+        if links is None:
+            links = self.local_links(doc)
+        if self.preflight_result(doc, links) is not None:
+            return []
+        if self.config.incremental:
+            stored = stored_links(doc)
+            if stored is not None:
+                # only the new entities not linked locally, with their context
+                _, new_remote = new_entity_links(links, stored.new_entities)
+                return context_windows(doc.text, new_remote, self.config.incremental_window)
+        _, entities = links
+        if self.config.chunk_size <= 0:
+            return [Chunk(0, doc.text, entities)]
+        return split_doc(doc,
+                         entities=entities,
+                         max_chars=self.config.chunk_size,
+                         max_entities=self.config.chunk_max_entities,
+                         boundary=self.config.chunk_boundary,
+                         overlap=self.config.chunk_overlap)
+
+    def text_batch(self, docs: List[Doc]) -> TextBatch:
+        """
+        It prepares the queries of the first pass of a batch of documents: the chunks of each
+        document, the short ones grouped in queries (cf. `group_short_texts`), each other
+        chunk making its own query.
+
+        :param docs: The documents to be processed
+        :type docs: List[Doc]
+        :return: the local links, chunks and groups of the batch.
+        """
+        links_batch = [self.local_links(doc) for doc in docs]
+        chunks_batch = [self.text_chunks(doc, links) for doc, links in zip(docs, links_batch)]
+        chunks = [chunk for doc_chunks in chunks_batch for chunk in doc_chunks]
+        if self.config.group_short_texts <= 0:
+            groups = [make_group(chunks, [idx]) for idx in range(len(chunks))]
+        else:
+            group_by = self.config.group_by
+            keys = [doc._.get(group_by) if group_by is not None else None
+                    for doc, doc_chunks in zip(docs, chunks_batch) for _ in doc_chunks]
+            groups = group_chunks(chunks, keys, self.config.group_short_texts,
+                                  self.config.group_max_chars)
+        return TextBatch(links_batch, chunks_batch, groups)
+
+    def merge_text_batch(self, docs: List[Doc], batch: TextBatch, results: list) -> list:
+        """
+        It regroups the results of the queries of the first pass by document.
+
+        :param docs: The documents processed
+        :type docs: List[Doc]
+        :param batch: the queries of the batch (cf. `text_batch`)
+        :type batch: TextBatch
+        :param results: the results of the groups
+        :type results: list
+        :return: A list of tuples (response, metadata, entities), aligned with `docs`.
+        """
+        chunks = [chunk for doc_chunks in batch.chunks for chunk in doc_chunks]
+        return self.merge_text_results(docs, batch.chunks,
+                                       split_group_results(batch.groups, chunks, results),
+                                       batch.links)
+
+    def merge_text_results(self,
+                           docs: List[Doc],
+                           chunks_batch: List[List[Chunk]],
+                           results: list,
+                           links_batch: List[Links] = None) -> list:
+        """
+        It regroups the results of the chunks by document (cf. `merge_chunk_results`), with the
+        links stored by a previous run if `incremental` is set.
+
+        :param docs: The documents processed
+        :type docs: List[Doc]
+        :param chunks_batch: the chunks of each document
+        :type chunks_batch: List[List[Chunk]]
+        :param results: the results of all the chunks
+        :type results: list
+        :param links_batch: the result of `local_links` for each document (computed if None)
+        :type links_batch: List[Tuple[list, List[Span]]]
+        :return: A list of tuples (response, metadata, entities), aligned with `docs`.
+        """
+        if links_batch is None:
+            links_batch = [self.local_links(doc) for doc in docs]
+        merged, start = [], 0
+        for doc, doc_chunks, local in zip(docs, chunks_batch, links_batch):
+            result = self.preflight_result(doc, local) if len(doc_chunks) == 0 else None
+            if result is not None:
+                self.counts["preflight"][result[1]["skipped"]] += 1
+                merged.append(self.add_local_links(doc, result, local))
+                continue
+            doc_results = results[start:start + len(doc_chunks)]
+            links = stored_links(doc) if self.config.incremental else None
+            if links is None:
+                result = merge_chunk_results(doc.text, doc_chunks, doc_results)
+            else:
+                result = self._merge_stored_links(doc, links, doc_chunks, doc_results)
+                local = new_entity_links(local, links.new_entities)
+            merged.append(self.add_local_links(doc, result, local))
+            if self.config.incremental:
+                doc._.metadata["incremental"] = "full" if links is None else "partial"
+                self.counts["incremental"][doc._.metadata["incremental"]] += 1
+            start += len(doc_chunks)
+        return merged
+
+    @staticmethod
+    def _merge_stored_links(doc: Doc, links: StoredLinks, chunks: List[Chunk],
+                            results: list) -> Tuple[dict, dict, list]:
+        # the links stored by a previous run that are still valid, with the results of the
+        # context windows of the new entities
+        if len(chunks) > 0:
+            _, metadata, entities = merge_chunk_results(doc.text, chunks, results)
+        else:
+            # entities removed only
+            metadata = doc._.metadata.get("disambiguation_text_service", {"ok": True})
+            entities = []
+        entities = links.entities + list(entities)
+        response = dict(doc._.annotations["disambiguation_text_service"], entities=entities)
+        return response, dict(metadata, reused_entities=len(links.entities)), entities
+
+    def add_local_links(self,
+                        doc: Doc,
+                        result: Tuple[dict, dict, list],
+                        links: Links = None) -> Tuple[dict, dict, list]:
+        """
+        It adds the entities linked locally (cf. `link_index`) to the result of the first pass.
+
+        :param doc: The document processed
+        :type doc: Doc
+        :param result: the result of the first pass (response, metadata, entities)
+        :type result: Tuple[dict, dict, list]
+        :param links: the result of `local_links` for the document (computed if None)
+        :type links: Tuple[list, List[Span]]
+        :return: the result with the local links: in the response of a successful first pass,
+        else (failed or not sent) only in the entities to attach, the response and metadata
+        being untouched.
+        """
+        if self.link_index is None:
+            return result
+        local, remote = self.local_links(doc) if links is None else links
+        self.counts["link_index"]["local"] += len(local)
+        self.counts["link_index"]["sent"] += len(remote)
+        if len(local) == 0:
+            return result
+        response, metadata, entities = result
+        entities = list(entities) + local
+        if len(response) == 0 or not metadata.get("ok", False):
+            return response, metadata, entities
+        return dict(response, entities=entities), dict(metadata, local_links=len(local)), entities
+
+    def attach_text_result(self, doc: Doc, result_from_ef_text: Tuple[dict, dict, list]) -> list:
+        """
+        It attaches the result of the first pass (text method in Entity-Fishing service) to the
+        document and returns the named entities that were not disambiguated ("nil clustering").
+
+        :param doc: The document to be processed
+        :type doc: Doc
+        :param result_from_ef_text: the response, metadata and entities of the first pass
+        :type result_from_ef_text: Tuple[dict, dict, list]
+        :return: A list of spans to pass back to the Entity-Fishing service with the terms method.
+        """
+        # 1a. Attach raw response (with text method in Entity-Fishing service) to doc
+        # (the second pass of a previous run, if any, is stale)
+        for key in ("truncated_annotations", "disambiguation_terms_service"):
+            doc._.metadata.pop(key, None)
+        doc._.annotations.pop("disambiguation_terms_service", None)
+        if len(result_from_ef_text[0]) > 0 and self.output.annotations != "none":
+            self._attach_annotation(doc, "disambiguation_text_service", result_from_ef_text[0])
+
+        doc._.metadata["disambiguation_text_service"] = result_from_ef_text[1]
+
+        # 2 .Because some named entities have not been disambiguated,
+        # create a list with these unrelated entities ("nil clustering").
+        # Pass them back in Entity-fishing without the text but with all
+        # the named entities surrounding these entities, to create a context
+        # of neighboring terms.
+        # nil_clustering = named entities in doc - actual disambiguated entities by EF
+        nil_clustering_ents = []
+        if len(result_from_ef_text[0]) > 0:
+            try:
+                nil_clustering_ents = self.linkable_ents(
+                    nil_clustering(doc, result_from_ef_text[0]['entities']))
+            except KeyError:
+                pass
+        return nil_clustering_ents
+
+    def _attach_annotation(self, doc: Doc, service: str, response: dict) -> None:
+        # the raw response of a service, with at most `annotations_max_entities` entities
+        response, dropped = cap_response(response, self.output.annotations_max_entities)
+        doc._.annotations[service] = response
+        if dropped > 0:
+            doc._.metadata["truncated_annotations"] = \
+                doc._.metadata.get("truncated_annotations", 0) + dropped
+
+    def terms_query(self, doc: Doc) -> str:
+        """
+        It builds the terms (all the named entities to link of the document) used as context
+        to disambiguate the "nil clustering" entities.
+
+        :param doc: The document to be processed
+        :type doc: Doc
+        :return: the named entities of the document separated by a space.
+        """
+        return " ".join([ent.text for ent in self.linkable_ents(doc.ents)])
+
+    def terms_batch(self,
+                    docs: List[Doc],
+                    result_from_ef_text_batch: list) -> Tuple[List[int], Queries]:
+        """
+        It attaches the results of the first pass to a batch of documents and prepares the
+        queries of the second pass: the "nil clustering" entities of each document, with the
+        terms of the document as context.
+
+        :param docs: The documents to be processed
+        :type docs: List[Doc]
+        :param result_from_ef_text_batch: the results of the first pass, aligned with `docs`
+        :type result_from_ef_text_batch: list
+        :return: the indexes of the documents with a second pass, and the text batch, terms
+        batch and entities batch of their queries.
+        """
+        nil_clustering_batch = [
+            self.attach_text_result(doc, result_from_ef_text)
+            for doc, result_from_ef_text in zip(docs, result_from_ef_text_batch)
+        ]
+        terms_idx = [idx for idx, nil_clustering_ents in enumerate(nil_clustering_batch)
+                     if len(nil_clustering_ents) != 0]
+        return terms_idx, (["" for _ in terms_idx],
+                           [self.terms_query(docs[idx]) for idx in terms_idx],
+                           [nil_clustering_batch[idx] for idx in terms_idx])
+
+    def attach_terms_result(self,
+                            doc: Doc,
+                            entities_from_text: list,
+                            result_from_ef_terms: Tuple[dict, dict, list] = None) -> list:
+        """
+        It attaches the result of the second pass (terms method in Entity-Fishing service), if any,
+        to the document and merges the entities of the two passes (the fingerprint of the
+        document is updated if `incremental` is set).
+
+        :param doc: The document to be processed
+        :type doc: Doc
+        :param entities_from_text: the entities disambiguated by the first pass
+        :type entities_from_text: list
+        :param result_from_ef_terms: the response, metadata and entities of the second pass
+        :type result_from_ef_terms: Tuple[dict, dict, list]
+        :return: the entities to link the spans with.
+        """
+        entities_from_terms = []
+        if result_from_ef_terms is not None:
+            entities_from_terms = result_from_ef_terms[2]
+
+            # 2b. Attach raw response (with terms method in Entity-Fishing service) to doc
+            if len(result_from_ef_terms[0]) > 0 and self.output.annotations != "none":
+                self._attach_annotation(doc, "disambiguation_terms_service",
+                                        result_from_ef_terms[0])
+            doc._.metadata["disambiguation_terms_service"] = result_from_ef_terms[1]
+
+        if self.config.incremental:
+            if linked_ok(doc._.metadata) and "truncated_annotations" not in doc._.metadata:
+                doc._.metadata["fingerprint"] = fingerprint(doc)
+            else:
+                # failed passes or truncated annotations can not be reused: the document is
+                # linked again from scratch
+                doc._.metadata.pop("fingerprint", None)
+
+        # 3. Merge two list of entities (first and second pass in EF service)
+        return merge_entities(entities_from_text, entities_from_terms)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters of the passes: "incremental" (number of documents reused, partially linked and
+        fully linked), "preflight" (number of documents not sent by `preflight` or because the
+        `link_index` links all their entities) and "link_index" (number of entities linked
+        locally and sent to the service). Empty for the features disabled.
+        """
+        enabled = {
+            "incremental": self.config.incremental,
+            "preflight": self.config.preflight or self.link_index is not None,
+            "link_index": self.link_index is not None,
+        }
+        return {name: ({key: self.counts[name][key] for key in keys} if enabled[name] else {})
+                for name, keys in COUNTERS.items()}
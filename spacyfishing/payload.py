@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+
+"""payload.py
+
+Encoding of the requests: the entities of the queries, and the bodies sent
+as multipart form data (default) or as a JSON body, optionally compressed
+(gzip or deflate) for servers that accept compressed requests; and the size
+of the responses as received (compressed) rather than decoded.
+"""
+
+import gzip
+import zlib
+
+from typing import NamedTuple, Optional
+
+from urllib3.filepost import encode_multipart_formdata
+
+from .parsing import dumps
+
+REQUEST_FORMATS = ("multipart", "json")
+
+REQUEST_COMPRESSIONS = (None, "gzip", "deflate")
+
+
+class Body(NamedTuple):
+    """Encoded body of a request."""
+    content: Optional[bytes]
+    """The body (None if the multipart content is sent as is, encoded by the HTTP library)."""
+    headers: dict
+    """Headers of the body (content type and encoding)."""
+
+
+def entity_query(ent, offset: int = 0) -> dict:
+    """
+    It converts a span (or an entity already converted) to an entity of a query,
+    with offsets relative to `offset`.
+
+    :param ent: a span or an entity of a query
+    :param offset: position of the text of the query in the document
+    :type offset: int
+    :return: the entity of the query.
+    """
+    if isinstance(ent, dict):
+        return dict(ent,
+                    offsetStart=ent["offsetStart"] - offset,
+                    offsetEnd=ent["offsetEnd"] - offset)
+    return {
+        "rawName": ent.text,
+        "offsetStart": ent.start_char - offset,
+        "offsetEnd": ent.end_char - offset,
+    }
+
+
+def prepare_query(text: str, terms: str, entities: list, language: dict,
+                  full: bool = False) -> dict:
+    """
+    It builds the query of the `disambiguate` service (the "query" field of the request).
+
+    :param text: the text to disambiguate ("" to send terms)
+    :type text: str
+    :param terms: the terms to disambiguate (`shortText`, "" to send a text)
+    :type terms: str
+    :param entities: the entities of the text (spans, or entities of a query)
+    :type entities: list
+    :param language: the language of the text (eg. {"lang": "en"})
+    :type language: dict
+    :param full: ask for the full description of the entities
+    :type full: bool
+    :return: the query.
+    """
+    return {
+        # compact JSON (`orjson` if installed)
+        "query": dumps({
+            "text": text,
+            "shortText": terms,
+            "language": language,
+            "entities": [entity_query(ent) for ent in entities],
+            "mentions": [],
+            "customisation": "generic",
+            "full": "true" if full else "false"
+        })
+    }
+
+
+def encode_body(files: Optional[dict],
+                request_format: str = "multipart",
+                compression: Optional[str] = None) -> Body:
+    """
+    It encodes the body of a request (once for all its attempts).
+
+    :param files: multipart content of the request (None without body)
+    :type files: dict
+    :param request_format: "multipart" (form data) or "json" (the "query" field as body)
+    :type request_format: str
+    :param compression: None, "gzip" or "deflate"
+    :type compression: str
+    :return: the body and its headers (no body if `files` is sent as is, as multipart by the
+    HTTP library).
+    """
+    if files is None or (request_format == "multipart" and compression is None):
+        return Body(None, {})
+    if request_format == "json":
+        query = files["query"]
+        body = query.encode("utf-8") if isinstance(query, str) else query
+        headers = {"Content-Type": "application/json"}
+    else:
+        body, content_type = encode_multipart_formdata(files)
+        headers = {"Content-Type": content_type}
+    if compression == "gzip":
+        # level 6: most of the gain of level 9, much faster
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    elif compression == "deflate":
+        body = zlib.compress(body, 6)
+        headers["Content-Encoding"] = "deflate"
+    return Body(body, headers)
+
+
+def received_bytes(response) -> int:
+    """
+    It returns the size of the body of a response as received (before decompression).
+
+    :param response: a `requests.Response` or an `httpx.Response` (already read)
+    :return: the number of bytes.
+    """
+    if hasattr(response, "num_bytes_downloaded"):
+        # httpx.Response
+        return response.num_bytes_downloaded
+    raw = getattr(response, "raw", None)
+    if raw is not None and hasattr(raw, "tell"):
+        try:
+            # bytes read from the connection by urllib3
+            return raw.tell()
+        except (OSError, ValueError):
+            pass
+    return len(response.content)
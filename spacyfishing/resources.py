@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+
+"""resources.py
+
+Resources of a process (thread pools, connection-pooled sessions): created
+on first use, and created again in a forked worker process, which inherits
+neither the threads of a pool nor usable sockets. The objects that hold
+them can be pickled (the resources are not).
+"""
+
+import os
+import threading
+
+from typing import Any, Callable
+
+
+class Lockable:
+    """Mixin of the objects guarded by a `_lock`: unpickled objects get a lock of their own."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class ProcessLocal:
+    """A resource created on first use in each process."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        """
+        `ProcessLocal` creates its resource with `factory` on the first `get` of each process.
+
+        Parameters:
+            factory (Callable[[], Any]): creates the resource (picklable, eg. a
+            `functools.partial`).
+        """
+        self.factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getstate__(self) -> dict:
+        # the resource stays with the process that created it
+        state = self.__dict__.copy()
+        state.update(_value=None)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_process(self) -> None:
+        if self._pid != os.getpid():
+            self._value = None
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    def get(self) -> Any:
+        """
+        It returns the resource of the current process (created on first access).
+
+        :return: the resource.
+        """
+        self._check_process()
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self.factory()
+        return self._value
+
+    def close(self, release: Callable[[Any], None]) -> None:
+        """
+        It releases the resource of the current process, if created (it is created again
+        on the next `get`).
+
+        :param release: releases the resource (eg. `ThreadPoolExecutor.shutdown`)
+        :type release: Callable[[Any], None]
+        """
+        self._check_process()
+        with self._lock:
+            if self._value is not None:
+                release(self._value)
+                self._value = None
@@ -0,0 +1,299 @@
+# -*- coding: UTF-8 -*-
+
+"""scheduler.py
+
+Request scheduling for the Entity-fishing clients: a token bucket
+(requests-per-second budget) and an AIMD adaptive concurrency limit
+that backs off on 429/5xx responses, errors and latency spikes (relative
+to the size of the requests) and ramps up while the server is healthy.
+"""
+
+import asyncio
+import threading
+import time
+
+from typing import NamedTuple, Optional
+
+from .resources import Lockable
+
+# Responses that signal an overloaded server.
+CONGESTION_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(Lockable):
+    """Thread-safe token bucket."""
+
+    def __init__(self, rate: float, burst: int = 0):
+        """
+        `TokenBucket` grants `rate` tokens per second, up to `burst` tokens at once.
+
+        Parameters:
+            rate (float): tokens (requests) per second.
+            burst (int): capacity of the bucket (0: `max(1, rate)`).
+        """
+        self.rate = rate
+        self.capacity = burst if burst > 0 else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        super().__init__()
+
+    def reserve(self) -> float:
+        """
+        It takes a token and returns the time to wait before using it.
+
+        :return: the delay in seconds (0 if a token is available now).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    @property
+    def stats(self) -> dict:
+        """Budget of the bucket."""
+        return {"rate_limit": self.rate}
+
+
+class AimdPolicy(NamedTuple):
+    """Bounds and factors of an `AdaptiveConcurrencyLimiter`."""
+    min_limit: int = 1
+    """Lowest concurrency limit."""
+    max_limit: int = 20
+    """Highest concurrency limit."""
+    decrease_factor: float = 0.5
+    """Factor applied to the limit on congestion."""
+    latency_factor: float = 3.0
+    """Latency spike threshold, relative to the average latency per KiB (0 disables it)."""
+
+
+class RoundTrips(NamedTuple):
+    """Exponential moving averages of the round trips seen by an `AdaptiveConcurrencyLimiter`."""
+    latency: Optional[float] = None
+    """Average latency in seconds (None before the first round trip)."""
+    relative_latency: Optional[float] = None
+    """Average latency per KiB of payload."""
+    last_decrease: float = 0.0
+    """Time (`time.monotonic`) of the last decrease of the limit."""
+
+    def update(self, latency: float, relative_latency: float) -> "RoundTrips":
+        """
+        It adds a round trip to the averages.
+
+        :param latency: the duration of the request in seconds
+        :type latency: float
+        :param relative_latency: the duration of the request per KiB of payload
+        :type relative_latency: float
+        :return: the updated averages.
+        """
+        if self.latency is None:
+            return RoundTrips(latency, relative_latency, self.last_decrease)
+        return RoundTrips(0.9 * self.latency + 0.1 * latency,
+                          0.9 * self.relative_latency + 0.1 * relative_latency,
+                          self.last_decrease)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD (additive increase, multiplicative decrease) concurrency limit."""
+
+    def __init__(self,
+                 min_limit: int = 1,
+                 max_limit: int = 20,
+                 decrease_factor: float = 0.5,
+                 latency_factor: float = 3.0):
+        """
+        `AdaptiveConcurrencyLimiter` starts at `min_limit` and doubles the limit every round
+        trip until the first congestion signal (slow start), then increases it by one every
+        round trip. A congestion signal (429/5xx, connection error or a latency per KiB of
+        payload above `latency_factor` times its average, so that a long document is not taken
+        for a slow server) multiplies the limit by `decrease_factor`, at most once per round trip.
+
+        Parameters:
+            min_limit (int): lowest concurrency limit.
+            max_limit (int): highest concurrency limit.
+            decrease_factor (float): factor applied to the limit on congestion.
+            latency_factor (float): latency spike threshold, relative to the average latency
+            per KiB of payload (0 disables the latency signal).
+
+        Attributes:
+            policy (AimdPolicy): bounds and factors of the limit.
+            round_trips (RoundTrips): averages of the round trips.
+        """
+        min_limit = max(1, min_limit)
+        self.policy = AimdPolicy(min_limit, max(min_limit, max_limit), decrease_factor,
+                                 latency_factor)
+        self.limit = float(min_limit)
+        self.in_flight = 0
+        # slow start lasts until the first congestion event
+        self.congestion_events = 0
+        self.round_trips = RoundTrips()
+        self._condition = threading.Condition()
+        # tasks waiting for a slot, woken up on their own event loop by `release`
+        self._waiters = []
+
+    @property
+    def latency_average(self) -> Optional[float]:
+        """Average latency of the requests in seconds (None before the first response)."""
+        return self.round_trips.latency
+
+    def acquire(self) -> None:
+        """It waits for a slot and takes it."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def aacquire(self) -> None:
+        """It waits for a slot (without blocking the event loop) and takes it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, asyncio.Event())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1].wait()
+            finally:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def _notify(self) -> None:
+        # called with the lock held: wakes up the threads and the tasks waiting for a slot
+        self._condition.notify_all()
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # pragma: no cover
+                pass  # the event loop is closed
+        self._waiters.clear()
+
+    def release(self, status_code: Optional[int], latency: float, size: int = 0) -> None:
+        """
+        It frees a slot and updates the limit from the outcome of the request.
+
+        :param status_code: the status code of the response (None if the request failed)
+        :type status_code: Optional[int]
+        :param latency: the duration of the request in seconds
+        :type latency: float
+        :param size: the size of the payload of the request (bytes)
+        :type size: int
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            policy, previous = self.policy, self.round_trips
+            # latency per KiB of payload (requests under 1 KiB count as 1 KiB)
+            relative_latency = latency / max(1.0, size / 1024)
+            spike = (policy.latency_factor > 0 and previous.relative_latency is not None
+                     and relative_latency > policy.latency_factor * previous.relative_latency)
+            self.round_trips = previous.update(latency, relative_latency)
+
+            if status_code is None or status_code in CONGESTION_STATUS_CODES or spike:
+                if now - self.round_trips.last_decrease > self.round_trips.latency:
+                    self.limit = max(float(policy.min_limit), self.limit * policy.decrease_factor)
+                    self.round_trips = RoundTrips(self.round_trips.latency,
+                                                  self.round_trips.relative_latency, now)
+                    self.congestion_events += 1
+            elif self.congestion_events == 0:
+                self.limit = min(float(policy.max_limit), self.limit + 1)
+            else:
+                self.limit = min(float(policy.max_limit), self.limit + 1 / self.limit)
+            self._notify()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_condition"]
+        state["in_flight"] = 0
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._condition = threading.Condition()
+
+
+class RequestScheduler(Lockable):
+    """Admission of the requests: requests-per-second budget and adaptive concurrency."""
+
+    def __init__(self,
+                 rate_limit: float = 0.0,
+                 rate_burst: int = 0,
+                 adaptive_concurrency: bool = False,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 20):
+        """
+        `RequestScheduler` is shared by the synchronous and asynchronous clients.
+
+        Parameters:
+            rate_limit (float): requests per second (0 disables the budget).
+            rate_burst (int): requests allowed at once above the rate (0: `max(1, rate_limit)`).
+            adaptive_concurrency (bool): adapt the number of requests in flight (AIMD).
+            min_concurrency (int): lowest adaptive concurrency limit.
+            max_concurrency (int): highest adaptive concurrency limit.
+        """
+        self.bucket = TokenBucket(rate_limit, rate_burst) if rate_limit > 0 else None
+        self.limiter = None
+        if adaptive_concurrency:
+            self.limiter = AdaptiveConcurrencyLimiter(min_limit=min_concurrency,
+                                                      max_limit=max_concurrency)
+        self.throttled_seconds = 0.0
+        super().__init__()
+
+    def _throttle(self) -> float:
+        if self.bucket is None:
+            return 0.0
+        delay = self.bucket.reserve()
+        if delay > 0:
+            with self._lock:
+                self.throttled_seconds += delay
+        return delay
+
+    def acquire(self) -> None:
+        """It waits until a request can be sent."""
+        if self.limiter is not None:
+            self.limiter.acquire()
+        delay = self._throttle()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self) -> None:
+        """It waits (without blocking the event loop) until a request can be sent."""
+        if self.limiter is not None:
+            await self.limiter.aacquire()
+        delay = self._throttle()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def release(self, status_code: Optional[int], latency: float, size: int = 0) -> None:
+        """
+        It reports the outcome of a request.
+
+        :param status_code: the status code of the response (None if the request failed)
+        :type status_code: Optional[int]
+        :param latency: the duration of the request in seconds
+        :type latency: float
+        :param size: the size of the payload of the request (bytes)
+        :type size: int
+        """
+        if self.limiter is not None:
+            self.limiter.release(status_code, latency, size)
+
+    @property
+    def stats(self) -> dict:
+        """Current state of the scheduler."""
+        stats = {"throttled_seconds": round(self.throttled_seconds, 3)}
+        if self.bucket is not None:
+            stats.update(self.bucket.stats)
+        if self.limiter is not None:
+            stats.update({
+                "concurrency_limit": int(self.limiter.limit),
+                "in_flight": self.limiter.in_flight,
+                "congestion_events": self.limiter.congestion_events,
+                "latency_average": self.limiter.latency_average,
+            })
+        return stats
@@ -0,0 +1,90 @@
+# -*- coding: UTF-8 -*-
+
+"""storage.py
+
+Per-document storage of the `annotations` and `metadata` extensions of
+`Doc`: each document gets its own dict in `doc.user_data` (under the key
+spaCy uses for the extension, so `DocBin`s stay compatible), allocated on
+first access, and the raw responses attached to it can be capped in size.
+"""
+
+import functools
+
+from typing import Tuple
+
+from spacy.tokens import Doc
+
+# Doc extensions stored per document.
+DOC_EXTENSIONS = ("annotations", "metadata")
+
+
+def store_key(name: str) -> tuple:
+    """
+    It builds the `user_data` key of a `Doc` extension (the key of spaCy's extensions).
+
+    :param name: the name of the extension
+    :type name: str
+    :return: the key.
+    """
+    return "._.", name, None, None
+
+
+def get_store(name: str, doc: Doc) -> dict:
+    """
+    It returns the dict of the extension `name` of `doc`, allocated on first access.
+
+    :param name: the name of the extension
+    :type name: str
+    :param doc: the document
+    :type doc: Doc
+    :return: the dict of the document.
+    """
+    key = store_key(name)
+    store = doc.user_data.get(key)
+    if store is None:
+        store = doc.user_data[key] = {}
+    return store
+
+
+def set_store(name: str, doc: Doc, value: dict) -> None:
+    """
+    It replaces the dict of the extension `name` of `doc` (by a copy, owned by the document).
+
+    :param name: the name of the extension
+    :type name: str
+    :param doc: the document
+    :type doc: Doc
+    :param value: the new content
+    :type value: dict
+    """
+    doc.user_data[store_key(name)] = dict(value)
+
+
+def set_doc_extensions() -> None:
+    """
+    It registers the `Doc` extensions stored per document (again, if they were registered
+    with a default value shared by all the documents, eg. by a previous version).
+    """
+    for name in DOC_EXTENSIONS:
+        if Doc.has_extension(name) and Doc.get_extension(name)[2] is not None:
+            continue
+        Doc.set_extension(name,
+                          getter=functools.partial(get_store, name),
+                          setter=functools.partial(set_store, name),
+                          force=True)
+
+
+def cap_response(response: dict, max_entities: int) -> Tuple[dict, int]:
+    """
+    It keeps at most `max_entities` entities in a response attached to a document.
+
+    :param response: the response
+    :type response: dict
+    :param max_entities: maximum number of entities (0: no limit)
+    :type max_entities: int
+    :return: the response (a copy if capped) and the number of entities dropped.
+    """
+    entities = response.get("entities")
+    if max_entities <= 0 or entities is None or len(entities) <= max_entities:
+        return response, 0
+    return dict(response, entities=entities[:max_entities]), len(entities) - max_entities
@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+
+"""streaming.py
+
+Streaming processing of documents: each document pulled from the stream is
+processed at once in a thread of its own pool (its requests are sent by the
+pool of the HTTP client, so that a document waiting for its requests never
+holds a thread the requests need), while the stream (the upstream components
+of the pipeline) keeps being consumed. Documents are yielded in the order of
+the stream, and at most `window` documents are in flight (the stream is not
+consumed further until the first pending document is done).
+"""
+
+import collections
+import concurrent.futures
+import functools
+
+from typing import Callable, Iterable, Iterator
+
+from spacy.tokens import Doc
+
+from .resources import ProcessLocal
+
+
+class DocStream:
+    """Bounded window of documents processed concurrently and yielded in order."""
+
+    def __init__(self, window: int):
+        """
+        `DocStream` owns a `ThreadPoolExecutor` of `window` threads, created on first use
+        in each process (it can be pickled or inherited by a forked worker process).
+
+        Parameters:
+            window (int): maximum number of documents in flight.
+        """
+        self.window = window
+        self._executor = ProcessLocal(functools.partial(concurrent.futures.ThreadPoolExecutor,
+                                                        max_workers=window,
+                                                        thread_name_prefix="entityfishing-doc"))
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Thread pool processing the documents (created on first access in each process)."""
+        return self._executor.get()
+
+    def process(self, stream: Iterable[Doc], func: Callable[[Doc], Doc]) -> Iterator[Doc]:
+        """
+        It processes the documents of a stream with `func`, `window` documents at a time,
+        and yields them in the order of the stream (as soon as they and all the documents
+        before them are done).
+
+        :param stream: the documents
+        :type stream: Iterable[Doc]
+        :param func: the processing of a document (eg. the component)
+        :type func: Callable[[Doc], Doc]
+        :return: the processed documents.
+        """
+        pending = collections.deque()
+        try:
+            for doc in stream:
+                pending.append(self.executor.submit(func, doc))
+                # blocks on the first pending document when the window is full (backpressure)
+                while pending and (pending[0].done() or len(pending) >= self.window):
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """Release the threads."""
+        self._executor.close(concurrent.futures.ThreadPoolExecutor.shutdown)
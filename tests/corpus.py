@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+
+"""corpus.py
+
+Synthetic corpus and lightweight pipeline (blank model + entity ruler)
+shared by tests and benchmarks, so that they do not need a trained NER model.
+"""
+
+import random
+
+from typing import List
+
+import spacy
+
+from spacy.language import Language
+
+# registers the `entityfishing` factory
+import spacyfishing  # noqa: F401  pylint: disable=unused-import
+
+MENTIONS = [
+    ("GPE", "Austria"), ("GPE", "Russia"), ("GPE", "France"), ("GPE", "Belgium"),
+    ("GPE", "Luxembourg"), ("GPE", "Trieste"), ("NORP", "Serbian"), ("NORP", "German"),
+    ("NORP", "Italians"), ("NORP", "Allied"), ("PERSON", "Paul von Hindenburg"),
+    ("PERSON", "Joseph Joffre"), ("PERSON", "John French"), ("PERSON", "Cadorna"),
+    ("PERSON", "Constantine I"), ("PERSON", "E. Venizelos"), ("EVENT", "Battle of Cer"),
+    ("EVENT", "Battle of Kolubara"), ("EVENT", "First Battle of Tannenberg"),
+    ("EVENT", "First Battle of the Marne"), ("EVENT", "Siege of Maubeuge"),
+    ("EVENT", "Brusilov Offensive"), ("EVENT", "Battle of Charleroi"), ("EVENT", "Battle of Mons"),
+    ("LOC", "Isonzo River"), ("LOC", "Ardennes"), ("LOC", "North Sea"), ("ORG", "British Expeditionary Force"),
+]
+
+FILLERS = ["the army advanced towards", "troops met", "a series of battles near", "reports from",
+           "the offensive against", "soldiers surrendered at", "the front along", "negotiations with"]
+
+
+def make_nlp(language: str = "en", **config) -> Language:
+    """
+    It builds a blank pipeline with an entity ruler recognising `MENTIONS`
+    followed by the `entityfishing` component.
+
+    :param language: language of the blank pipeline
+    :type language: str
+    :param config: configuration of the `entityfishing` component
+    :return: the pipeline.
+    """
+    nlp = spacy.blank(language)
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": label, "pattern": pattern} for label, pattern in MENTIONS])
+    nlp.add_pipe("entityfishing", config=config)
+    return nlp
+
+
+def make_texts(n_docs: int, n_mentions: int = 8, seed: int = 0) -> List[str]:
+    """
+    It generates `n_docs` texts with `n_mentions` mentions each.
+
+    :param n_docs: number of texts
+    :type n_docs: int
+    :param n_mentions: number of mentions in each text
+    :type n_mentions: int
+    :param seed: seed of the random generator
+    :type seed: int
+    :return: the texts.
+    """
+    rng = random.Random(seed)
+    texts = []
+    for idx in range(n_docs):
+        words = [f"Report {idx}:"]
+        for _ in range(n_mentions):
+            words.append(rng.choice(FILLERS))
+            words.append(rng.choice(MENTIONS)[1])
+            words.append(".")
+        texts.append(" ".join(words))
+    return texts
+
+
+def make_dense_texts(n_docs: int, n_mentions: int = 50, seed: int = 0) -> List[str]:
+    """
+    It generates `n_docs` entity-dense texts: `n_mentions` mentions separated by commas.
+
+    :param n_docs: number of texts
+    :type n_docs: int
+    :param n_mentions: number of mentions in each text
+    :type n_mentions: int
+    :param seed: seed of the random generator
+    :type seed: int
+    :return: the texts.
+    """
+    rng = random.Random(seed)
+    return [f"List {idx}: " + ", ".join(rng.choice(MENTIONS)[1] for _ in range(n_mentions)) + "."
+            for idx in range(n_docs)]
+
+
+def make_long_texts(n_docs: int, n_paragraphs: int = 50, n_mentions: int = 8, seed: int = 0) -> List[str]:
+    """
+    It generates `n_docs` long texts of `n_paragraphs` paragraphs (cf. `make_texts`).
+
+    :param n_docs: number of texts
+    :type n_docs: int
+    :param n_paragraphs: number of paragraphs in each text
+    :type n_paragraphs: int
+    :param n_mentions: number of mentions in each paragraph
+    :type n_mentions: int
+    :param seed: seed of the random generator
+    :type seed: int
+    :return: the texts.
+    """
+    paragraphs = make_texts(n_docs * n_paragraphs, n_mentions=n_mentions, seed=seed)
+    return ["\n\n".join(paragraphs[idx * n_paragraphs:(idx + 1) * n_paragraphs]) for idx in range(n_docs)]
@@ -0,0 +1,289 @@
+# -*- coding: UTF-8 -*-
+
+"""mock_server.py
+
+Local mock of the Entity-fishing REST API (`disambiguate` service)
+used by benchmarks and tests, so that neither depends on
+the public demo server.
+"""
+
+import gzip
+import json
+import random
+import threading
+import time
+import zlib
+
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUPPORTED_LANGUAGES = {"en", "fr", "de", "it", "es", "ar", "zh", "ru", "ja", "pt", "fa", "uk", "sv", "bn", "hi"}
+
+
+def fake_qid(raw_name: str) -> int:
+    """
+    It returns a stable (fake) Wikidata identifier number for a mention.
+
+    :param raw_name: the surface form of the mention
+    :type raw_name: str
+    :return: an integer identifier.
+    """
+    return zlib.crc32(raw_name.encode("utf-8")) % 10_000_000 + 1
+
+
+def parse_query(content_type: str, body: bytes) -> dict:
+    """
+    It extracts the JSON query from a multipart/form-data body, or from an application/json body.
+
+    :param content_type: the Content-Type header of the request
+    :type content_type: str
+    :param body: the raw body of the request
+    :type body: bytes
+    :return: the decoded query.
+    """
+    if content_type.split(";")[0].strip() == "application/json":
+        return json.loads(body.decode("utf-8"))
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "query":
+            return json.loads(part.get_payload(decode=True).decode("utf-8"))
+    raise ValueError("missing query")
+
+
+def disambiguate(query: dict, padding: int = 0) -> dict:
+    """
+    It builds a fake `disambiguate` response: every entity of the query is linked
+    with a QID derived from its surface form, except one in five entities in the
+    text mode (left to the "nil clustering" pass).
+
+    :param query: the decoded query
+    :type query: dict
+    :param padding: characters of filler added to each entity (size of the response)
+    :type padding: int
+    :return: the response body.
+    """
+    text_mode = len(query.get("text", "")) > 0
+    full = query.get("full") == "true"
+    entities = []
+    for entity in query.get("entities", []):
+        qid = fake_qid(entity["rawName"])
+        if text_mode and qid % 5 == 0:
+            continue
+        result = {
+            "rawName": entity["rawName"],
+            "offsetStart": entity["offsetStart"],
+            "offsetEnd": entity["offsetEnd"],
+            "confidence_score": round((qid % 1000) / 1000, 3),
+            "wikipediaExternalRef": qid,
+            "wikidataId": f"Q{qid}",
+        }
+        if full:
+            result.update(concept(qid))
+        if padding > 0:
+            result["padding"] = "x" * padding
+        entities.append(result)
+    return {
+        "software": "entity-fishing",
+        "version": "mock",
+        "text": query.get("text", ""),
+        "shortText": query.get("shortText", ""),
+        "language": query.get("language", {}),
+        "entities": entities,
+        "runtime": 0,
+    }
+
+
+def concept(wiki_id: int, padding: int = 0) -> dict:
+    """
+    It builds a fake `kb/concept` response.
+
+    :param wiki_id: the Wikipedia identifier of the concept
+    :type wiki_id: int
+    :param padding: characters of filler added to the concept (size of the response)
+    :type padding: int
+    :return: the concept.
+    """
+    result = {
+        "wikipediaExternalRef": wiki_id,
+        "wikidataId": f"Q{wiki_id}",
+        "preferredTerm": f"Concept {wiki_id}",
+        "definitions": [{"definition": f"Definition of concept {wiki_id}.",
+                         "source": "wikipedia-en",
+                         "lang": "en"}],
+        "statements": [{"conceptId": f"Q{wiki_id}",
+                        "propertyId": "P214",
+                        "propertyName": "VIAF ID",
+                        "valueType": "external-id",
+                        "value": str(wiki_id)}],
+    }
+    if padding > 0:
+        result["padding"] = "x" * padding
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        compress = self.server.compress_responses and "gzip" in self.headers.get("Accept-Encoding", "")
+        if compress:
+            payload = gzip.compress(payload, mtime=0)
+        if self.server.corrupt_encoding:
+            # declared compressed but not: the client fails to decode the body
+            compress = True
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _simulate(self) -> bool:
+        server = self.server
+        server.count_request(1)
+        try:
+            delay = server.latency + server.rng_uniform(0, server.jitter)
+            if delay > 0:
+                time.sleep(delay)
+        finally:
+            server.count_request(-1)
+        if server.error_rate > 0 and server.rng_uniform(0, 1) < server.error_rate:
+            self._send_json(500, {"message": "Mock internal error"})
+            return False
+        return True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = self.path.split("?")[0]
+        if path.endswith("/isalive"):
+            self._send_json(200, {"alive": True})
+        elif "/kb/concept/" in path:
+            if self._simulate():
+                wiki_id = path.rsplit("/", 1)[-1]
+                try:
+                    self._send_json(200, concept(int(wiki_id), self.server.payload_padding))
+                except ValueError:
+                    self._send_json(404, {"message": "Concept not found"})
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.count_bytes(len(body))
+        if not self.path.split("?")[0].endswith("/disambiguate"):
+            self._send_json(404, {"message": "Not found"})
+            return
+        if not self._simulate():
+            return
+        try:
+            encoding = self.headers.get("Content-Encoding", "identity")
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            elif encoding == "deflate":
+                body = zlib.decompress(body)
+            elif encoding != "identity":
+                self._send_json(415, {"message": f"Unsupported Content-Encoding: {encoding}"})
+                return
+            query = parse_query(self.headers.get("Content-Type", ""), body)
+        except (ValueError, KeyError, OSError, zlib.error):
+            self._send_json(400, {"message": "Wrong request"})
+            return
+        if query.get("language", {}).get("lang") not in SUPPORTED_LANGUAGES:
+            self._send_json(406, {"message": "The language specified is not supported or not valid. "})
+            return
+        if len(query.get("text", "")) + len(query.get("shortText", "")) <= 5:
+            self._send_json(400, {"message": "Text too short"})
+            return
+        self._send_json(200, disambiguate(query, self.server.payload_padding))
+
+
+class MockEntityFishingServer(ThreadingHTTPServer):
+    """Threaded mock of the Entity-fishing API listening on localhost."""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self,
+                 port: int = 0,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 seed: int = None,
+                 payload_padding: int = 0,
+                 compress_responses: bool = False,
+                 corrupt_encoding: bool = False):
+        """
+        `MockEntityFishingServer` serves the Entity-fishing API on localhost.
+
+        Parameters:
+            port (int): port to listen on (0 picks a free port).
+            latency (float): fixed delay (seconds) added to each request.
+            jitter (float): random delay (seconds) added on top of `latency`.
+            error_rate (float): probability to answer with a 500 error.
+            seed (int): seed of the random generator.
+            payload_padding (int): characters of filler added to each entity and concept of
+            the responses (to emulate large responses).
+            compress_responses (bool): gzip the responses to the clients accepting it (`Accept-Encoding`).
+            corrupt_encoding (bool): send the responses with a gzip `Content-Encoding` and a body that is not.
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.payload_padding = payload_padding
+        self.compress_responses = compress_responses
+        self.corrupt_encoding = corrupt_encoding
+        self.request_count = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the mock service (to use as `api_ef_base`)."""
+        return f"http://127.0.0.1:{self.server_address[1]}/service/"
+
+    def rng_uniform(self, low: float, high: float) -> float:
+        """Thread-safe uniform draw."""
+        with self._lock:
+            return self._rng.uniform(low, high)
+
+    def count_request(self, step: int) -> None:
+        """Thread-safe request counters (total and concurrent requests)."""
+        with self._lock:
+            if step > 0:
+                self.request_count += 1
+            self.in_flight += step
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def count_bytes(self, size: int) -> None:
+        """Thread-safe counter of the bytes of the bodies received."""
+        with self._lock:
+            self.bytes_received += size
+
+    def start(self) -> "MockEntityFishingServer":
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and release the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
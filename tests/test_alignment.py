@@ -0,0 +1,50 @@
+# -*- coding: UTF-8 -*-
+
+import random
+import unittest
+
+import spacy
+
+from spacyfishing.alignment import CharIndex
+
+from tests.corpus import make_nlp, make_texts
+
+
+class TestEfAlignment(unittest.TestCase):
+    def test_same_spans_as_char_span(self):
+        doc = spacy.blank("en")(make_texts(1, n_mentions=30)[0])
+        rng = random.Random(0)
+        offsets = []
+        for _ in range(500):
+            start = rng.randrange(0, len(doc.text))
+            offsets.append((start, min(len(doc.text), start + rng.randrange(1, 30))))
+        index = CharIndex(doc)
+        for mode in ("strict", "contract", "expand"):
+            for (start, end), bounds in zip(offsets, index.token_bounds(offsets, mode)):
+                span = doc.char_span(start, end, alignment_mode=mode)
+                expected = (span.start, span.end) if span is not None and len(span) > 0 else None
+                self.assertEqual(bounds, expected, (mode, start, end))
+
+    def test_recover_misaligned_links(self):
+        nlp = make_nlp(api_ef_base="http://localhost/", output={"alignment_mode": "expand"})
+        with nlp.select_pipes(disable=["entityfishing"]):
+            doc = nlp(make_texts(1)[0])
+        ent = doc.ents[0]
+        # offsets cutting the last character of the mention
+        response = [{"rawName": ent.text[:-1], "offsetStart": ent.start_char, "offsetEnd": ent.end_char - 1,
+                     "wikidataId": "Q42", "confidence_score": 0.5}]
+
+        nlp.get_pipe("entityfishing").updated_entities(doc, response)
+        self.assertEqual(ent._.kb_qid, "Q42")
+        self.assertEqual(doc._.metadata["unaligned_entities"], 0)
+
+        strict = make_nlp(api_ef_base="http://localhost/").get_pipe("entityfishing")
+        with nlp.select_pipes(disable=["entityfishing"]):
+            doc = nlp(make_texts(1)[0])
+        strict.updated_entities(doc, response)
+        self.assertIsNone(doc.ents[0]._.kb_qid)
+        self.assertEqual(doc._.metadata["unaligned_entities"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
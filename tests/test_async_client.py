@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+
+import asyncio
+import gc
+import threading
+import unittest
+import warnings
+
+from unittest import mock
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer, fake_qid
+
+
+class TestEfAsyncClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = MockEntityFishingServer(latency=0.001, jitter=0.03, seed=3).start()
+        cls.texts = make_texts(80)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.stop()
+
+    def run_apipe(self, nlp, batch_size=128, max_in_flight=1024):
+        linker = nlp.get_pipe("entityfishing")
+
+        async def collect():
+            async def stream():
+                with nlp.select_pipes(disable=["entityfishing"]):
+                    for doc in nlp.pipe(self.texts):
+                        yield doc
+            docs = [doc async for doc in linker.apipe(stream(), batch_size=batch_size,
+                                                          max_in_flight=max_in_flight)]
+            await linker.aclose()
+            return docs
+
+        return asyncio.run(collect())
+
+    def test_apipe_keeps_order_and_links(self):
+        nlp = make_nlp(api_ef_base=self.server.url, client={"async_concurrency": 16})
+        docs = self.run_apipe(nlp, batch_size=8, max_in_flight=10)
+        self.assertEqual([doc.text for doc in docs], self.texts)
+        for doc in docs:
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+            self.assertEqual(doc._.annotations["disambiguation_text_service"]["text"], doc.text)
+            for ent in doc.ents:
+                if ent._.kb_qid is not None:
+                    self.assertEqual(ent._.kb_qid, f"Q{fake_qid(ent.text)}")
+
+    def test_apipe_matches_pipe(self):
+        nlp = make_nlp(api_ef_base=self.server.url)
+        expected = [[ent._.kb_qid for ent in doc.ents] for doc in nlp.pipe(self.texts)]
+        docs = self.run_apipe(nlp)
+        self.assertEqual([[ent._.kb_qid for ent in doc.ents] for doc in docs], expected)
+        self.assertTrue(any(doc._.metadata.get("disambiguation_terms_service") for doc in docs))
+
+    def test_connections_closed_with_each_loop(self):
+        nlp = make_nlp(api_ef_base=self.server.url, client={"async_concurrency": 8})
+        linker = nlp.get_pipe("entityfishing")
+
+        async def collect():
+            with nlp.select_pipes(disable=["entityfishing"]):
+                docs = list(nlp.pipe(self.texts[:10]))
+            return [doc async for doc in linker.apipe(docs)]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            for _ in range(3):
+                self.assertEqual(len(asyncio.run(collect())), 10)
+                self.assertEqual(len(linker.api.async_client._loops), 0)
+            gc.collect()
+        self.assertEqual([warning for warning in caught if issubclass(warning.category, ResourceWarning)], [])
+
+
+    def test_apipe_sends_minibatches(self):
+        nlp = make_nlp(api_ef_base=self.server.url)
+        linker = nlp.get_pipe("entityfishing")
+        with mock.patch.object(linker, "amain_disambiguation_process_batch",
+                               wraps=linker.amain_disambiguation_process_batch) as process_batch:
+            docs = self.run_apipe(nlp, batch_size=32)
+        self.assertEqual([doc.text for doc in docs], self.texts)
+        calls = [call.kwargs["text_batch"] if "text_batch" in call.kwargs else call.args[0]
+                 for call in process_batch.call_args_list]
+        text_batches = [text_batch for text_batch in calls if text_batch[0] != ""]
+        self.assertEqual([len(text_batch) for text_batch in text_batches], [32, 32, 16])
+        # the "nil clustering" queries of a minibatch are sent as one batch
+        self.assertIn(len(process_batch.call_args_list) - len(text_batches), (1, 2, 3))
+
+    def test_event_loops_keep_their_own_connections(self):
+        client = make_nlp(api_ef_base=self.server.url).get_pipe("entityfishing").api.async_client
+        url = self.server.url + "kb/concept/123"
+        first_sent, second_done = threading.Event(), threading.Event()
+        status_codes = []
+
+        async def first():
+            async with client.session():
+                status_codes.append((await client.request("GET", url)).status_code)
+                first_sent.set()
+                await asyncio.get_running_loop().run_in_executor(None, second_done.wait)
+                # the session of the other event loop is over, this one still has its connections
+                status_codes.append((await client.request("GET", url)).status_code)
+
+        async def second():
+            async with client.session():
+                status_codes.append((await client.request("GET", url)).status_code)
+
+        thread = threading.Thread(target=asyncio.run, args=(first(),))
+        thread.start()
+        first_sent.wait()
+        asyncio.run(second())
+        second_done.set()
+        thread.join()
+        self.assertEqual(status_codes, [200, 200, 200])
+        self.assertEqual(len(client._loops), 0)
@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+import spacyfishing
+
+from spacyfishing.client import backoff_delay
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer, fake_qid
+
+
+class TestEfBatchClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = MockEntityFishingServer(latency=0.001, jitter=0.03, seed=1).start()
+        cls.texts = make_texts(60)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.stop()
+
+    def test_pipe_keeps_request_order(self):
+        nlp = make_nlp(api_ef_base=self.server.url)
+        for text, doc in zip(self.texts, nlp.pipe(self.texts, batch_size=30)):
+            self.assertEqual(doc.text, text)
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+            self.assertEqual(doc._.annotations["disambiguation_text_service"]["text"], text)
+            linked = [ent for ent in doc.ents if ent._.kb_qid is not None]
+            self.assertGreater(len(linked), 0)
+            for ent in linked:
+                self.assertEqual(ent._.kb_qid, f"Q{fake_qid(ent.text)}")
+
+    def test_failed_request_keeps_its_slot(self):
+        unreachable = "http://127.0.0.1:9/service/disambiguate"
+        url_batch = [self.server.url + "isalive", unreachable, self.server.url + "isalive"]
+        responses = spacyfishing.EntityFishing.generic_client_batch(method="GET",
+                                                                    url_batch=url_batch,
+                                                                    verbose=False)
+        self.assertEqual(len(responses), 3)
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertIsInstance(responses[1], Exception)
+        self.assertEqual(responses[2].status_code, 200)
+
+        res, metadata = spacyfishing.EntityFishing.process_response(responses[1])
+        self.assertEqual(res, {})
+        self.assertEqual(metadata["ok"], False)
+        self.assertIsNone(metadata["status_code"])
+        self.assertEqual(metadata["error"], "ConnectionError")
+
+        # same slots through the pooled client of the component
+        linker = make_nlp(api_ef_base=self.server.url, client={"max_retries": 0}).get_pipe("entityfishing")
+        responses = linker.api.batch(method="GET", url_batch=url_batch)
+        self.assertEqual([isinstance(response, Exception) for response in responses], [False, True, False])
+
+    def test_retry_on_server_errors(self):
+        with MockEntityFishingServer(error_rate=0.3, seed=2) as flaky_server:
+            nlp = make_nlp(api_ef_base=flaky_server.url, client={"max_retries": 10, "backoff_factor": 0.001})
+            docs = list(nlp.pipe(self.texts[:20]))
+            self.assertGreater(flaky_server.request_count, 20)
+        for doc in docs:
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+
+    def test_pipe_batches_nil_clustering(self):
+        nlp = make_nlp(api_ef_base=self.server.url)
+        expected = [[ent._.kb_qid for ent in nlp(text).ents] for text in self.texts[:20]]
+        docs = list(nlp.pipe(self.texts[:20], batch_size=20))
+        self.assertEqual([[ent._.kb_qid for ent in doc.ents] for doc in docs], expected)
+        terms_metadata = [doc._.metadata["disambiguation_terms_service"] for doc in docs
+                          if "disambiguation_terms_service" in doc._.metadata]
+        self.assertGreater(len(terms_metadata), 0)
+        for metadata in terms_metadata:
+            self.assertEqual(metadata["status_code"], 200)
+
+    def test_backoff_honors_retry_after(self):
+        class Response:
+            headers = {"Retry-After": "3"}
+        self.assertEqual(backoff_delay(0.5, 2), 2.0)
+        self.assertEqual(backoff_delay(0.5, 0, Response()), 3.0)
+        self.assertEqual(backoff_delay(0.5, 0, Response(), max_delay=1.0), 1.0)
+        self.assertEqual(backoff_delay(0.5, 10, max_delay=1.0), 1.0)
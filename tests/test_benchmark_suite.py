@@ -0,0 +1,35 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+import requests
+
+from benchmarks.suite import compare, run
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfBenchmarkSuite(unittest.TestCase):
+    def test_payload_padding(self):
+        with MockEntityFishingServer(payload_padding=1000) as server:
+            response = requests.get(server.url + "kb/concept/42")
+        self.assertGreater(len(response.content), 1000)
+
+    def test_run_and_compare(self):
+        results = run(["call", "pipe_16"], n_docs=20, latency=0.0, jitter=0.0, error_rate=0.0,
+                      payload_padding=0, isolated=False)
+        self.assertEqual([result["scenario"] for result in results], ["call", "pipe_16"])
+        for result in results:
+            self.assertEqual(result["docs"], 20)
+            self.assertEqual(result["failed_docs"], 0)
+            self.assertGreater(result["docs_per_second"], 0)
+            self.assertLessEqual(result["latency_p50"], result["latency_p99"])
+        self.assertEqual(compare(results, results, tolerance=0.0), [])
+
+        baseline = [dict(results[0], docs_per_second=results[0]["docs_per_second"] * 2)]
+        regressions = compare(results, baseline, tolerance=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("call: docs_per_second"))
+
+
+if __name__ == "__main__":
+    unittest.main()
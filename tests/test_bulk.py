@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import random
+import tempfile
+import unittest
+
+from pathlib import Path
+
+import requests
+import srsly
+
+from spacy.tokens import DocBin, Span
+
+from spacyfishing.bulk import (ResponseStore, apply_responses, export_queries, load_linker,
+                               read_checkpoint, read_docs)
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+def links(doc) -> list:
+    return [(ent.start_char, ent._.kb_qid, ent._.nerd_score, ent._.description) for ent in doc.ents]
+
+
+def run_batch_job(server_url: str, queries_path: Path, responses_path: Path) -> None:
+    # stands for a batch job run elsewhere: responses are written in any order
+    queries = list(srsly.read_jsonl(queries_path))
+    random.Random(0).shuffle(queries)
+    lines = []
+    for query in queries:
+        response = requests.post(server_url + "disambiguate", files={"query": query["query"]})
+        lines.append({"id": query["id"], "status_code": response.status_code, "response": response.json()})
+    srsly.write_jsonl(responses_path, lines)
+
+
+class TestEfBulk(unittest.TestCase):
+    def test_export_ingest_apply(self):
+        texts = make_texts(23)
+        config = {"extra_info": True}
+        with MockEntityFishingServer() as server, tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            nlp = make_nlp(api_ef_base=server.url, **config)
+            expected = [links(doc) for doc in nlp.pipe(texts)]
+            with nlp.select_pipes(disable=["entityfishing"]):
+                DocBin(docs=nlp.pipe(texts[:12])).to_disk(tmp / "a.spacy")
+                DocBin(docs=nlp.pipe(texts[12:])).to_disk(tmp / "b.spacy")
+            corpus = [tmp / "a.spacy", tmp / "b.spacy"]
+
+            _, linker = load_linker(None, "en", config)
+            store = ResponseStore(tmp / "responses.sqlite")
+            self.assertEqual(export_queries(linker, read_docs(corpus, nlp.vocab), tmp / "text.jsonl"), 23)
+            run_batch_job(server.url, tmp / "text.jsonl", tmp / "text_responses.jsonl")
+            store.ingest(tmp / "text_responses.jsonl")
+
+            export_queries(linker, read_docs(corpus, nlp.vocab), tmp / "terms.jsonl", store)
+            run_batch_job(server.url, tmp / "terms.jsonl", tmp / "terms_responses.jsonl")
+            store.ingest(tmp / "terms_responses.jsonl")
+            requests_sent = server.request_count
+
+            # an interrupted run (after two shards), then resumed
+            docs = list(read_docs(corpus, nlp.vocab))
+            self.assertEqual(apply_responses(linker, docs[:11], store, tmp / "out", shard_size=5), 11)
+            self.assertEqual(read_checkpoint(tmp / "out"), {"docs": 11, "shards": 3})
+            resumed = read_docs(corpus, nlp.vocab, start=read_checkpoint(tmp / "out")["docs"])
+            self.assertEqual(apply_responses(linker, resumed, store, tmp / "out", shard_size=5, resume=True), 12)
+            self.assertEqual(server.request_count, requests_sent)
+
+            shards = sorted((tmp / "out").glob("*.spacy"))
+            self.assertEqual(len(shards), 6)
+            linked = list(read_docs(shards, nlp.vocab))
+        self.assertEqual([doc.text for doc in linked], texts)
+        self.assertEqual([links(doc) for doc in linked], expected)
+        for doc in linked:
+            self.assertTrue(doc._.metadata["disambiguation_text_service"]["offline"])
+
+    def test_read_docs_from_start(self):
+        texts = make_texts(7)
+        nlp = make_nlp()
+        with tempfile.TemporaryDirectory() as tmp, nlp.select_pipes(disable=["entityfishing"]):
+            tmp = Path(tmp)
+            DocBin(docs=nlp.pipe(texts[:3])).to_disk(tmp / "a.spacy")
+            DocBin(docs=nlp.pipe(texts[3:])).to_disk(tmp / "b.spacy")
+            for start in range(9):
+                self.assertEqual([doc.text for doc in read_docs([tmp / "a.spacy", tmp / "b.spacy"],
+                                                                nlp.vocab, start=start)], texts[start:])
+
+    def test_missing_response(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            nlp, linker = load_linker(None, "en", {})
+            doc = nlp.make_doc(make_texts(1)[0])
+            doc.ents = [Span(doc, 2, 3, label="GPE")]
+            store = ResponseStore(Path(tmp) / "responses.sqlite")
+            apply_responses(linker, [doc], store, Path(tmp) / "out")
+            linked = list(read_docs([Path(tmp) / "out" / "00000.spacy"], nlp.vocab))[0]
+        self.assertEqual(linked._.metadata["disambiguation_text_service"]["error"], "MissingResponse")
+        self.assertEqual(json.loads(json.dumps(linked._.annotations)), {})
+
+    def test_missing_terms_response(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            nlp, linker = load_linker(None, "en", {})
+            doc = nlp.make_doc(make_texts(1)[0])
+            doc.ents = [Span(doc, 2, 3, label="GPE")]
+            # first pass without links: the entity needs a second pass, whose response is missing
+            (tmp / "responses.jsonl").write_text(json.dumps({"id": "0/0", "status_code": 200,
+                                                             "response": {"entities": []}}) + "\n")
+            store = ResponseStore(tmp / "responses.sqlite")
+            store.ingest(tmp / "responses.jsonl")
+            apply_responses(linker, [doc], store, tmp / "out")
+            linked = list(read_docs([tmp / "out" / "00000.spacy"], nlp.vocab))[0]
+        self.assertTrue(linked._.metadata["disambiguation_text_service"]["ok"])
+        terms = linked._.metadata["disambiguation_terms_service"]
+        self.assertEqual((terms["error"], terms["ok"]), ("MissingResponse", False))
+        self.assertIn("0/terms", terms["reason"])
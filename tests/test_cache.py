@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import tempfile
+import time
+import unittest
+
+from spacyfishing.cache import LRUCache, ResponseCache, SQLiteCache
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru_eviction_and_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "responses.sqlite")
+            cache = ResponseCache(maxsize=10, path=path)
+            cache.set("key", {"response": {"entities": []}, "metadata": {"status_code": 200}})
+            restarted = ResponseCache(maxsize=10, path=path)
+            self.assertEqual(restarted.get("key")["metadata"]["status_code"], 200)
+            self.assertEqual(restarted.stats["disk_hits"], 1)
+            self.assertEqual(restarted.get("key")["metadata"]["status_code"], 200)
+            self.assertEqual(restarted.stats["memory_hits"], 1)
+            self.assertEqual(len(SQLiteCache(path)), 1)
+
+    def test_component_serves_repeated_documents_from_cache(self):
+        texts = make_texts(10) * 3
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, cache={"cache_size": 100})
+            expected = [[ent._.kb_qid for ent in doc.ents] for doc in nlp.pipe(texts[:10])]
+            sent = server.request_count
+            docs = list(nlp.pipe(texts[10:], batch_size=20))
+            self.assertEqual(server.request_count, sent)
+        linker = nlp.get_pipe("entityfishing")
+        self.assertGreaterEqual(linker.stats["cache"]["hits"], 20)
+        self.assertEqual([[ent._.kb_qid for ent in doc.ents] for doc in docs], expected * 2)
+        self.assertTrue(docs[0]._.metadata["disambiguation_text_service"]["cached"])
+
+    def test_cached_responses_are_not_shared(self):
+        text = make_texts(1)[0]
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, cache={"cache_size": 100})
+            first, second = nlp.pipe([text, text])
+            self.assertIsNot(first._.annotations["disambiguation_text_service"],
+                             second._.annotations["disambiguation_text_service"])
+            first._.annotations["disambiguation_text_service"]["entities"].clear()
+            third = nlp(text)
+        self.assertTrue(third._.metadata["disambiguation_text_service"]["cached"])
+        self.assertEqual(len(third._.annotations["disambiguation_text_service"]["entities"]),
+                         len(second._.annotations["disambiguation_text_service"]["entities"]))
+        self.assertEqual("disambiguation_terms_service" in third._.metadata,
+                         "disambiguation_terms_service" in second._.metadata)
+
+    def test_identical_queries_in_a_batch_are_sent_once(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, cache={"cache_size": 100})
+            list(nlp.pipe(make_texts(1) * 8))
+            self.assertLessEqual(server.request_count, 2)
+
+    def test_responses_are_not_shared_between_services(self):
+        text = make_texts(1)[0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "responses.sqlite")
+            with MockEntityFishingServer() as first, MockEntityFishingServer() as second:
+                make_nlp(api_ef_base=first.url, cache={"cache_path": path})(text)
+                doc = make_nlp(api_ef_base=second.url, cache={"cache_path": path})(text)
+                self.assertGreater(second.request_count, 0)
+        self.assertNotIn("cached", doc._.metadata["disambiguation_text_service"])
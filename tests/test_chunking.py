@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacyfishing.chunking import split_doc
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfChunking(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.long_text = " ".join(make_texts(12, n_mentions=6))
+        cls.paragraphs_text = "\n\n".join(make_texts(12, n_mentions=6))
+
+    def links(self, docs):
+        return [[(ent.start_char, ent._.kb_qid) for ent in doc.ents] for doc in docs]
+
+    def test_split_doc_keeps_entities_and_offsets(self):
+        nlp = make_nlp()
+        nlp.add_pipe("sentencizer", first=True)
+        with nlp.select_pipes(disable=["entityfishing"]):
+            doc = nlp(self.long_text)
+        chunks = split_doc(doc, doc.ents, max_chars=300, max_entities=10, overlap=20)
+        self.assertGreater(len(chunks), 1)
+        entities = [entity for chunk in chunks for entity in chunk.entities]
+        self.assertEqual(len(entities), len(doc.ents))
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.entities), 10)
+            self.assertEqual(doc.text[chunk.offset:chunk.offset + len(chunk.text)], chunk.text)
+            for entity in chunk.entities:
+                self.assertEqual(chunk.text[entity["offsetStart"]:entity["offsetEnd"]], entity["rawName"])
+
+    def test_chunked_documents_link_like_whole_documents(self):
+        with MockEntityFishingServer() as server:
+            expected = self.links(make_nlp(api_ef_base=server.url).pipe([self.paragraphs_text, self.long_text]))
+            nlp = make_nlp(api_ef_base=server.url,
+                           queries={"chunk_size": 500, "chunk_boundary": "paragraph", "chunk_overlap": 30})
+            docs = list(nlp.pipe([self.paragraphs_text, self.long_text]))
+        self.assertEqual(self.links(docs), expected)
+        metadata = docs[0]._.metadata["disambiguation_text_service"]
+        self.assertGreater(metadata["chunks"], 1)
+        self.assertEqual(metadata["failed_chunks"], 0)
+        self.assertEqual(docs[0]._.annotations["disambiguation_text_service"]["text"], self.paragraphs_text)
+        # without sentences nor paragraphs, the long document is sent whole
+        self.assertNotIn("chunks", docs[1]._.metadata["disambiguation_text_service"])
@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+
+import asyncio
+import unittest
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+def extra_info(docs):
+    return [[(ent._.kb_qid, ent._.normal_term, ent._.description, ent._.src_description, ent._.other_ids)
+             for ent in doc.ents] for doc in docs]
+
+
+class TestEfConceptLookup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.texts = make_texts(40)
+
+    def test_concept_lookup_matches_full_responses(self):
+        with MockEntityFishingServer() as server:
+            expected = extra_info(make_nlp(api_ef_base=server.url, extra_info=True).pipe(self.texts))
+            nlp = make_nlp(api_ef_base=server.url, extra_info=True, cache={"concept_lookup": True})
+            docs = list(nlp.pipe(self.texts, batch_size=20))
+        self.assertEqual(extra_info(docs), expected)
+        self.assertTrue(any(ent._.description for doc in docs for ent in doc.ents))
+        self.assertNotIn("definitions", docs[0]._.annotations["disambiguation_text_service"]["entities"][0])
+
+    def test_each_concept_is_fetched_once(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, extra_info=True, cache={"concept_lookup": True})
+            docs = list(nlp.pipe(self.texts, batch_size=20))
+            wiki_ids = {ent._.wikipedia_page_ref for doc in docs for ent in doc.ents if ent._.wikipedia_page_ref}
+            first_count = server.request_count
+            list(nlp.pipe(self.texts, batch_size=20))
+            second_count = server.request_count - first_count
+        linker = nlp.get_pipe("entityfishing")
+        self.assertEqual(len(linker.api.concept_cache), len(wiki_ids))
+        # the second run only sends disambiguation queries (concepts are served by the cache)
+        self.assertEqual(second_count, first_count - len(wiki_ids))
+
+    def test_concept_lookup_with_apipe(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, extra_info=True, cache={"concept_lookup": True})
+            expected = extra_info(nlp.pipe(self.texts[:10]))
+            linker = nlp.get_pipe("entityfishing")
+            linker.api.concept_cache.clear()
+
+            async def collect():
+                with nlp.select_pipes(disable=["entityfishing"]):
+                    docs = [doc async for doc in linker.apipe(nlp.pipe(self.texts[:10]))]
+                await linker.aclose()
+                return docs
+
+            docs = asyncio.run(collect())
+        self.assertEqual(extra_info(docs), expected)
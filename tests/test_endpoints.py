@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+import requests
+
+from spacyfishing.client import EntityFishingClient
+from spacyfishing.endpoints import OPEN, EndpointPool
+from spacyfishing.scheduler import RequestScheduler
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+UNREACHABLE_URL = "http://127.0.0.1:9/service/"
+
+
+class TestEfEndpoints(unittest.TestCase):
+    def test_weighted_round_robin(self):
+        pool = EndpointPool(["http://a/", "http://b/"], weights=[3, 1], strategy="round_robin")
+        selected = []
+        for _ in range(8):
+            endpoint = pool.acquire()
+            selected.append(endpoint.url)
+            pool.release(endpoint, True, 0.01)
+        self.assertEqual(selected.count("http://a/"), 6)
+        self.assertEqual(selected.count("http://b/"), 2)
+
+    def test_circuit_breaker(self):
+        pool = EndpointPool(["http://a/", "http://b/"], failure_threshold=2, recovery_timeout=60)
+        a = pool.endpoints[0]
+        for _ in range(2):
+            pool.acquire()
+            pool.release(a, False, 0.01)
+        self.assertEqual(a.state, OPEN)
+        self.assertEqual({pool.acquire().url for _ in range(4)}, {"http://b/"})
+
+    def test_requests_are_balanced(self):
+        with MockEntityFishingServer() as first, MockEntityFishingServer() as second:
+            nlp = make_nlp(api_ef_base=[first.url, second.url])
+            docs = list(nlp.pipe(make_texts(40)))
+            counts = first.request_count, second.request_count
+        self.assertGreater(min(counts), 0)
+        for doc in docs:
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+        stats = nlp.get_pipe("entityfishing").stats["endpoints"]
+        self.assertEqual(sum(endpoint["requests"] for endpoint in stats.values()), sum(counts))
+
+    def test_failover_ejects_unreachable_endpoint(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=[UNREACHABLE_URL, server.url],
+                           endpoints={"failure_threshold": 2, "recovery_timeout": 60},
+                           client={"backoff_factor": 0.001})
+            docs = list(nlp.pipe(make_texts(20)))
+        for doc in docs:
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+        stats = nlp.get_pipe("entityfishing").stats["endpoints"]
+        self.assertEqual(stats[UNREACHABLE_URL]["state"], OPEN)
+        self.assertLessEqual(stats[UNREACHABLE_URL]["requests"], 20)
+
+    def test_outstanding_released_on_undecodable_body(self):
+        with MockEntityFishingServer(corrupt_encoding=True) as first, \
+                MockEntityFishingServer(corrupt_encoding=True) as second:
+            pool = EndpointPool([first.url, second.url])
+            client = EntityFishingClient(max_retries=0, endpoints=pool,
+                                         scheduler=RequestScheduler(adaptive_concurrency=True))
+            for _ in range(4):
+                with self.assertRaises(requests.exceptions.ContentDecodingError):
+                    client.request("GET", "kb/concept/123")
+            client.close()
+        self.assertEqual([endpoint["outstanding"] for endpoint in pool.stats.values()], [0, 0])
+        self.assertEqual(sum(endpoint["requests"] for endpoint in pool.stats.values()), 4)
+
+    def test_check_endpoints(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=[UNREACHABLE_URL, server.url])
+            health = nlp.get_pipe("entityfishing").check_endpoints()
+        self.assertEqual(health, {UNREACHABLE_URL: False, server.url: True})
+        self.assertEqual(nlp.get_pipe("entityfishing").stats["endpoints"][UNREACHABLE_URL]["state"], OPEN)
@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacy.tokens import Doc
+
+from spacyfishing.chunking import Chunk
+from spacyfishing.grouping import group_chunks, split_group_results
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer, disambiguate
+
+
+def links(doc) -> list:
+    return [(ent.start_char, ent.end_char, ent._.kb_qid) for ent in doc.ents]
+
+
+class TestEfGrouping(unittest.TestCase):
+    def test_split_offsets(self):
+        chunks = [Chunk(0, "Reports from Austria", [{"rawName": "Austria", "offsetStart": 13, "offsetEnd": 20}]),
+                  Chunk(0, "x" * 50, []),
+                  Chunk(0, "France", [{"rawName": "France", "offsetStart": 0, "offsetEnd": 6}])]
+        groups = group_chunks(chunks, [None, None, None], max_text_chars=30, max_chars=100)
+        self.assertEqual([group.members for group in groups], [[0, 2], [1]])
+        self.assertEqual(groups[0].text[groups[0].entities[1]["offsetStart"]:groups[0].entities[1]["offsetEnd"]],
+                         "France")
+        response = disambiguate({"shortText": groups[0].text, "entities": groups[0].entities})
+        results = [(response, {"ok": True}, response["entities"]), ({}, {"ok": True}, [])]
+        chunk_results = split_group_results(groups, chunks, results)
+        self.assertEqual([(entity["offsetStart"], entity["offsetEnd"]) for entity in chunk_results[0][2]], [(13, 20)])
+        self.assertEqual([(entity["offsetStart"], entity["offsetEnd"]) for entity in chunk_results[2][2]], [(0, 6)])
+        self.assertEqual(chunk_results[2][0]["shortText"], "France")
+        self.assertEqual(chunk_results[0][1]["grouped"], 2)
+
+    def test_fewer_requests_same_links(self):
+        texts = make_texts(40, n_mentions=1)
+        with MockEntityFishingServer() as server:
+            expected = [links(doc) for doc in make_nlp(api_ef_base=server.url).pipe(texts)]
+            count = server.request_count
+            docs = list(make_nlp(api_ef_base=server.url,
+                                 queries={"group_short_texts": 200, "group_max_chars": 2000}).pipe(texts))
+            grouped_count = server.request_count - count
+        self.assertEqual([links(doc) for doc in docs], expected)
+        self.assertLessEqual(grouped_count * 10, count)
+        self.assertTrue(all(doc._.metadata["disambiguation_text_service"]["grouped"] > 1 for doc in docs))
+
+    def test_group_by(self):
+        if not Doc.has_extension("source"):
+            Doc.set_extension("source", default=None)
+        texts = make_texts(10, n_mentions=1)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, queries={"group_short_texts": 200, "group_by": "source"})
+            docs = []
+            for idx, doc in enumerate(nlp.make_doc(text) for text in texts):
+                doc._.source = idx % 2
+                docs.append(doc)
+            with nlp.select_pipes(disable=["entityfishing"]):
+                docs = [nlp(doc) for doc in docs]
+            docs = list(nlp.get_pipe("entityfishing").pipe(docs))
+        self.assertTrue(all(doc._.metadata["disambiguation_text_service"]["grouped"] == 5 for doc in docs))
+        self.assertTrue(all(ent._.kb_qid is not None for doc in docs for ent in doc.ents))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacy.tokens import DocBin, Span
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+def links(doc) -> list:
+    return [(ent.start_char, ent.end_char, ent._.kb_qid, ent._.nerd_score) for ent in doc.ents]
+
+
+class TestEfIncremental(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.texts = make_texts(10) + ["Reports from Vienna and Austria ."]
+        cls.server = MockEntityFishingServer().start()
+        cls.nlp = make_nlp(api_ef_base=cls.server.url, queries={"incremental": True})
+        cls.linker = cls.nlp.get_pipe("entityfishing")
+        doc_bin = DocBin(store_user_data=True, docs=cls.nlp.pipe(cls.texts))
+        cls.data = doc_bin.to_bytes()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def recognised(self, text: str):
+        with self.nlp.select_pipes(disable=["entityfishing"]):
+            return self.nlp(text)
+
+    def stored_docs(self) -> list:
+        return list(DocBin().from_bytes(self.data).get_docs(self.nlp.vocab))
+
+    def test_failed_runs_are_not_reused(self):
+        texts = make_texts(3)
+        with MockEntityFishingServer(error_rate=1.0) as failing:
+            nlp = make_nlp(api_ef_base=failing.url, queries={"incremental": True}, client={"max_retries": 0})
+            docs = list(nlp.pipe(texts))
+        for doc in docs:
+            self.assertFalse(doc._.metadata["disambiguation_text_service"]["ok"])
+            self.assertNotIn("fingerprint", doc._.metadata)
+
+        nlp = make_nlp(api_ef_base=self.server.url, queries={"incremental": True})
+        linker = nlp.get_pipe("entityfishing")
+        docs = list(linker.pipe(docs))
+        self.assertEqual(linker.stats["incremental"]["reused"], 0)
+        for doc in docs:
+            self.assertIn("fingerprint", doc._.metadata)
+            self.assertTrue(all(ent._.kb_qid is not None for ent in doc.ents))
+
+        # a fingerprint stored with a failed pass (eg. by a previous version) is not trusted
+        docs[0]._.metadata["disambiguation_terms_service"] = {"ok": False, "status_code": 500}
+        list(linker.pipe(docs[:1]))
+        self.assertEqual(linker.stats["incremental"]["reused"], 0)
+
+    def with_new_entity(self, doc):
+        # "Vienna" is not recognised by the entity ruler
+        doc.ents = list(doc.ents) + [Span(doc, 2, 3, label="GPE")]
+        return doc
+
+    def test_unchanged_docs_reused(self):
+        docs = self.stored_docs()
+        expected = [links(doc) for doc in docs]
+        count = self.server.request_count
+        docs = list(self.linker.pipe(docs))
+        self.assertEqual(self.server.request_count, count)
+        self.assertEqual([links(doc) for doc in docs], expected)
+        self.assertTrue(all(doc._.metadata["incremental"] == "reused" for doc in docs))
+
+    def test_new_entity_only(self):
+        doc = self.with_new_entity(self.stored_docs()[-1])
+        count = self.server.request_count
+        doc = self.linker(doc)
+        self.assertEqual(self.server.request_count, count + 1)
+        self.assertEqual(doc._.metadata["incremental"], "partial")
+        self.assertEqual(doc._.metadata["disambiguation_text_service"]["reused_entities"], 1)
+
+        full = self.linker(self.with_new_entity(self.recognised(self.texts[-1])))
+        self.assertEqual(full._.metadata["incremental"], "full")
+        self.assertEqual(links(doc), links(full))
+        self.assertIsNotNone(doc.ents[0]._.kb_qid)
+
+    def test_changed_text_relinked(self):
+        doc = self.recognised(self.texts[0] + " Reports from France .")
+        doc.user_data.update(self.stored_docs()[0].user_data)
+        self.linker(doc)
+        self.assertEqual(doc._.metadata["incremental"], "full")
+        self.assertTrue(all(ent._.kb_qid is not None for ent in doc.ents))
+
+
+if __name__ == "__main__":
+    unittest.main()
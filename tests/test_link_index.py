@@ -0,0 +1,159 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import pickle
+import tempfile
+import unittest
+
+from unittest import mock
+
+from spacy.tokens import Span
+
+from spacyfishing.link_index import LinkIndex, LinkIndexBuilder
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfLinkIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "links.npy")
+        self.texts = make_texts(20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_link_locally(self):
+        with MockEntityFishingServer() as server:
+            reference = list(make_nlp(api_ef_base=server.url).pipe(self.texts))
+            LinkIndexBuilder("en").add_docs(reference).save(self.path)
+
+            server.request_count = 0
+            nlp = make_nlp(api_ef_base=server.url,
+                           queries={"link_index_path": self.path, "link_index_threshold": 0.0,
+                                    "link_index_min_count": 1})
+            docs = list(nlp.pipe(self.texts))
+            self.assertEqual(server.request_count, 0)
+        linker = nlp.get_pipe("entityfishing")
+        self.assertEqual(linker.stats["preflight"]["linked_locally"], len(docs))
+        self.assertEqual(linker.stats["link_index"]["sent"], 0)
+        for doc, expected in zip(docs, reference):
+            self.assertEqual([(ent._.kb_qid, ent._.wikipedia_page_ref) for ent in doc.ents],
+                             [(ent._.kb_qid, ent._.wikipedia_page_ref) for ent in expected.ents])
+
+    def test_link_locally_without_preflight(self):
+        with MockEntityFishingServer() as server:
+            reference = list(make_nlp(api_ef_base=server.url).pipe(self.texts))
+            LinkIndexBuilder("en").add_docs(reference).save(self.path)
+
+            server.request_count = 0
+            nlp = make_nlp(api_ef_base=server.url,
+                           queries={"link_index_path": self.path, "link_index_threshold": 0.0,
+                                    "link_index_min_count": 1})
+            index = nlp.get_pipe("entityfishing").passes.link_index
+            with mock.patch.object(index, "lookup", wraps=index.lookup) as lookup:
+                docs = list(nlp.pipe(self.texts))
+            self.assertEqual(server.request_count, 0)
+        # looked up once per document
+        self.assertEqual(lookup.call_count, len(docs))
+        for doc, expected in zip(docs, reference):
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["skipped"], "linked_locally")
+            self.assertEqual([ent._.kb_qid for ent in doc.ents], [ent._.kb_qid for ent in expected.ents])
+
+    def test_threshold(self):
+        with MockEntityFishingServer() as server:
+            reference = list(make_nlp(api_ef_base=server.url).pipe(self.texts))
+            LinkIndexBuilder("en").add_docs(reference).save(self.path)
+            nlp = make_nlp(api_ef_base=server.url,
+                           queries={"link_index_path": self.path, "link_index_threshold": 0.5})
+            docs = list(nlp.pipe(self.texts))
+        stats = nlp.get_pipe("entityfishing").stats["link_index"]
+        self.assertGreater(stats["local"], 0)
+        self.assertGreater(stats["sent"], 0)
+        for doc in docs:
+            local = [entity for entity in doc._.annotations["disambiguation_text_service"]["entities"]
+                     if entity.get("local")]
+            self.assertTrue(all(entity["confidence_score"] >= 0.5 for entity in local))
+            self.assertTrue(all(ent._.kb_qid is not None for ent in doc.ents))
+
+    def test_ambiguous_mentions(self):
+        builder = LinkIndexBuilder("en")
+        builder.add("Paris", "GPE", "Q90", "22989", 0.95)
+        builder.add("Paris", "PERSON", "Q167646", "23456", 0.95)
+        builder.add("Paris", "PERSON", "Q1", None, 0.95)
+        builder.save(self.path)
+        nlp = make_nlp(api_ef_base="http://localhost:1/")
+        doc = nlp.make_doc("Paris and Paris.")
+        doc.set_ents([doc.char_span(0, 5, label="GPE"), doc.char_span(10, 15, label="PERSON")])
+
+        # seen once: not linked by default
+        self.assertEqual(LinkIndex(self.path, "en", threshold=0.9).lookup(list(doc.ents)), [None, None])
+        index = LinkIndex(self.path, "en", threshold=0.9, min_count=1)
+        self.assertEqual(len(index), 2)
+        gpe, person = index.lookup(list(doc.ents))
+        self.assertEqual((gpe["wikidataId"], gpe["wikipediaExternalRef"]), ("Q90", 22989))
+        self.assertIsNone(person)
+        # pickled with its path only (mapped again)
+        self.assertEqual(pickle.loads(pickle.dumps(index)).lookup(list(doc.ents))[0], gpe)
+        self.assertEqual(LinkIndex(self.path, "fr", min_count=1).lookup(list(doc.ents)), [None, None])
+
+    def test_failed_first_pass_is_untouched(self):
+        with MockEntityFishingServer() as server:
+            reference = make_nlp(api_ef_base=server.url)(self.texts[0])
+        ent = reference.ents[0]
+        builder = LinkIndexBuilder("en")
+        for _ in range(2):
+            builder.add(ent.text, ent.label_, ent._.kb_qid, ent._.wikipedia_page_ref, ent._.nerd_score)
+        builder.save(self.path)
+        with MockEntityFishingServer(error_rate=1.0) as server:
+            nlp = make_nlp(api_ef_base=server.url, queries={"link_index_path": self.path},
+                           client={"max_retries": 0})
+            doc = nlp(self.texts[0])
+        metadata = doc._.metadata["disambiguation_text_service"]
+        self.assertEqual((metadata["status_code"], metadata["ok"]), (500, False))
+        self.assertNotIn("local_links", metadata)
+        self.assertNotIn("entities", doc._.annotations.get("disambiguation_text_service", {}))
+        # the entities of the index are linked all the same
+        self.assertEqual(doc.ents[0]._.kb_qid, ent._.kb_qid)
+
+    def test_extra_information_of_local_links(self):
+        with MockEntityFishingServer() as server:
+            reference = list(make_nlp(api_ef_base=server.url, extra_info=True).pipe(self.texts))
+            LinkIndexBuilder("en").add_docs(reference).save(self.path)
+            server.request_count = 0
+            nlp = make_nlp(api_ef_base=server.url, extra_info=True,
+                           queries={"link_index_path": self.path, "link_index_threshold": 0.0,
+                                    "link_index_min_count": 1})
+            docs = list(nlp.pipe(self.texts))
+            # only the concepts of the local links are fetched (once each)
+            self.assertEqual(server.request_count, len({ent._.wikipedia_page_ref for doc in docs for ent in doc.ents}))
+        for doc, expected in zip(docs, reference):
+            self.assertEqual([ent._.description for ent in doc.ents], [ent._.description for ent in expected.ents])
+            self.assertTrue(all(ent._.description is not None for ent in doc.ents))
+
+    def test_incremental_new_entities_linked_locally(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, queries={"incremental": True})
+            docs = list(nlp.pipe(self.texts[:2]))
+            # a new mention ("Report"), known by the index
+            doc = docs[0]
+            span = Span(doc, 0, 1, label="GPE")
+            doc.ents = [span] + list(doc.ents)
+            known = LinkIndexBuilder("en")
+            for _ in range(2):
+                known.add(span.text, "GPE", "Q40", "26964", 0.9)
+            known.save(self.path)
+
+            server.request_count = 0
+            nlp = make_nlp(api_ef_base=server.url,
+                           queries={"incremental": True, "link_index_path": self.path})
+            linked = list(nlp.pipe(docs))
+            self.assertEqual(server.request_count, 0)
+        self.assertEqual(linked[0].ents[0]._.kb_qid, "Q40")
+        self.assertTrue(all(ent._.kb_qid is not None for ent in linked[0].ents))
+        self.assertEqual(linked[0]._.metadata["incremental"], "partial")
+
+
+if __name__ == "__main__":
+    unittest.main()
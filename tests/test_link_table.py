@@ -0,0 +1,49 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacy.tokens import DocBin
+
+from spacyfishing.links import LINKS_KEY
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+EXTENSIONS = ("kb_qid", "wikipedia_page_ref", "url_wikidata", "nerd_score",
+              "normal_term", "description", "src_description", "other_ids")
+
+
+def links(doc) -> list:
+    return [tuple(ent._.get(name) for name in EXTENSIONS) for ent in doc.ents]
+
+
+class TestEfLinkTable(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        texts = make_texts(20)
+        with MockEntityFishingServer() as server:
+            cls.docs = list(make_nlp(api_ef_base=server.url, extra_info=True).pipe(texts))
+            nlp = make_nlp(api_ef_base=server.url, extra_info=True, output={"link_table": True})
+            cls.vocab = nlp.vocab
+            cls.docs_table = list(nlp.pipe(texts))
+
+    def test_same_links(self):
+        for doc, doc_table in zip(self.docs, self.docs_table):
+            self.assertIn(LINKS_KEY, doc_table.user_data)
+            self.assertEqual(links(doc_table), links(doc))
+            self.assertTrue(all(ent._.url_wikidata.endswith(ent._.kb_qid) for ent in doc_table.ents))
+
+    def test_smaller_doc_bin(self):
+        doc_bin = DocBin(store_user_data=True, docs=self.docs)
+        doc_bin_table = DocBin(store_user_data=True, docs=self.docs_table)
+        data_table = doc_bin_table.to_bytes()
+        self.assertLess(len(data_table), len(doc_bin.to_bytes()))
+
+        docs = list(DocBin().from_bytes(data_table).get_docs(self.vocab))
+        self.assertEqual([links(doc) for doc in docs], [links(doc) for doc in self.docs])
+
+    def test_set_value_overrides_table(self):
+        ent = self.docs_table[0].copy().ents[0]
+        ent._.kb_qid = "Q90"
+        self.assertEqual(ent._.kb_qid, "Q90")
+        self.assertEqual(ent._.url_wikidata, "https://www.wikidata.org/wiki/Q90")
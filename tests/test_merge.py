@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacyfishing.links import merge_entities, nil_clustering
+
+from benchmarks.bench_merge import make_doc
+from tests.corpus import make_nlp
+
+
+class TestEfMerge(unittest.TestCase):
+    def test_nil_clustering(self):
+        doc, response, entities_from_terms = make_doc(make_nlp(), 50)
+        not_linked = nil_clustering(doc, response["entities"])
+        self.assertEqual([(ent.start_char, ent.end_char) for ent in not_linked],
+                         [(entity["offsetStart"], entity["offsetEnd"]) for entity in entities_from_terms])
+
+    def test_first_pass_wins(self):
+        text_entity = {"rawName": "Paris", "offsetStart": 0, "offsetEnd": 5, "wikidataId": "Q90"}
+        conflict = dict(text_entity, wikidataId="Q167646")
+        other = {"rawName": "France", "offsetStart": 10, "offsetEnd": 16, "wikidataId": "Q142"}
+        merged = merge_entities([text_entity], [conflict, other, dict(other, wikidataId="Q1")])
+        self.assertEqual(merged, [text_entity, other])
+
+    def test_links_are_attached(self):
+        nlp = make_nlp()
+        linker = nlp.get_pipe("entityfishing")
+        doc, response, entities_from_terms = make_doc(nlp, 20)
+        metadata = {"status_code": 200, "ok": True}
+        linker.passes.attach_text_result(doc, (response, metadata, response["entities"]))
+        entities = linker.passes.attach_terms_result(doc, response["entities"],
+                                                     ({}, metadata, entities_from_terms))
+        linker.updated_entities(doc, entities)
+        self.assertTrue(all(ent._.kb_qid is not None for ent in doc.ents))
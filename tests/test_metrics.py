@@ -0,0 +1,71 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacyfishing.client import EntityFishingClient
+from spacyfishing.metrics import Histogram, Metrics
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfMetrics(unittest.TestCase):
+    def test_histogram_quantiles(self):
+        histogram = Histogram(buckets=(0.1, 0.2, 0.5, 1.0))
+        for value in [0.05] * 50 + [0.15] * 49 + [0.8]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertLessEqual(histogram.quantile(0.5), 0.1)
+        self.assertTrue(0.1 < histogram.quantile(0.9) <= 0.2)
+        self.assertTrue(0.5 < histogram.quantile(1.0) <= 1.0)
+
+    def test_requests_by_stage(self):
+        events = []
+        texts = make_texts(20)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, extra_info=True,
+                           cache={"cache_size": 100, "concept_lookup": True})
+            linker = nlp.get_pipe("entityfishing")
+            linker.metrics.add_hook(lambda event, data: events.append((event, data)))
+            docs = list(nlp.pipe(texts, batch_size=10))
+            list(nlp.pipe(texts[:5]))
+            request_count = server.request_count
+        stats = linker.stats["metrics"]
+        self.assertEqual(sum(stats["requests"].values()), request_count)
+        self.assertEqual(stats["requests"]["text"], 20)
+        self.assertGreater(stats["requests"]["terms"], 0)
+        self.assertGreater(stats["requests"]["concepts"], 0)
+        self.assertGreater(stats["bytes_sent"]["text"], sum(len(text) for text in texts))
+        self.assertGreater(stats["bytes_received"]["text"], 0)
+        self.assertEqual(stats["cache_hits"]["text"], 5)
+        self.assertEqual(stats["request_latency"]["text"]["count"], 20)
+        self.assertIsNotNone(stats["queue_wait"]["terms"]["p99"])
+        self.assertEqual(stats["docs"]["total"], 25)
+        self.assertGreater(stats["entities_per_second"], 0)
+        self.assertEqual(sum(1 for event, _ in events if event == "request"), request_count)
+        self.assertEqual([data["docs"] for event, data in events if event == "batch"], [10, 10, 5])
+
+        timings = docs[0]._.metadata["timings"]
+        self.assertEqual(timings["batch_size"], 10)
+        self.assertLessEqual(timings["text"] + timings["terms"] + timings["concepts"], timings["total"])
+
+    def test_retries(self):
+        with MockEntityFishingServer(error_rate=0.3, seed=1) as server:
+            nlp = make_nlp(api_ef_base=server.url, client={"max_retries": 5, "backoff_factor": 0.0})
+            list(nlp.pipe(make_texts(20)))
+        stats = nlp.get_pipe("entityfishing").stats["metrics"]
+        self.assertGreater(sum(stats["retries"].values()), 0)
+        self.assertEqual(sum(stats["retries"].values()) + sum(stats["requests"].values()), server.request_count)
+
+    def test_failed_request_is_observed(self):
+        metrics = Metrics()
+        client = EntityFishingClient(metrics=metrics)
+        # not a connection error: raised at once, without retries
+        with self.assertRaises(Exception):
+            client.request("GET", "unknown://localhost/service")
+        self.assertEqual(metrics.stats["requests"], {"other": 1})
+        self.assertEqual(metrics.stats["errors"], {"other": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+
+import pickle
+import tempfile
+import unittest
+
+import spacy
+
+from spacy.tokens import Doc
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+def qids(doc: Doc) -> list:
+    return [(ent.start_char, ent._.kb_qid) for ent in doc.ents]
+
+
+class TestEfMultiprocess(unittest.TestCase):
+    def test_component_is_picklable(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, cache={"cache_size": 10},
+                           scheduler={"rate_limit": 100, "adaptive_concurrency": True})
+            component = nlp.get_pipe("entityfishing")
+            text = make_texts(1)[0]
+            expected = qids(nlp(text))
+            clone = pickle.loads(pickle.dumps(component))
+            doc = clone(nlp.get_pipe("entity_ruler")(nlp.make_doc(text)))
+            self.assertEqual(qids(doc), expected)
+            self.assertEqual(clone.stats["cache"]["memory_size"], 1)
+
+    def test_pipe_n_process(self):
+        texts = make_texts(40)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url)
+            # the clients of the parent process are created before the fork
+            expected = [qids(doc) for doc in nlp.pipe(texts)]
+            docs = list(nlp.pipe(texts, n_process=2, batch_size=8))
+        self.assertEqual([doc.text for doc in docs], texts)
+        self.assertEqual([qids(doc) for doc in docs], expected)
+        for doc in docs:
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+
+    def test_extensions_are_registered_once(self):
+        make_nlp()
+        extension = Doc.get_extension("metadata")
+        make_nlp()
+        self.assertIs(Doc.get_extension("metadata"), extension)
+
+    def test_caches_are_serialized(self):
+        texts = make_texts(5)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, cache={"cache_size": 100})
+            list(nlp.pipe(texts))
+            requests_sent = server.request_count
+
+            with tempfile.TemporaryDirectory() as path:
+                nlp.to_disk(path)
+                loaded = spacy.load(path)
+            list(loaded.pipe(texts))
+            self.assertEqual(server.request_count, requests_sent)
+
+            other = make_nlp(api_ef_base=server.url, cache={"cache_size": 100})
+            other.get_pipe("entityfishing").from_bytes(nlp.get_pipe("entityfishing").to_bytes())
+            list(other.pipe(texts))
+            self.assertEqual(server.request_count, requests_sent)
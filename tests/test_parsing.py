@@ -0,0 +1,55 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import unittest
+
+from spacyfishing.parsing import ENTITY_FIELDS, compact_response, dumps, loads
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer, concept
+
+
+def links(doc) -> list:
+    return [(ent._.kb_qid, ent._.nerd_score, ent._.description, ent._.other_ids) for ent in doc.ents]
+
+
+class TestEfParsing(unittest.TestCase):
+    def test_loads(self):
+        self.assertEqual(loads('{"entities": [{"rawName": "Été"}]}'.encode("utf-8")),
+                         {"entities": [{"rawName": "Été"}]})
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            loads(b"<html>")
+
+    def test_dumps(self):
+        value = {"entities": [{"rawName": "Été", "offsetStart": 0}]}
+        self.assertIsInstance(dumps(value), str)
+        self.assertEqual(loads(dumps(value)), value)
+
+    def test_compact_response(self):
+        entity = dict({"rawName": "Paris", "offsetStart": 0, "offsetEnd": 5, "domains": ["Geography"]}, **concept(90))
+        res = {"software": "entity-fishing", "text": "Paris ...", "global_categories": [{}], "entities": [entity]}
+        compact = compact_response(res)
+        self.assertEqual(set(compact), {"software", "entities"})
+        self.assertTrue(set(compact["entities"][0]).issubset(ENTITY_FIELDS))
+        extra = compact_response(res, extra=True)["entities"][0]
+        self.assertEqual(extra["statements"], [{"propertyName": "VIAF ID", "propertyId": "P214", "value": "90"}])
+        self.assertEqual(len(extra["definitions"]), 1)
+
+    def test_annotations_modes(self):
+        texts = make_texts(10)
+        with MockEntityFishingServer() as server:
+            full = list(make_nlp(api_ef_base=server.url, extra_info=True).pipe(texts))
+            compact = list(make_nlp(api_ef_base=server.url, extra_info=True,
+                                    output={"annotations": "compact"}).pipe(texts))
+            none = list(make_nlp(api_ef_base=server.url, extra_info=True,
+                                 output={"annotations": "none"}).pipe(texts))
+        for doc_full, doc_compact, doc_none in zip(full, compact, none):
+            self.assertEqual(links(doc_compact), links(doc_full))
+            self.assertEqual(links(doc_none), links(doc_full))
+            self.assertNotIn("text", doc_compact._.annotations["disambiguation_text_service"])
+            self.assertEqual(doc_none._.annotations, {})
+            self.assertTrue(doc_none._.metadata["disambiguation_text_service"]["ok"])
+
+    def test_unknown_annotations_mode(self):
+        with self.assertRaises(ValueError):
+            make_nlp(output={"annotations": "raw"})
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+
+import asyncio
+import gzip
+import json
+import unittest
+
+from spacyfishing.payload import encode_body
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfPayload(unittest.TestCase):
+    def setUp(self):
+        self.texts = make_texts(20)
+
+    def link(self, server, **config):
+        nlp = make_nlp(api_ef_base=server.url, extra_info=True, **config)
+        docs = list(nlp.pipe(self.texts))
+        return docs, nlp.get_pipe("entityfishing").stats["metrics"]
+
+    def test_encode_body(self):
+        files = {"query": json.dumps({"text": "Paris é"}, ensure_ascii=False)}
+        self.assertEqual(encode_body(files), (None, {}))
+        body, headers = encode_body(files, "json", "gzip")
+        self.assertEqual(headers, {"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        self.assertEqual(json.loads(gzip.decompress(body)), {"text": "Paris é"})
+        body, headers = encode_body(files, "multipart", "deflate")
+        self.assertEqual(headers["Content-Encoding"], "deflate")
+        self.assertTrue(headers["Content-Type"].startswith("multipart/form-data"))
+        self.assertEqual(encode_body(None, "json", "gzip"), (None, {}))
+
+    def test_same_links_in_every_mode(self):
+        with MockEntityFishingServer(payload_padding=200) as server:
+            reference, plain = self.link(server)
+            for request_format in ("multipart", "json"):
+                for compression in ("gzip", "deflate"):
+                    docs, _ = self.link(server,
+                                        client={"request_format": request_format,
+                                                "request_compression": compression})
+                    for doc, expected in zip(docs, reference):
+                        self.assertTrue(doc._.metadata["disambiguation_text_service"]["ok"])
+                        self.assertEqual([(ent._.kb_qid, ent._.description) for ent in doc.ents],
+                                         [(ent._.kb_qid, ent._.description) for ent in expected.ents])
+            _, compressed = self.link(server,
+                                      client={"request_format": "json", "request_compression": "gzip"})
+        self.assertLess(compressed["bytes_sent"]["text"], plain["bytes_sent"]["text"])
+
+    def test_bytes_on_the_wire(self):
+        with MockEntityFishingServer(payload_padding=500, compress_responses=True) as server:
+            _, stats = self.link(server, client={"request_format": "json"})
+            sent = server.bytes_received
+        self.assertEqual(sum(stats["bytes_sent"].values()), sent)
+        self.assertLess(stats["bytes_received"]["text"] * 2, stats["bytes_decoded"]["text"])
+
+    def test_async_client(self):
+        async def link(nlp):
+            return [doc async for doc in nlp.get_pipe("entityfishing").apipe(nlp.pipe(self.texts))]
+
+        with MockEntityFishingServer(compress_responses=True) as server:
+            nlp = make_nlp(api_ef_base=server.url,
+                           client={"request_format": "json", "request_compression": "gzip"})
+            with nlp.select_pipes(disable=["entityfishing"]):
+                docs = asyncio.run(link(nlp))
+        self.assertTrue(all(ent._.kb_qid is not None for doc in docs for ent in doc.ents))
+        stats = nlp.get_pipe("entityfishing").stats["metrics"]
+        self.assertLess(stats["bytes_received"]["text"], stats["bytes_decoded"]["text"])
+
+    def test_unknown_options(self):
+        with self.assertRaises(ValueError):
+            make_nlp(client={"request_format": "xml"})
+        with self.assertRaises(ValueError):
+            make_nlp(client={"request_compression": "br"})
+        with self.assertRaises(ValueError):
+            make_nlp(client={"request_fromat": "json"})
+
+
+if __name__ == "__main__":
+    unittest.main()
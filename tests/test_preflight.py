@@ -0,0 +1,55 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfPreflight(unittest.TestCase):
+    def test_skip_short_and_entity_free_docs(self):
+        # 5 characters: still rejected by the API
+        texts = ["de", "Paris", "Nothing to link here."] + make_texts(3)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, queries={"preflight": True})
+            docs = list(nlp.pipe(texts))
+            self.assertEqual(server.request_count, 3 + sum(1 for doc in docs if "disambiguation_terms_service"
+                                                             in doc._.metadata))
+        no_entities = docs[2]._.metadata
+        for too_short in (docs[0]._.metadata, docs[1]._.metadata):
+            self.assertEqual(too_short["disambiguation_text_service"]["status_code"], 400)
+            self.assertEqual(too_short["disambiguation_text_service"]["skipped"], "text_too_short")
+            self.assertFalse(too_short["disambiguation_text_service"]["ok"])
+        self.assertEqual(no_entities["disambiguation_text_service"]["skipped"], "no_entities")
+        self.assertTrue(no_entities["disambiguation_text_service"]["ok"])
+        self.assertEqual(docs[2]._.annotations, {})
+        self.assertEqual(nlp.get_pipe("entityfishing").stats["preflight"], {"text_too_short": 2, "no_entities": 1,
+                                                                             "linked_locally": 0})
+        self.assertTrue(all(ent._.kb_qid is not None for doc in docs[3:] for ent in doc.ents))
+
+    def test_preflight_is_opt_in(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url)
+            doc = nlp("Nothing to link here.")
+            self.assertEqual(server.request_count, 1)
+        self.assertNotIn("skipped", doc._.metadata["disambiguation_text_service"])
+        self.assertEqual(nlp.get_pipe("entityfishing").stats["preflight"], {})
+
+    def test_exclude_labels(self):
+        texts = ["Reports from the Serbian and German troops."] + make_texts(3)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, queries={"preflight": True, "exclude_labels": ["NORP"]})
+            docs = list(nlp.pipe(texts))
+        self.assertEqual(docs[0]._.metadata["disambiguation_text_service"]["skipped"], "no_entities")
+        for doc in docs:
+            for ent in doc.ents:
+                if ent.label_ == "NORP":
+                    self.assertIsNone(ent._.kb_qid)
+                    self.assertNotIn(ent.text, doc._.annotations.get("disambiguation_terms_service", {})
+                                     .get("shortText", ""))
+                else:
+                    self.assertIsNotNone(ent._.kb_qid)
+
+
+if __name__ == "__main__":
+    unittest.main()
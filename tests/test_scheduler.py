@@ -0,0 +1,112 @@
+# -*- coding: UTF-8 -*-
+
+import asyncio
+import time
+import unittest
+
+import requests
+
+from spacyfishing.client import AsyncEntityFishingClient, EntityFishingClient
+from spacyfishing.scheduler import AdaptiveConcurrencyLimiter, RequestScheduler, TokenBucket
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+class TestEfScheduler(unittest.TestCase):
+    def test_token_bucket_delays(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        delays = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(delays[:2], [0.0, 0.0])
+        self.assertAlmostEqual(delays[2], 0.1, delta=0.02)
+        self.assertAlmostEqual(delays[3], 0.2, delta=0.02)
+
+    def test_aimd_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=10, latency_factor=0)
+        for _ in range(6):
+            limiter.acquire()
+            limiter.release(200, 0.01)
+        # slow start: +1 per success
+        self.assertEqual(int(limiter.limit), 7)
+        limiter.acquire()
+        limiter.release(503, 0.01)
+        self.assertEqual(int(limiter.limit), 3)
+        self.assertEqual(limiter.congestion_events, 1)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(200, 0.01)
+        # congestion avoidance: about +1 per round of `limit` successes
+        self.assertEqual(int(limiter.limit), 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_latency_relative_to_payload_size(self):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=4, max_limit=4)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(200, 0.01, 512)
+        # a long document is slower, not a congestion signal
+        limiter.acquire()
+        limiter.release(200, 0.2, 40 * 1024)
+        self.assertEqual(limiter.congestion_events, 0)
+        limiter.acquire()
+        limiter.release(200, 0.2, 512)
+        self.assertEqual(limiter.congestion_events, 1)
+
+    def test_waiting_tasks_are_woken_up(self):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1, latency_factor=0)
+        limiter.acquire()
+
+        async def wait_for_slot():
+            waiting = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+            # released by another thread
+            await asyncio.get_running_loop().run_in_executor(None, limiter.release, 200, 0.01)
+            await asyncio.wait_for(waiting, timeout=1)
+
+        asyncio.run(wait_for_slot())
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertEqual(limiter._waiters, [])
+
+    def test_rate_limit_is_respected(self):
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, scheduler={"rate_limit": 40, "rate_burst": 1})
+            start = time.perf_counter()
+            list(nlp.pipe(make_texts(20)))
+            elapsed = time.perf_counter() - start
+            count = server.request_count
+        self.assertGreaterEqual(elapsed, (count - 1) / 40 * 0.9)
+
+    def test_adaptive_concurrency_backs_off(self):
+        with MockEntityFishingServer(latency=0.005, error_rate=0.2, seed=4) as server:
+            nlp = make_nlp(api_ef_base=server.url, scheduler={"adaptive_concurrency": True},
+                           client={"max_workers": 16, "max_retries": 8, "backoff_factor": 0.001})
+            docs = list(nlp.pipe(make_texts(60)))
+            max_in_flight = server.max_in_flight
+        stats = nlp.get_pipe("entityfishing").stats["scheduler"]
+        self.assertGreater(stats["congestion_events"], 0)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertLessEqual(max_in_flight, 16)
+        for doc in docs:
+            self.assertEqual(doc._.metadata["disambiguation_text_service"]["status_code"], 200)
+
+    def test_slot_released_on_undecodable_body(self):
+        scheduler = RequestScheduler(adaptive_concurrency=True, min_concurrency=1, max_concurrency=1)
+        client = EntityFishingClient(max_retries=0, scheduler=scheduler)
+        async_client = AsyncEntityFishingClient(max_retries=0, scheduler=scheduler)
+
+        async def arequest(url):
+            try:
+                return await async_client.request("GET", url)
+            finally:
+                await async_client.aclose()
+
+        with MockEntityFishingServer(corrupt_encoding=True) as server:
+            url = server.url + "kb/concept/123"
+            for _ in range(3):
+                with self.assertRaises(requests.exceptions.ContentDecodingError):
+                    client.request("GET", url)
+                with self.assertRaises(Exception):
+                    asyncio.run(asyncio.wait_for(arequest(url), timeout=5))
+        client.close()
+        self.assertEqual(scheduler.stats["in_flight"], 0)
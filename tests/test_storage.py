@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from spacy.tokens import Doc, DocBin
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+from spacyfishing.storage import store_key
+
+
+class TestEfStorage(unittest.TestCase):
+    def test_dicts_owned_by_each_doc(self):
+        nlp = make_nlp(api_ef_base="http://localhost:1/")
+        first, second = nlp.make_doc("A first text."), nlp.make_doc("A second text.")
+        first._.annotations["key"] = "value"
+        self.assertEqual(second._.annotations, {})
+        self.assertIsNot(first._.metadata, second._.metadata)
+        self.assertIs(first.user_data[store_key("annotations")], first._.annotations)
+        second._.metadata = {"key": "value"}
+        self.assertEqual(second._.metadata, {"key": "value"})
+        self.assertTrue(Doc.get_extension("metadata")[2] is not None)
+
+    def test_grouped_docs_and_docbin(self):
+        texts = make_texts(6)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, queries={"group_short_texts": 1000})
+            docs = list(nlp.pipe(texts, batch_size=6))
+        metadata = [doc._.metadata["disambiguation_text_service"] for doc in docs]
+        self.assertGreater(metadata[0]["grouped"], 1)
+        self.assertEqual(len({id(item) for item in metadata}), len(docs))
+
+        doc_bin = DocBin(store_user_data=True, docs=docs)
+        loaded = list(DocBin().from_bytes(doc_bin.to_bytes()).get_docs(nlp.vocab))
+        # a `DocBin` loads the lists as tuples
+        self.assertEqual(list(loaded[0]._.annotations["disambiguation_text_service"]["entities"]),
+                         docs[0]._.annotations["disambiguation_text_service"]["entities"])
+
+    def test_max_entities(self):
+        texts = make_texts(4)
+        with MockEntityFishingServer() as server:
+            nlp = make_nlp(api_ef_base=server.url, output={"annotations_max_entities": 1},
+                           queries={"incremental": True})
+            docs = list(nlp.pipe(texts))
+        for doc in docs:
+            self.assertLessEqual(len(doc._.annotations["disambiguation_text_service"]["entities"]), 1)
+            if "truncated_annotations" in doc._.metadata:
+                self.assertNotIn("fingerprint", doc._.metadata)
+            else:
+                self.assertIn("fingerprint", doc._.metadata)
+            self.assertTrue(doc._.metadata["disambiguation_text_service"]["ok"])
+        self.assertTrue(any(doc._.metadata.get("truncated_annotations", 0) > 0 for doc in docs))
+        # links are not truncated
+        self.assertTrue(all(ent._.kb_qid is not None for doc in docs for ent in doc.ents))
+
+
+if __name__ == "__main__":
+    unittest.main()
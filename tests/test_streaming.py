@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+
+import pickle
+import time
+import unittest
+
+from spacy.language import Language
+
+from spacyfishing.streaming import DocStream
+
+from tests.corpus import make_nlp, make_texts
+from tests.mock_server import MockEntityFishingServer
+
+
+@Language.component("slow_upstream")
+def slow_upstream(doc):
+    # an upstream component (eg. NER) taking 10ms per document
+    time.sleep(0.01)
+    return doc
+
+
+class TestEfStreaming(unittest.TestCase):
+    def test_streaming_pipe_keeps_order(self):
+        texts = make_texts(40)
+        with MockEntityFishingServer(latency=0.01, jitter=0.02, seed=0) as server:
+            nlp = make_nlp(api_ef_base=server.url, client={"streaming_window": 8})
+            docs = list(nlp.pipe(texts, batch_size=16))
+        self.assertEqual([doc.text for doc in docs], texts)
+        self.assertTrue(all(ent._.kb_qid is not None for doc in docs for ent in doc.ents))
+        self.assertTrue(all(doc._.metadata["timings"]["batch_size"] == 1 for doc in docs))
+
+    def test_backpressure(self):
+        pulled = []
+
+        def stream():
+            for idx in range(50):
+                pulled.append(idx)
+                yield idx
+
+        def slow(idx):
+            time.sleep(0.001 * (idx % 5))
+            return idx
+
+        streaming = DocStream(window=4)
+        results = []
+        for result in streaming.process(stream(), slow):
+            self.assertLessEqual(len(pulled) - len(results), 4)
+            results.append(result)
+        streaming.close()
+        self.assertEqual(results, list(range(50)))
+
+    def test_overlaps_upstream_components(self):
+        texts = make_texts(24)
+        durations = {}
+        with MockEntityFishingServer(latency=0.05) as server:
+            for window in (0, 8):
+                nlp = make_nlp(api_ef_base=server.url, client={"streaming_window": window})
+                nlp.add_pipe("slow_upstream", before="entityfishing")
+                nlp(texts[0])
+                start = time.perf_counter()
+                list(nlp.pipe(texts, batch_size=8))
+                durations[window] = time.perf_counter() - start
+        self.assertLess(durations[8], durations[0])
+
+    def test_pickle(self):
+        streaming = DocStream(window=2)
+        self.assertEqual(list(streaming.process(range(5), lambda idx: idx)), list(range(5)))
+        copy = pickle.loads(pickle.dumps(streaming))
+        self.assertEqual(list(copy.process(range(5), lambda idx: idx * 2)), [0, 2, 4, 6, 8])
+        streaming.close()
+        copy.close()
+
+
+if __name__ == "__main__":
+    unittest.main()